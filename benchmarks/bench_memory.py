@@ -0,0 +1,149 @@
+"""Peak memory of the structures a sync keeps per card.
+
+python benchmarks/bench_memory.py --cards 100000
+
+Each scenario runs in a fresh interpreter and reports how far its peak RSS
+rose above the RSS after setup, in MiB per 100k cards: parsing a vault,
+indexing the existing notes fetched from a fake AnkiConnect, and loading the
+local sync state. Exits non-zero if a result exceeds its
+`mib_per_100k_cards` limit in --thresholds.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from vault import write_vault
+
+THRESHOLDS = Path(__file__).with_name("thresholds.json")
+SCENARIOS = ("parse memory", "existing index memory", "state load memory")
+
+
+def _peak_mib() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _fill_anki(fake, cards: int) -> None:
+    from mdanki.anki import NOTE_FIELDS, NOTE_TYPE_NAME, make_note
+    from mdanki.parser import MarkdownCard
+
+    fake._createModel(NOTE_TYPE_NAME, NOTE_FIELDS)
+    fake._createDeck("vault")
+    for i in range(cards):
+        front = f"<p>Card {i}: what is the integral of x squared?</p>"
+        back = f"<p>The answer is {i}</p>" + "<p>Step</p>" * 40
+        source_hash = MarkdownCard.compute_hash(front)
+        fake._addNote(make_note("vault", front, back, source_hash, f"vault/{i}.md"))
+
+
+def measure(scenario: str, root: Path, cards: int) -> float:
+    """Run `scenario` in this process; return the peak RSS rise in MiB."""
+    from mdanki.parser import parse_all
+    from mdanki.state import SyncState
+
+    if scenario == "parse memory":
+        start = _peak_mib()
+        kept = parse_all(root, use_cache=False)
+    elif scenario == "existing index memory":
+        from fake_anki import FakeAnki
+        from mdanki.anki import AnkiClient
+        from mdanki.sync import get_existing_notes
+
+        with FakeAnki() as fake:
+            _fill_anki(fake, cards)
+            client = AnkiClient(url=fake.url)
+            client.find_notes("deck:vault")
+            start = _peak_mib()
+            kept = get_existing_notes(client, "vault")
+    else:
+        state = SyncState.for_root(root)
+        start = _peak_mib()
+        kept = state.load()
+    assert len(kept) == cards, len(kept)
+    return _peak_mib() - start
+
+
+def _write_state(root: Path, cards: int) -> None:
+    from mdanki.state import NoteState, SyncState
+
+    SyncState.for_root(root).save(
+        [
+            NoteState(
+                source_hash=f"{i:016x}",
+                note_id=1_000_000 + i,
+                card_ids=[2_000_000 + i],
+                deck=f"vault::topic{i % 7}::sub{i % 3}",
+                source_file=f"vault/topic{i % 7}/sub{i % 3}/file{i // 50 * 50}.md",
+                fields_digest=f"{i:032x}",
+                fingerprint=f"{i:016x}",
+            )
+            for i in range(cards)
+        ]
+    )
+
+
+def _child(*args: str) -> str:
+    return subprocess.run(
+        [sys.executable, __file__, "--child", *args],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+
+def run(cards: int) -> dict[str, float]:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir) / "vault"
+        # Set up in a child too: a forked child starts at its parent's peak RSS
+        _child("setup", str(root), "--cards", str(cards))
+        for scenario in SCENARIOS:
+            output = _child(scenario, str(root), "--cards", str(cards))
+            results[scenario] = float(output) / cards * 100_000
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cards", type=int, default=100_000)
+    parser.add_argument("--thresholds", type=Path, default=THRESHOLDS)
+    parser.add_argument(
+        "--no-check", action="store_true", help="Report without checking thresholds"
+    )
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        scenario, root = args.child
+        if scenario == "setup":
+            write_vault(Path(root), args.cards)
+            _write_state(Path(root), args.cards)
+        else:
+            print(measure(scenario, Path(root), args.cards))
+        return 0
+
+    results = run(args.cards)
+    print(f"{'scenario':<22}  {'MiB per 100k cards':>18}")
+    for name, mib in results.items():
+        print(f"{name:<22}  {mib:>18.1f}")
+
+    if args.no_check:
+        return 0
+    thresholds = json.loads(args.thresholds.read_text())
+    failures = [
+        f"{name}: {mib:.1f} MiB > {thresholds[name]['mib_per_100k_cards']}"
+        for name, mib in results.items()
+        if mib > thresholds.get(name, {}).get("mib_per_100k_cards", float("inf"))
+    ]
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
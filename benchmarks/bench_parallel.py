@@ -0,0 +1,61 @@
+"""How parse + render time scales with --jobs.
+
+python benchmarks/bench_parallel.py --cards 20000 --jobs 1 2 4 8
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from mdanki.parser import parse_all
+from mdanki.render import render_many
+from vault import write_vault
+
+
+def run(root: Path, jobs: int) -> tuple[float, float, list[str]]:
+    start = time.perf_counter()
+    cards = parse_all(root, jobs=jobs)
+    parsed = time.perf_counter()
+    html = render_many(
+        [text for card in cards for text in (card.front_raw, card.back_raw)], jobs
+    )
+    return parsed - start, time.perf_counter() - parsed, html
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cards", type=int, default=10_000)
+    parser.add_argument("--cards-per-file", type=int, default=50)
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        nargs="+",
+        default=sorted({1, 2, 4, os.cpu_count() or 1}),
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir) / "vault"
+        write_vault(root, args.cards, args.cards_per_file)
+
+        print(f"{args.cards} cards, {os.cpu_count()} CPUs")
+        print(f"{'jobs':>4}  {'parse s':>8}  {'render s':>8}  {'total s':>8}  speedup")
+        baseline = None
+        expected = None
+        for jobs in args.jobs:
+            parse_s, render_s, html = run(root, jobs)
+            if expected is None:
+                expected = html
+            assert html == expected, f"--jobs {jobs} output differs"
+            total = parse_s + render_s
+            baseline = baseline or total
+            print(
+                f"{jobs:>4}  {parse_s:>8.3f}  {render_s:>8.3f}  {total:>8.3f}"
+                f"  {baseline / total:>6.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
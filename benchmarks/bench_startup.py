@@ -0,0 +1,94 @@
+"""Cold-start cost of the mdanki CLI, with regression thresholds.
+
+python benchmarks/bench_startup.py --runs 20
+
+Starts a fresh interpreter per run and reports the median milliseconds each
+scenario adds to a bare `python -c pass`. Exits non-zero if a result exceeds
+its `milliseconds` limit in --thresholds.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from vault import write_vault
+
+THRESHOLDS = Path(__file__).with_name("thresholds.json")
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+SCENARIOS = {
+    "baseline": "pass",
+    "cli import": "import mdanki.cli",
+    "cli --help": (
+        "import contextlib, io, sys; from mdanki.cli import main\n"
+        "sys.argv = ['mdanki', '--help']\n"
+        "with contextlib.redirect_stdout(io.StringIO()), "
+        "contextlib.suppress(SystemExit): main()"
+    ),
+    "parse command": (
+        "import contextlib, io, sys; from mdanki.cli import main\n"
+        "sys.argv = ['mdanki', 'parse', '--no-cache', sys.argv[1]]\n"
+        "with contextlib.redirect_stdout(io.StringIO()): main()"
+    ),
+}
+
+
+def time_run(code: str, vault: Path) -> float:
+    env = {**os.environ, "PYTHONPATH": str(SRC), "PYTHONDONTWRITEBYTECODE": ""}
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code, str(vault)], env=env, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def run(runs: int) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        vault = Path(tmpdir) / "vault"
+        write_vault(vault, 20)
+        # One untimed pass of each, so bytecode is compiled and cached
+        for code in SCENARIOS.values():
+            time_run(code, vault)
+        samples: dict[str, list[float]] = {name: [] for name in SCENARIOS}
+        # Interleaved, so machine noise hits every scenario alike
+        for _ in range(runs):
+            for name, code in SCENARIOS.items():
+                samples[name].append(time_run(code, vault))
+    medians = {name: statistics.median(times) for name, times in samples.items()}
+    baseline = medians.pop("baseline")
+    return {name: ms - baseline for name, ms in medians.items()}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--thresholds", type=Path, default=THRESHOLDS)
+    parser.add_argument(
+        "--no-check", action="store_true", help="Report without checking thresholds"
+    )
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    print(f"{'scenario':<14}  {'ms over python':>14}")
+    for name, ms in results.items():
+        print(f"{name:<14}  {ms:>14.1f}")
+
+    if args.no_check:
+        return 0
+    thresholds = json.loads(args.thresholds.read_text())
+    failures = [
+        f"{name}: {ms:.1f} ms > {thresholds[name]['milliseconds']}"
+        for name, ms in results.items()
+        if ms > thresholds.get(name, {}).get("milliseconds", float("inf"))
+    ]
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""Sync cost against a fake AnkiConnect server, with regression thresholds.
+
+python benchmarks/bench_sync.py --cards 1000 10000 100000 --latency 0.002
+
+Reports wall time, AnkiConnect requests and bytes transferred for parsing,
+rendering, a first sync, a no-op sync and a sync after editing a share of the
+files. Exits non-zero if a result exceeds its limit in --thresholds.
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+from fake_anki import FakeAnki
+from mdanki.anki import AnkiClient
+from mdanki.parser import parse_all
+from mdanki.render import render_many
+from mdanki.sync import sync
+from vault import write_vault
+
+THRESHOLDS = Path(__file__).with_name("thresholds.json")
+
+
+@dataclass
+class Result:
+    scenario: str
+    cards: int
+    seconds: float
+    requests: int
+    bytes: int
+
+
+def measure(
+    scenario: str, cards: int, fake: FakeAnki | None, fn: Callable[[], object]
+) -> Result:
+    if fake:
+        fake.reset_counters()
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    requests = sum(fake.requests.values()) if fake else 0
+    transferred = fake.bytes_in + fake.bytes_out if fake else 0
+    return Result(scenario, cards, seconds, requests, transferred)
+
+
+def edit_files(files: list[Path], fraction: float) -> None:
+    step = max(1, round(1 / fraction)) if fraction > 0 else len(files) + 1
+    for path in files[::step]:
+        path.write_text(path.read_text().replace("find an", "look for an"))
+
+
+def run(cards: int, latency: float, edit_fraction: float, jobs: int) -> list[Result]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir, FakeAnki(latency) as fake:
+        root = Path(tmpdir) / "vault"
+        files = write_vault(root, cards)
+        client = AnkiClient(url=fake.url)
+
+        parsed = []
+        results.append(
+            measure(
+                "parse",
+                cards,
+                None,
+                lambda: parsed.extend(parse_all(root, jobs=jobs)),
+            )
+        )
+        texts = [text for card in parsed for text in (card.front_raw, card.back_raw)]
+        results.append(measure("render", cards, None, lambda: render_many(texts, jobs)))
+
+        def sync_once() -> None:
+            stats = sync(root, client, jobs=jobs)
+            assert not stats.errors, stats.errors[:3]
+
+        results.append(measure("first sync", cards, fake, sync_once))
+        results.append(measure("no-op sync", cards, fake, sync_once))
+        edit_files(files, edit_fraction)
+        results.append(measure("edit sync", cards, fake, sync_once))
+    return results
+
+
+def check(results: list[Result], thresholds: dict) -> list[str]:
+    """Limits are per scenario: `seconds_per_1k_cards`, `requests`,
+    `requests_per_1k_cards` and `bytes_per_card`, each optional."""
+    failures = []
+    for r in results:
+        limits = thresholds.get(r.scenario, {})
+        measured = {
+            "seconds_per_1k_cards": r.seconds / r.cards * 1000,
+            "requests": r.requests,
+            "requests_per_1k_cards": r.requests / r.cards * 1000,
+            "bytes_per_card": r.bytes / r.cards,
+        }
+        for name, limit in limits.items():
+            if measured[name] > limit:
+                failures.append(
+                    f"{r.scenario} ({r.cards} cards): {name} "
+                    f"{measured[name]:.3f} > {limit}"
+                )
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cards", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added per request"
+    )
+    parser.add_argument("--edit-fraction", type=float, default=0.1)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--thresholds", type=Path, default=THRESHOLDS)
+    parser.add_argument(
+        "--no-check", action="store_true", help="Report without checking thresholds"
+    )
+    args = parser.parse_args()
+
+    results = []
+    print(
+        f"{'scenario':<12}  {'cards':>7}  {'wall s':>8}  {'requests':>8}  {'KiB':>10}"
+    )
+    for cards in args.cards:
+        for r in run(cards, args.latency, args.edit_fraction, args.jobs):
+            results.append(r)
+            print(
+                f"{r.scenario:<12}  {r.cards:>7}  {r.seconds:>8.3f}"
+                f"  {r.requests:>8}  {r.bytes / 1024:>10.1f}"
+            )
+
+    if args.no_check:
+        return 0
+    thresholds = json.loads(args.thresholds.read_text())
+    failures = check(results, thresholds)
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+"""An in-process stand-in for AnkiConnect, for benchmarks that run without Anki.
+
+It implements the actions AnkiClient sends, keeps notes in memory, and counts
+requests and bytes per action. `latency` seconds are added to every request.
+"""
+
+import base64
+import fnmatch
+import functools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[()]|[^\s()"]+(?:"(?:[^"\\]|\\.)*")?')
+
+
+def _parse_query(query: str) -> list[list[tuple[str, str]]]:
+    """Split a search into AND-ed clauses of OR-ed (field, pattern) terms.
+
+    Covers what AnkiClient sends: plain and quoted `field:value` terms, `OR`,
+    and one level of parentheses.
+    """
+    clauses: list[list[tuple[str, str]]] = []
+    group: list[tuple[str, str]] | None = None
+    join = False
+    for token in _TOKEN.findall(query):
+        if token == "(":
+            group = []
+        elif token == ")":
+            clauses.append(group or [])
+            group = None
+        elif token == "OR":
+            join = True
+        else:
+            # Drop the quoting but keep escaped quotes inside the value
+            term = re.sub(r'\\.|"', lambda m: "" if m[0] == '"' else m[0], token)
+            key, _, value = term.partition(":")
+            if group is not None:
+                group.append((key.lower(), value))
+            elif join and clauses:
+                clauses[-1].append((key.lower(), value))
+            else:
+                clauses.append([(key.lower(), value)])
+            join = False
+    return clauses
+
+
+@functools.cache
+def _pattern(value: str) -> re.Pattern[str]:
+    # Anki wildcards: * for any run, _ for one character, backslash escapes
+    parts = re.findall(r"\\.|.", value)
+    return re.compile(
+        "".join(
+            re.escape(p[1])
+            if p.startswith("\\")
+            else ".*"
+            if p == "*"
+            else "."
+            if p == "_"
+            else re.escape(p)
+            for p in parts
+        ),
+        re.IGNORECASE | re.DOTALL,
+    )
+
+
+class FakeAnki:
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        # Field names by model
+        self.models: dict[str, list[str]] = {}
+        self.decks: dict[str, int] = {"Default": 1}
+        self.notes: dict[int, dict[str, Any]] = {}
+        self.cards: dict[int, dict[str, Any]] = {}
+        self.media: dict[str, bytes] = {}
+        # Note IDs by SourceHash, so hash lookups do not scan every note
+        self.by_hash: dict[str, set[int]] = {}
+        self.requests: Counter[str] = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._next_id = 1_000_000
+        # Stands in for Anki's modification times, which only have second
+        # resolution there
+        self._mod = 0
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+
+    @property
+    def url(self) -> str:
+        assert self._server is not None
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeAnki":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if fake.latency:
+                    time.sleep(fake.latency)
+                reply = json.dumps(fake.handle(json.loads(body))).encode()
+                with fake._lock:
+                    fake.bytes_in += len(body)
+                    fake.bytes_out += len(reply)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        assert self._server is not None
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self) -> None:
+        self.requests.clear()
+        self.bytes_in = self.bytes_out = 0
+
+    def handle(self, payload: dict[str, Any]) -> dict[str, Any]:
+        action = payload["action"]
+        with self._lock:
+            self.requests[action] += 1
+            try:
+                result = getattr(self, f"_{action}")(**payload.get("params", {}))
+            except Exception as e:
+                return {"result": None, "error": str(e) or type(e).__name__}
+        return {"result": result, "error": None}
+
+    def _new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def _tick(self) -> int:
+        self._mod += 1
+        return self._mod
+
+    def _matches(self, note: dict[str, Any], key: str, value: str) -> bool:
+        pattern = _pattern(value)
+        if key == "note":
+            return bool(pattern.fullmatch(note["modelName"]))
+        if key == "deck":
+            decks = {self.cards[c]["deckName"] for c in note["cards"]}
+            return any(
+                pattern.fullmatch(d) or d.lower().startswith(value.lower() + "::")
+                for d in decks
+            )
+        for name, field in note["fields"].items():
+            if name.lower() == key:
+                return bool(pattern.fullmatch(field))
+        return False
+
+    def _search(self, query: str) -> list[int]:
+        clauses = _parse_query(query)
+        candidates: Any = self.notes
+        for clause in clauses:
+            if all(
+                k == "sourcehash" and not re.search(r"[*_\\]", v) for k, v in clause
+            ):
+                candidates = sorted(
+                    {nid for _, v in clause for nid in self.by_hash.get(v, ())}
+                )
+                break
+        return [
+            nid
+            for nid in candidates
+            if all(
+                any(self._matches(self.notes[nid], k, v) for k, v in c) for c in clauses
+            )
+        ]
+
+    def _version(self) -> int:
+        return 6
+
+    def _multi(self, actions: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        results = []
+        for action in actions:
+            try:
+                method = getattr(self, f"_{action['action']}")
+                results.append(
+                    {"result": method(**action.get("params", {})), "error": None}
+                )
+            except Exception as e:
+                results.append({"result": None, "error": str(e)})
+        return results
+
+    def _modelNames(self) -> list[str]:
+        return sorted(self.models)
+
+    def _createModel(
+        self, modelName: str, inOrderFields: list[str], **_: Any
+    ) -> dict[str, Any]:
+        self.models[modelName] = list(inOrderFields)
+        return {"name": modelName}
+
+    def _modelFieldNames(self, modelName: str) -> list[str]:
+        if modelName not in self.models:
+            raise ValueError(f"model was not found: {modelName}")
+        return self.models[modelName]
+
+    def _modelFieldAdd(self, modelName: str, fieldName: str, index: int) -> None:
+        self.models[modelName].insert(index, fieldName)
+        for note in self.notes.values():
+            if note["modelName"] == modelName:
+                note["fields"].setdefault(fieldName, "")
+
+    def _deckNames(self) -> list[str]:
+        return sorted(self.decks)
+
+    def _createDeck(self, deck: str) -> int:
+        parts = deck.split("::")
+        for i in range(1, len(parts) + 1):
+            self.decks.setdefault("::".join(parts[:i]), self._new_id())
+        return self.decks[deck]
+
+    def _deleteDecks(self, decks: list[str], cardsToo: bool = False) -> None:
+        for deck in decks:
+            for name in [
+                d for d in self.decks if d == deck or d.startswith(deck + "::")
+            ]:
+                del self.decks[name]
+        cards = {
+            c for c, card in self.cards.items() if card["deckName"] not in self.decks
+        }
+        for nid in [n for n, note in self.notes.items() if cards & set(note["cards"])]:
+            self._deleteNotes([nid])
+
+    def _findNotes(self, query: str) -> list[int]:
+        return self._search(query)
+
+    def _findCards(self, query: str) -> list[int]:
+        return [c for nid in self._search(query) for c in self.notes[nid]["cards"]]
+
+    def _getDecks(self, cards: list[int]) -> dict[str, list[int]]:
+        decks: dict[str, list[int]] = {}
+        for card in cards:
+            decks.setdefault(self.cards[card]["deckName"], []).append(card)
+        return decks
+
+    def _notesInfo(self, notes: list[int]) -> list[dict[str, Any]]:
+        return [
+            {
+                "noteId": nid,
+                "modelName": self.notes[nid]["modelName"],
+                "fields": {
+                    name: {"value": value, "order": i}
+                    for i, (name, value) in enumerate(self.notes[nid]["fields"].items())
+                },
+                "cards": self.notes[nid]["cards"],
+                "tags": [],
+                "mod": self.notes[nid]["mod"],
+            }
+            for nid in notes
+            if nid in self.notes
+        ]
+
+    def _cardsInfo(self, cards: list[int]) -> list[dict[str, Any]]:
+        return [{"cardId": c, **self.cards[c]} for c in cards if c in self.cards]
+
+    def _addNote(self, note: dict[str, Any]) -> int:
+        if note["deckName"] not in self.decks:
+            raise ValueError(f"deck was not found: {note['deckName']}")
+        if note["modelName"] not in self.models:
+            raise ValueError(f"model was not found: {note['modelName']}")
+        nid, cid, mod = self._new_id(), self._new_id(), self._tick()
+        self.cards[cid] = {"note": nid, "deckName": note["deckName"], "mod": mod}
+        self.notes[nid] = {
+            "modelName": note["modelName"],
+            "fields": dict(note["fields"]),
+            "cards": [cid],
+            "mod": mod,
+        }
+        self.by_hash.setdefault(note["fields"]["SourceHash"], set()).add(nid)
+        return nid
+
+    def _addNotes(self, notes: list[dict[str, Any]]) -> list[int | None]:
+        results: list[int | None] = []
+        for note in notes:
+            try:
+                results.append(self._addNote(note))
+            except ValueError:
+                results.append(None)
+        return results
+
+    def _canAddNotesWithErrorDetail(
+        self, notes: list[dict[str, Any]]
+    ) -> list[dict[str, Any]]:
+        return [
+            {"canAdd": False, "error": f"deck was not found: {n['deckName']}"}
+            if n["deckName"] not in self.decks
+            else {"canAdd": True}
+            for n in notes
+        ]
+
+    def _updateNoteFields(self, note: dict[str, Any]) -> None:
+        if note["id"] not in self.notes:
+            raise ValueError("note was not found")
+        fields = self.notes[note["id"]]["fields"]
+        old_hash = fields["SourceHash"]
+        fields.update(note["fields"])
+        self.notes[note["id"]]["mod"] = self._tick()
+        if fields["SourceHash"] != old_hash:
+            self.by_hash[old_hash].discard(note["id"])
+            self.by_hash.setdefault(fields["SourceHash"], set()).add(note["id"])
+
+    def _changeDeck(self, cards: list[int], deck: str) -> None:
+        self._createDeck(deck)
+        mod = self._tick()
+        for card in cards:
+            self.cards[card].update(deckName=deck, mod=mod)
+
+    def _notesModTime(self, notes: list[int]) -> list[dict[str, int]]:
+        if missing := [nid for nid in notes if nid not in self.notes]:
+            raise ValueError(f"note was not found: {missing[0]}")
+        return [{"noteId": nid, "mod": self.notes[nid]["mod"]} for nid in notes]
+
+    def _cardsModTime(self, cards: list[int]) -> list[dict[str, int]]:
+        if missing := [cid for cid in cards if cid not in self.cards]:
+            raise ValueError(f"card was not found: {missing[0]}")
+        return [{"cardId": cid, "mod": self.cards[cid]["mod"]} for cid in cards]
+
+    def _deleteNotes(self, notes: list[int]) -> None:
+        for nid in notes:
+            note = self.notes.pop(nid, None)
+            if note is None:
+                continue
+            self.by_hash[note["fields"]["SourceHash"]].discard(nid)
+            for card in note["cards"]:
+                self.cards.pop(card, None)
+
+    def _storeMediaFile(self, filename: str, data: str, **_: Any) -> str:
+        self.media[filename] = base64.b64decode(data)
+        return filename
+
+    def _getMediaFilesNames(self, pattern: str = "*") -> list[str]:
+        return sorted(n for n in self.media if fnmatch.fnmatchcase(n, pattern))
@@ -0,0 +1,42 @@
+"""Synthetic markdown vaults for the benchmarks."""
+
+from pathlib import Path
+
+CARD = """## Card {i}: what is $\\int_0^{{{i}}} x^2\\,dx$?
+
+The answer is $\\frac{{{i}^3}}{{3}}$, because
+
+$$
+\\int_0^a x^2\\,dx = \\left[\\frac{{x^3}}{{3}}\\right]_0^a
+$$
+
+- **Step 1**: find an antiderivative
+- **Step 2**: evaluate at the bounds
+
+```python
+def integral(a):
+    return a ** 3 / 3  # card {i}
+```
+
+"""
+
+
+def file_path(root: Path, start: int) -> Path:
+    """Where the file whose first card is `start` lives, up to three levels
+    deep."""
+    return root / f"topic{start % 7}" / f"sub{start % 3}" / f"part{start % 5}"
+
+
+def write_vault(root: Path, cards: int, cards_per_file: int = 50) -> list[Path]:
+    """Write `cards` cards, `cards_per_file` to a file, and return the files."""
+    files = []
+    for start in range(0, cards, cards_per_file):
+        directory = file_path(root, start)
+        directory.mkdir(parents=True, exist_ok=True)
+        body = "".join(
+            CARD.format(i=i) for i in range(start, min(start + cards_per_file, cards))
+        )
+        path = directory / f"file{start}.md"
+        path.write_text(body)
+        files.append(path)
+    return files
@@ -1,83 +1,607 @@
+import asyncio
+import base64
+import bisect
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
 from typing import Any
 
 import httpx
 
+from .defaults import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_FETCH_SIZE,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+)
+
 ANKI_CONNECT_URL = "http://localhost:8765"
 ANKI_CONNECT_VERSION = 6
 NOTE_TYPE_NAME = "mdanki"
+NOTE_FIELDS = ["Front", "Back", "SourceHash", "SourceFile", "Fingerprint"]
+CARD_TEMPLATE = {
+    "Name": "Card",
+    "Front": "{{Front}}",
+    "Back": "{{FrontSide}}\n<hr id=answer>\n{{Back}}",
+}
+# File bytes stored per `multi` request; a larger file goes alone
+MEDIA_BATCH_BYTES = 8 * 1024 * 1024
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# Seconds a bulk request may take before its chunks shrink; AnkiConnect runs on
+# Anki's main thread, so long requests also freeze Anki's window
+DEFAULT_TARGET_LATENCY = 1.0
+# Seconds before the first retry, doubling with each further one
+DEFAULT_RETRY_BACKOFF = 0.5
+_MAX_RETRY_BACKOFF = 8.0
+
+# Actions that leave Anki in the same state when sent twice, so they can be
+# retried after a timeout even if the first attempt reached Anki
+_IDEMPOTENT = frozenset(
+    {
+        "version",
+        "modelNames",
+        "modelFieldNames",
+        "deckNames",
+        "findNotes",
+        "findCards",
+        "notesInfo",
+        "cardsInfo",
+        "notesModTime",
+        "getDecks",
+        "getMediaFilesNames",
+        "canAddNotesWithErrorDetail",
+        "createDeck",
+        "changeDeck",
+        "updateNoteFields",
+        "deleteNotes",
+        "deleteDecks",
+        "storeMediaFile",
+    }
+)
+# Raised before the request reaches Anki, so any action can be retried
+_CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
 
 
 class AnkiConnectError(Exception):
     pass
 
 
+@dataclass
+class ActionStats:
+    """Requests sent for one AnkiConnect action. `histogram[i]` counts the
+    requests no slower than LATENCY_BUCKETS[i], the last entry those slower
+    than every bucket."""
+
+    calls: int = 0
+    # Attempts that failed with a connection error or timeout and were retried
+    retries: int = 0
+    seconds: float = 0.0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    histogram: list[int] = field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1)
+    )
+
+    def add(self, seconds: float, sent: int, received: int) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        self.bytes_sent += sent
+        self.bytes_received += received
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+
+def _action_name(action: str, params: dict[str, Any]) -> str:
+    if action == "multi":
+        inner = sorted({a["action"] for a in params.get("actions", [])})
+        return f"multi({','.join(inner)})"
+    return action
+
+
+def _payload(action: str, params: dict[str, Any]) -> dict[str, Any]:
+    payload: dict[str, Any] = {"action": action, "version": ANKI_CONNECT_VERSION}
+    if params:
+        payload["params"] = params
+    return payload
+
+
+def _unwrap(response: httpx.Response) -> Any:
+    response.raise_for_status()
+    result = response.json()
+    if error := result.get("error"):
+        raise AnkiConnectError(error)
+    return result.get("result")
+
+
+def _record_request(
+    recorders: list[dict[str, ActionStats]],
+    action: str,
+    params: dict[str, Any],
+    start: float,
+    response: httpx.Response,
+) -> None:
+    if not recorders:
+        return
+    seconds = time.perf_counter() - start
+    name = _action_name(action, params)
+    for target in recorders:
+        target.setdefault(name, ActionStats()).add(
+            seconds, len(response.request.content), len(response.content)
+        )
+
+
+def _record_retry(
+    recorders: list[dict[str, ActionStats]], action: str, params: dict[str, Any]
+) -> None:
+    name = _action_name(action, params)
+    for target in recorders:
+        target.setdefault(name, ActionStats()).retries += 1
+
+
+def _is_idempotent(action: str, params: dict[str, Any]) -> bool:
+    if action == "multi":
+        return all(a["action"] in _IDEMPOTENT for a in params["actions"])
+    return action in _IDEMPOTENT
+
+
+def _retry_errors(idempotent: bool) -> tuple[type[Exception], ...]:
+    return (httpx.TransportError,) if idempotent else _CONNECT_ERRORS
+
+
+def _backoff(base: float, attempt: int) -> float:
+    return min(base * 2**attempt, _MAX_RETRY_BACKOFF)
+
+
+class _ChunkSize:
+    """Items per request for one bulk action. Starts at `limit`, halves after
+    a request slower than `target` seconds and grows back by a quarter after
+    one faster than half of it."""
+
+    def __init__(self, limit: int, target: float) -> None:
+        self.limit = max(1, limit)
+        self.size = self.limit
+        self.target = target
+
+    def shrink(self) -> None:
+        self.size = max(1, self.size // 2)
+
+    def observe(self, seconds: float) -> None:
+        if seconds > self.target:
+            self.shrink()
+        elif seconds < self.target / 2:
+            self.size = min(self.limit, self.size + max(1, self.size // 4))
+
+
+def _multi_actions(chunk: list[tuple[str, dict[str, Any]]]) -> list[dict[str, Any]]:
+    return [
+        {"action": action, "version": ANKI_CONNECT_VERSION, "params": params}
+        for action, params in chunk
+    ]
+
+
+def _multi_results(responses: list[dict[str, Any]]) -> list[Any]:
+    return [
+        AnkiConnectError(error) if (error := r.get("error")) else r.get("result")
+        for r in responses
+    ]
+
+
+def _rejections(details: list[dict[str, Any]]) -> list[AnkiConnectError]:
+    return [
+        AnkiConnectError(detail.get("error") or "cannot create note")
+        for detail in details
+    ]
+
+
+def _decks_query(prefixes: list[str]) -> str:
+    # deck: also matches sub-decks
+    return " OR ".join(f'deck:"{prefix}"' for prefix in prefixes)
+
+
+def _empty_decks(
+    deck_names: list[str], prefixes: list[str], decks_with_cards: list[str]
+) -> list[str]:
+    """The decks under `prefixes` that hold no cards themselves or in any
+    sub-deck, deepest first."""
+    occupied = set()
+    for deck in decks_with_cards:
+        parts = deck.split("::")
+        occupied.update("::".join(parts[:i]) for i in range(1, len(parts) + 1))
+    return sorted(
+        [
+            d
+            for d in deck_names
+            if d not in occupied
+            and any(d == p or d.startswith(p + "::") for p in prefixes)
+        ],
+        key=lambda d: d.count("::"),
+        reverse=True,
+    )
+
+
+_NOTE_TYPE = {
+    "modelName": NOTE_TYPE_NAME,
+    "inOrderFields": NOTE_FIELDS,
+    "cardTemplates": [CARD_TEMPLATE],
+}
+# Read together, so checking the note type is a single request
+_NOTE_TYPE_QUERIES: list[tuple[str, dict[str, Any]]] = [
+    ("modelNames", {}),
+    ("modelFieldNames", {"modelName": NOTE_TYPE_NAME}),
+]
+
+
+def _missing_fields(fields: list[str] | None) -> list[tuple[int, str]]:
+    """The (index, name) of each NOTE_FIELDS entry an older note type lacks."""
+    if fields is None:
+        return []
+    return [(i, name) for i, name in enumerate(NOTE_FIELDS) if name not in fields]
+
+
+def make_note(
+    deck: str,
+    front: str,
+    back: str,
+    source_hash: str,
+    source_file: str,
+    fingerprint: str = "",
+) -> dict[str, Any]:
+    return {
+        "deckName": deck,
+        "modelName": NOTE_TYPE_NAME,
+        "fields": {
+            "Front": front,
+            "Back": back,
+            "SourceHash": source_hash,
+            "SourceFile": source_file,
+            "Fingerprint": fingerprint,
+        },
+    }
+
+
+def _media_batches(
+    files: list[tuple[str, Path]], limit: int
+) -> list[list[tuple[str, Path]]]:
+    batches: list[list[tuple[str, Path]]] = []
+    batch: list[tuple[str, Path]] = []
+    size = 0
+    for name, path in files:
+        file_size = path.stat().st_size
+        if batch and size + file_size > limit:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append((name, path))
+        size += file_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _store_media_actions(
+    batch: list[tuple[str, Path]],
+) -> list[tuple[str, dict[str, Any]]]:
+    return [
+        (
+            "storeMediaFile",
+            {
+                "filename": name,
+                "data": base64.b64encode(path.read_bytes()).decode("ascii"),
+            },
+        )
+        for name, path in batch
+    ]
+
+
+def _with_parents(deck: str) -> list[str]:
+    parts = deck.split("::")
+    return ["::".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+class MetadataCache:
+    """Deck and model names for the session, read through on first use and kept
+    current by the writes sent through the client."""
+
+    def __init__(self) -> None:
+        self.decks: set[str] | None = None
+        self.models: set[str] | None = None
+        # Field names of the mdanki note type
+        self.note_fields: list[str] | None = None
+
+    def clear(self) -> None:
+        self.decks = None
+        self.models = None
+        self.note_fields = None
+
+    def record(self, action: str, params: dict[str, Any], result: Any) -> None:
+        """Update the cache after `action` succeeded with `result`."""
+        match action:
+            case "deckNames":
+                self.decks = set(result)
+            case "modelNames":
+                self.models = set(result)
+            case "createDeck" | "changeDeck" if self.decks is not None:
+                # Both create the deck and any missing parents
+                self.decks.update(_with_parents(params["deck"]))
+            case "deleteDecks" if self.decks is not None:
+                for deck in params["decks"]:
+                    self.decks = {
+                        d
+                        for d in self.decks
+                        if d != deck and not d.startswith(deck + "::")
+                    }
+            case "createModel":
+                if self.models is not None:
+                    self.models.add(params["modelName"])
+                if params["modelName"] == NOTE_TYPE_NAME:
+                    self.note_fields = list(params["inOrderFields"])
+            case "modelFieldNames" if params["modelName"] == NOTE_TYPE_NAME:
+                self.note_fields = list(result)
+            case "modelFieldAdd" if params["modelName"] == NOTE_TYPE_NAME:
+                if self.note_fields is not None:
+                    self.note_fields.insert(params["index"], params["fieldName"])
+
+    def record_multi(
+        self, chunk: list[tuple[str, dict[str, Any]]], results: list[Any]
+    ) -> None:
+        for (action, params), result in zip(chunk, results):
+            if not isinstance(result, AnkiConnectError):
+                self.record(action, params, result)
+
+
 class AnkiClient:
-    def __init__(self, url: str = ANKI_CONNECT_URL) -> None:
+    """Client for AnkiConnect.
+
+    Requests that fail with a connection error, or with a timeout for
+    actions safe to repeat, are retried up to `retries` times with
+    exponential backoff. Bulk actions are sent in chunks of at most
+    `batch_size` or `fetch_size` items that shrink while requests take longer
+    than `target_latency` seconds and grow back while Anki keeps up. A chunk
+    of a repeatable action that times out is split in two instead of resent.
+    """
+
+    def __init__(
+        self,
+        url: str = ANKI_CONNECT_URL,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        fetch_size: int = DEFAULT_FETCH_SIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        target_latency: float = DEFAULT_TARGET_LATENCY,
+    ) -> None:
         self.url = url
-        self._client = httpx.Client(timeout=30.0)
+        self.batch_size = batch_size
+        self.fetch_size = fetch_size
+        self.retries = retries
+        self.retry_backoff = DEFAULT_RETRY_BACKOFF
+        self.target_latency = target_latency
+        self.metadata = MetadataCache()
+        self._recorders: list[dict[str, ActionStats]] = []
+        self._sizes: dict[str, _ChunkSize] = {}
+        self._client = httpx.Client(timeout=timeout)
+
+    @contextmanager
+    def recording(self, target: dict[str, ActionStats]) -> Iterator[None]:
+        """Record the requests sent inside the block into `target`, by action."""
+        self._recorders.append(target)
+        try:
+            yield
+        finally:
+            self._recorders.remove(target)
 
     def get_version(self) -> str:
         return str(self._request("version"))
 
     def _request(self, action: str, **params: Any) -> Any:
-        payload = {"action": action, "version": ANKI_CONNECT_VERSION}
-        if params:
-            payload["params"] = params
-        response = self._client.post(self.url, json=payload)
-        response.raise_for_status()
-        result = response.json()
-        if error := result.get("error"):
-            raise AnkiConnectError(error)
-        return result.get("result")
+        return self._send(action, params, _retry_errors(_is_idempotent(action, params)))
+
+    def _send(
+        self,
+        action: str,
+        params: dict[str, Any],
+        retry_on: tuple[type[Exception], ...],
+    ) -> Any:
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self._client.post(self.url, json=_payload(action, params))
+            except retry_on:
+                if attempt >= self.retries:
+                    raise
+                _record_retry(self._recorders, action, params)
+                time.sleep(_backoff(self.retry_backoff, attempt))
+                attempt += 1
+                continue
+            _record_request(self._recorders, action, params, start, response)
+            result = _unwrap(response)
+            self.metadata.record(action, params, result)
+            return result
+
+    def _chunk_size(self, action: str, limit: int) -> _ChunkSize:
+        size = self._sizes.get(action)
+        if size is None or size.limit != max(1, limit):
+            size = self._sizes[action] = _ChunkSize(limit, self.target_latency)
+        return size
+
+    def _chunks(
+        self,
+        action: str,
+        param: str,
+        items: list[Any],
+        limit: int,
+        wrap: Callable[[list[Any]], Any] = list,
+    ) -> Iterator[tuple[list[Any], list[Any]]]:
+        """Send `items` as `action` requests with each chunk, passed through
+        `wrap`, as `param`. Yields each chunk with its raw result list."""
+        size = self._chunk_size(action, limit)
+        start = 0
+        while start < len(items):
+            chunk = items[start : start + size.size]
+            began = time.perf_counter()
+            result = self._send_chunk(action, param, chunk, wrap, size)
+            size.observe(time.perf_counter() - began)
+            start += len(chunk)
+            yield chunk, result
+
+    def _send_chunk(
+        self,
+        action: str,
+        param: str,
+        chunk: list[Any],
+        wrap: Callable[[list[Any]], Any],
+        size: _ChunkSize,
+    ) -> list[Any]:
+        params = {param: wrap(chunk)}
+        idempotent = _is_idempotent(action, params)
+        if not idempotent or len(chunk) == 1:
+            return self._send(action, params, _retry_errors(idempotent))
+        try:
+            return self._send(action, params, _CONNECT_ERRORS)
+        except _CONNECT_ERRORS:
+            raise
+        except httpx.TransportError:
+            # Anki is struggling with the chunk, so send it as two halves
+            _record_retry(self._recorders, action, params)
+            size.shrink()
+            time.sleep(self.retry_backoff)
+            half = len(chunk) // 2
+            return self._send_chunk(
+                action, param, chunk[:half], wrap, size
+            ) + self._send_chunk(action, param, chunk[half:], wrap, size)
+
+    def multi(self, actions: list[tuple[str, dict[str, Any]]]) -> list[Any]:
+        """Send actions as `multi` requests of at most `batch_size` actions each.
+
+        Returns one entry per action, in order: the action's result, or an
+        AnkiConnectError if that action failed.
+        """
+        results: list[Any] = []
+        for chunk, responses in self._chunks(
+            "multi", "actions", actions, self.batch_size, _multi_actions
+        ):
+            chunk_results = _multi_results(responses)
+            self.metadata.record_multi(chunk, chunk_results)
+            results.extend(chunk_results)
+        return results
 
     def create_note_type_if_not_exists(self) -> None:
-        if NOTE_TYPE_NAME in self._request("modelNames"):
-            return
-        self._request(
-            "createModel",
-            modelName=NOTE_TYPE_NAME,
-            inOrderFields=["Front", "Back", "SourceHash", "SourceFile"],
-            cardTemplates=[
-                {
-                    "Name": "Card",
-                    "Front": "{{Front}}",
-                    "Back": "{{FrontSide}}\n<hr id=answer>\n{{Back}}",
-                }
-            ],
-        )
+        """Create the mdanki note type, or add the fields an older version of
+        it lacks."""
+        if self.metadata.models is None or self.metadata.note_fields is None:
+            # modelFieldNames fails while the note type does not exist yet
+            self.multi(_NOTE_TYPE_QUERIES)
+        if NOTE_TYPE_NAME not in self.get_model_names():
+            self._request("createModel", **_NOTE_TYPE)
+        for index, name in _missing_fields(self.metadata.note_fields):
+            self._request(
+                "modelFieldAdd", modelName=NOTE_TYPE_NAME, fieldName=name, index=index
+            )
+
+    def get_model_names(self) -> list[str]:
+        if self.metadata.models is None:
+            self._request("modelNames")
+        return sorted(self.metadata.models or ())
 
     def get_deck_names(self) -> list[str]:
-        return self._request("deckNames")
+        if self.metadata.decks is None:
+            self._request("deckNames")
+        return sorted(self.metadata.decks or ())
 
-    def create_deck(self, name: str) -> int:
+    def create_deck(self, name: str) -> int | None:
+        """Create a deck, returning its ID, or None if it is known to exist."""
+        if name in self.get_deck_names():
+            return None
         return self._request("createDeck", deck=name)
 
+    def create_decks(self, names: list[str]) -> list[Any]:
+        """Create the decks not known to exist in one `multi` request.
+
+        Returns one entry per name, in order: the new deck ID, None for a deck
+        that already existed, or an AnkiConnectError.
+        """
+        known = set(self.get_deck_names())
+        missing = [name for name in names if name not in known]
+        created = iter(self.multi([("createDeck", {"deck": d}) for d in missing]))
+        return [None if name in known else next(created) for name in names]
+
     def find_notes(self, query: str) -> list[int]:
         return self._request("findNotes", query=query)
 
     def get_notes_info(self, note_ids: list[int]) -> list[dict[str, Any]]:
-        return self._request("notesInfo", notes=note_ids) if note_ids else []
+        return [info for chunk in self.iter_notes_info(note_ids) for info in chunk]
 
     def get_cards_info(self, card_ids: list[int]) -> list[dict[str, Any]]:
-        return self._request("cardsInfo", cards=card_ids) if card_ids else []
+        return [info for chunk in self.iter_cards_info(card_ids) for info in chunk]
+
+    def iter_notes_info(
+        self, note_ids: list[int], chunk_size: int | None = None
+    ) -> Iterator[list[dict[str, Any]]]:
+        """Yield `notesInfo` results for at most `chunk_size` notes at a time
+        (default: `fetch_size`), so only one chunk is held in memory."""
+        yield from self._iter_chunks("notesInfo", "notes", note_ids, chunk_size)
+
+    def iter_cards_info(
+        self, card_ids: list[int], chunk_size: int | None = None
+    ) -> Iterator[list[dict[str, Any]]]:
+        """Yield `cardsInfo` results for at most `chunk_size` cards at a time
+        (default: `fetch_size`)."""
+        yield from self._iter_chunks("cardsInfo", "cards", card_ids, chunk_size)
+
+    def _iter_chunks(
+        self, action: str, param: str, ids: list[int], chunk_size: int | None
+    ) -> Iterator[list[dict[str, Any]]]:
+        for _, result in self._chunks(
+            action, param, ids, chunk_size or self.fetch_size
+        ):
+            yield result
 
     def add_note(
         self, deck: str, front: str, back: str, source_hash: str, source_file: str
     ) -> int:
         return self._request(
-            "addNote",
-            note={
-                "deckName": deck,
-                "modelName": NOTE_TYPE_NAME,
-                "fields": {
-                    "Front": front,
-                    "Back": back,
-                    "SourceHash": source_hash,
-                    "SourceFile": source_file,
-                },
-            },
+            "addNote", note=make_note(deck, front, back, source_hash, source_file)
         )
 
+    def add_notes(self, notes: list[dict[str, Any]]) -> list[Any]:
+        """Create notes with `addNotes`, at most `batch_size` notes per request.
+
+        Returns one entry per note, in order: the new note ID, or an
+        AnkiConnectError explaining why that note was not added.
+        """
+        results: list[Any] = []
+        size = self._chunk_size("addNotes", self.batch_size)
+        start = 0
+        while start < len(notes):
+            chunk = notes[start : start + size.size]
+            start += len(chunk)
+            began = time.perf_counter()
+            try:
+                note_ids = self._request("addNotes", notes=chunk)
+            except AnkiConnectError:
+                # Newer AnkiConnect versions fail the whole request if any note
+                # is rejected; retry individually to find out which ones
+                results.extend(self.multi([("addNote", {"note": n}) for n in chunk]))
+                continue
+            size.observe(time.perf_counter() - began)
+            rejected = [n for n, note_id in zip(chunk, note_ids) if note_id is None]
+            reasons = iter(self._rejection_reasons(rejected))
+            for note_id in note_ids:
+                results.append(note_id if note_id is not None else next(reasons))
+        return results
+
+    def _rejection_reasons(self, notes: list[dict[str, Any]]) -> list[AnkiConnectError]:
+        if not notes:
+            return []
+        try:
+            details = self._request("canAddNotesWithErrorDetail", notes=notes)
+        except AnkiConnectError:
+            details = [{}] * len(notes)
+        return _rejections(details)
+
     def update_note(
         self, note_id: int, front: str, back: str, source_file: str
     ) -> None:
@@ -97,17 +621,360 @@ class AnkiClient:
         if note_ids:
             self._request("deleteNotes", notes=note_ids)
 
-    def delete_empty_decks(self, prefix: str) -> list[str]:
-        deck_names = self.get_deck_names()
-        # Include root and sub-decks, delete deepest-first so parents cascade to empty
-        matching = sorted(
-            [d for d in deck_names if d == prefix or d.startswith(prefix + "::")],
-            key=lambda d: d.count("::"),
-            reverse=True,
+    def get_media_file_names(self, pattern: str = "*") -> list[str]:
+        return self._request("getMediaFilesNames", pattern=pattern)
+
+    def store_media_files(self, files: list[tuple[str, Path]]) -> list[Any]:
+        """Store local files in Anki's media folder, each under its given name.
+
+        Files are read one batch at a time and sent as `multi` requests of
+        about MEDIA_BATCH_BYTES each. Returns one entry per file, in order: the
+        stored name, or an AnkiConnectError.
+        """
+        results: list[Any] = []
+        for batch in _media_batches(files, MEDIA_BATCH_BYTES):
+            results.extend(self.multi(_store_media_actions(batch)))
+        return results
+
+    def delete_empty_decks(self, *prefixes: str) -> list[str]:
+        """Delete the empty decks among `prefixes` and their sub-decks.
+
+        Finds every card under the prefixes and the decks holding them, then
+        deletes all decks left without cards in one request.
+        """
+        if not prefixes:
+            return []
+        card_ids = self._request("findCards", query=_decks_query(list(prefixes)))
+        decks = self._request("getDecks", cards=card_ids) if card_ids else {}
+        empty = _empty_decks(self.get_deck_names(), list(prefixes), list(decks))
+        if empty:
+            self._request("deleteDecks", decks=empty, cardsToo=True)
+        return empty
+
+
+class AsyncAnkiClient:
+    """AnkiClient on `httpx.AsyncClient`, with at most `max_in_flight` requests
+    outstanding at once.
+
+    Independent reads such as info chunks run concurrently. Writes whose order
+    matters to AnkiConnect (`multi` and `addNotes` chunks, deck deletion) are
+    still sent one after another. Retries and chunk sizes adapt like
+    `AnkiClient`'s.
+    """
+
+    def __init__(
+        self,
+        url: str = ANKI_CONNECT_URL,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        fetch_size: int = DEFAULT_FETCH_SIZE,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        timeout: float = DEFAULT_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        target_latency: float = DEFAULT_TARGET_LATENCY,
+    ) -> None:
+        self.url = url
+        self.batch_size = batch_size
+        self.fetch_size = fetch_size
+        self.retries = retries
+        self.retry_backoff = DEFAULT_RETRY_BACKOFF
+        self.target_latency = target_latency
+        self._limit = asyncio.Semaphore(max(1, max_in_flight))
+        self._max_in_flight = max(1, max_in_flight)
+        self.metadata = MetadataCache()
+        self._recorders: list[dict[str, ActionStats]] = []
+        self._sizes: dict[str, _ChunkSize] = {}
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+    @contextmanager
+    def recording(self, target: dict[str, ActionStats]) -> Iterator[None]:
+        """Record the requests sent inside the block into `target`, by action."""
+        self._recorders.append(target)
+        try:
+            yield
+        finally:
+            self._recorders.remove(target)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def get_version(self) -> str:
+        return str(await self._request("version"))
+
+    async def _request(self, action: str, **params: Any) -> Any:
+        return await self._send(
+            action, params, _retry_errors(_is_idempotent(action, params))
+        )
+
+    async def _send(
+        self,
+        action: str,
+        params: dict[str, Any],
+        retry_on: tuple[type[Exception], ...],
+    ) -> Any:
+        attempt = 0
+        while True:
+            try:
+                async with self._limit:
+                    start = time.perf_counter()
+                    response = await self._client.post(
+                        self.url, json=_payload(action, params)
+                    )
+                    _record_request(self._recorders, action, params, start, response)
+            except retry_on:
+                if attempt >= self.retries:
+                    raise
+                _record_retry(self._recorders, action, params)
+                await asyncio.sleep(_backoff(self.retry_backoff, attempt))
+                attempt += 1
+                continue
+            result = _unwrap(response)
+            self.metadata.record(action, params, result)
+            return result
+
+    def _chunk_size(self, action: str, limit: int) -> _ChunkSize:
+        size = self._sizes.get(action)
+        if size is None or size.limit != max(1, limit):
+            size = self._sizes[action] = _ChunkSize(limit, self.target_latency)
+        return size
+
+    async def _timed_chunk(
+        self,
+        action: str,
+        param: str,
+        chunk: list[Any],
+        wrap: Callable[[list[Any]], Any],
+        size: _ChunkSize,
+    ) -> list[Any]:
+        began = time.perf_counter()
+        result = await self._send_chunk(action, param, chunk, wrap, size)
+        size.observe(time.perf_counter() - began)
+        return result
+
+    async def _send_chunk(
+        self,
+        action: str,
+        param: str,
+        chunk: list[Any],
+        wrap: Callable[[list[Any]], Any],
+        size: _ChunkSize,
+    ) -> list[Any]:
+        """Send one chunk like `AnkiClient._send_chunk`."""
+        params = {param: wrap(chunk)}
+        idempotent = _is_idempotent(action, params)
+        if not idempotent or len(chunk) == 1:
+            return await self._send(action, params, _retry_errors(idempotent))
+        try:
+            return await self._send(action, params, _CONNECT_ERRORS)
+        except _CONNECT_ERRORS:
+            raise
+        except httpx.TransportError:
+            _record_retry(self._recorders, action, params)
+            size.shrink()
+            await asyncio.sleep(self.retry_backoff)
+            half = len(chunk) // 2
+            first = await self._send_chunk(action, param, chunk[:half], wrap, size)
+            return first + await self._send_chunk(
+                action, param, chunk[half:], wrap, size
+            )
+
+    async def multi(self, actions: list[tuple[str, dict[str, Any]]]) -> list[Any]:
+        """Send actions as `multi` requests of at most `batch_size` actions each,
+        in order. Returns what `AnkiClient.multi` does."""
+        results: list[Any] = []
+        size = self._chunk_size("multi", self.batch_size)
+        start = 0
+        while start < len(actions):
+            chunk = actions[start : start + size.size]
+            start += len(chunk)
+            responses = await self._timed_chunk(
+                "multi", "actions", chunk, _multi_actions, size
+            )
+            chunk_results = _multi_results(responses)
+            self.metadata.record_multi(chunk, chunk_results)
+            results.extend(chunk_results)
+        return results
+
+    async def create_note_type_if_not_exists(self) -> None:
+        if self.metadata.models is None or self.metadata.note_fields is None:
+            await self.multi(_NOTE_TYPE_QUERIES)
+        if NOTE_TYPE_NAME not in await self.get_model_names():
+            await self._request("createModel", **_NOTE_TYPE)
+        for index, name in _missing_fields(self.metadata.note_fields):
+            await self._request(
+                "modelFieldAdd", modelName=NOTE_TYPE_NAME, fieldName=name, index=index
+            )
+
+    async def get_model_names(self) -> list[str]:
+        if self.metadata.models is None:
+            await self._request("modelNames")
+        return sorted(self.metadata.models or ())
+
+    async def get_deck_names(self) -> list[str]:
+        if self.metadata.decks is None:
+            await self._request("deckNames")
+        return sorted(self.metadata.decks or ())
+
+    async def create_deck(self, name: str) -> int | None:
+        if name in await self.get_deck_names():
+            return None
+        return await self._request("createDeck", deck=name)
+
+    async def create_decks(self, names: list[str]) -> list[Any]:
+        """Create the decks not known to exist, like `AnkiClient.create_decks`."""
+        known = set(await self.get_deck_names())
+        missing = [name for name in names if name not in known]
+        created = iter(await self.multi([("createDeck", {"deck": d}) for d in missing]))
+        return [None if name in known else next(created) for name in names]
+
+    async def find_notes(self, query: str) -> list[int]:
+        return await self._request("findNotes", query=query)
+
+    async def get_notes_info(self, note_ids: list[int]) -> list[dict[str, Any]]:
+        return [
+            info async for chunk in self.iter_notes_info(note_ids) for info in chunk
+        ]
+
+    async def get_cards_info(self, card_ids: list[int]) -> list[dict[str, Any]]:
+        return [
+            info async for chunk in self.iter_cards_info(card_ids) for info in chunk
+        ]
+
+    def iter_notes_info(
+        self, note_ids: list[int], chunk_size: int | None = None
+    ) -> AsyncIterator[list[dict[str, Any]]]:
+        """Yield `notesInfo` chunks in order, fetching up to `max_in_flight`
+        chunks ahead of the consumer."""
+        return self._iter_chunks("notesInfo", "notes", note_ids, chunk_size)
+
+    def iter_cards_info(
+        self, card_ids: list[int], chunk_size: int | None = None
+    ) -> AsyncIterator[list[dict[str, Any]]]:
+        """Yield `cardsInfo` chunks in order, fetching ahead like
+        `iter_notes_info`."""
+        return self._iter_chunks("cardsInfo", "cards", card_ids, chunk_size)
+
+    async def _iter_chunks(
+        self, action: str, param: str, ids: list[int], chunk_size: int | None
+    ) -> AsyncIterator[list[dict[str, Any]]]:
+        size = self._chunk_size(action, chunk_size or self.fetch_size)
+        start = 0
+        pending: deque[asyncio.Task[Any]] = deque()
+        try:
+            while True:
+                # Keep a bounded window of requests running ahead, each as
+                # large as the latency of those finished so far allows
+                while len(pending) < self._max_in_flight and start < len(ids):
+                    chunk = ids[start : start + size.size]
+                    start += len(chunk)
+                    pending.append(
+                        asyncio.ensure_future(
+                            self._timed_chunk(action, param, chunk, list, size)
+                        )
+                    )
+                if not pending:
+                    return
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def add_note(
+        self, deck: str, front: str, back: str, source_hash: str, source_file: str
+    ) -> int:
+        return await self._request(
+            "addNote", note=make_note(deck, front, back, source_hash, source_file)
+        )
+
+    async def add_notes(self, notes: list[dict[str, Any]]) -> list[Any]:
+        """Create notes with `addNotes` like `AnkiClient.add_notes`, one chunk
+        after another."""
+        results: list[Any] = []
+        size = self._chunk_size("addNotes", self.batch_size)
+        start = 0
+        while start < len(notes):
+            chunk = notes[start : start + size.size]
+            start += len(chunk)
+            began = time.perf_counter()
+            try:
+                note_ids = await self._request("addNotes", notes=chunk)
+            except AnkiConnectError:
+                results.extend(
+                    await self.multi([("addNote", {"note": n}) for n in chunk])
+                )
+                continue
+            size.observe(time.perf_counter() - began)
+            rejected = [n for n, note_id in zip(chunk, note_ids) if note_id is None]
+            reasons = iter(await self._rejection_reasons(rejected))
+            for note_id in note_ids:
+                results.append(note_id if note_id is not None else next(reasons))
+        return results
+
+    async def _rejection_reasons(
+        self, notes: list[dict[str, Any]]
+    ) -> list[AnkiConnectError]:
+        if not notes:
+            return []
+        try:
+            details = await self._request("canAddNotesWithErrorDetail", notes=notes)
+        except AnkiConnectError:
+            details = [{}] * len(notes)
+        return _rejections(details)
+
+    async def update_note(
+        self, note_id: int, front: str, back: str, source_file: str
+    ) -> None:
+        await self._request(
+            "updateNoteFields",
+            note={
+                "id": note_id,
+                "fields": {"Front": front, "Back": back, "SourceFile": source_file},
+            },
+        )
+
+    async def change_deck(self, card_ids: list[int], deck: str) -> None:
+        if card_ids:
+            await self._request("changeDeck", cards=card_ids, deck=deck)
+
+    async def delete_notes(self, note_ids: list[int]) -> None:
+        if note_ids:
+            await self._request("deleteNotes", notes=note_ids)
+
+    async def get_media_file_names(self, pattern: str = "*") -> list[str]:
+        return await self._request("getMediaFilesNames", pattern=pattern)
+
+    async def store_media_files(self, files: list[tuple[str, Path]]) -> list[Any]:
+        """Store files like `AnkiClient.store_media_files`, with up to
+        `max_in_flight` batches read and sent at once."""
+        window = asyncio.Semaphore(self._max_in_flight)
+
+        async def store(batch: list[tuple[str, Path]]) -> list[Any]:
+            async with window:
+                actions = await asyncio.to_thread(_store_media_actions, batch)
+                return await self.multi(actions)
+
+        batches = await asyncio.gather(
+            *(store(batch) for batch in _media_batches(files, MEDIA_BATCH_BYTES))
+        )
+        return [result for batch in batches for result in batch]
+
+    async def delete_empty_decks(self, *prefixes: str) -> list[str]:
+        """Delete empty decks like `AnkiClient.delete_empty_decks`, fetching the
+        deck names alongside the card lookup."""
+        if not prefixes:
+            return []
+
+        async def occupied_decks() -> list[str]:
+            card_ids = await self._request(
+                "findCards", query=_decks_query(list(prefixes))
+            )
+            return list(
+                await self._request("getDecks", cards=card_ids) if card_ids else {}
+            )
+
+        deck_names, decks = await asyncio.gather(
+            self.get_deck_names(), occupied_decks()
         )
-        deleted = []
-        for deck in matching:
-            if not self.find_notes(f'deck:"{deck}"'):
-                self._request("deleteDecks", decks=[deck], cardsToo=True)
-                deleted.append(deck)
-        return deleted
+        empty = _empty_decks(deck_names, list(prefixes), decks)
+        if empty:
+            await self._request("deleteDecks", decks=empty, cardsToo=True)
+        return empty
@@ -0,0 +1,294 @@
+import hashlib
+import json
+import re
+import sqlite3
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+from .anki import CARD_TEMPLATE, NOTE_FIELDS, NOTE_TYPE_NAME
+from .parser import MarkdownCard, parse_all
+from .render import RenderCache, fingerprint, render_many
+from .state import fingerprint_field
+
+# Fixed so every export, and every re-import, shares one mdanki note type
+MODEL_ID = int(hashlib.sha256(NOTE_TYPE_NAME.encode()).hexdigest()[:12], 16)
+DEFAULT_DECK_ID = 1
+
+_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null,
+    scm integer not null, ver integer not null, dty integer not null,
+    usn integer not null, ls integer not null, conf text not null,
+    models text not null, decks text not null, dconf text not null,
+    tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null,
+    flds text not null, sfld integer not null, csum integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null,
+    type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null,
+    ivl integer not null, lastIvl integer not null, factor integer not null,
+    time integer not null, type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+_DECK_CONF = {
+    "id": 1,
+    "name": "Default",
+    "mod": 0,
+    "usn": 0,
+    "maxTaken": 60,
+    "autoplay": True,
+    "timer": 0,
+    "replayq": True,
+    "dyn": False,
+    "new": {
+        "bury": True,
+        "delays": [1, 10],
+        "initialFactor": 2500,
+        "ints": [1, 4, 7],
+        "order": 1,
+        "perDay": 20,
+        "separate": True,
+    },
+    "lapse": {
+        "delays": [10],
+        "leechAction": 0,
+        "leechFails": 8,
+        "minInt": 1,
+        "mult": 0,
+    },
+    "rev": {
+        "bury": True,
+        "ease4": 1.3,
+        "fuzz": 0.05,
+        "ivlFct": 1,
+        "maxIvl": 36500,
+        "minSpace": 1,
+        "perDay": 100,
+    },
+}
+
+_COL_CONF = {
+    "activeDecks": [DEFAULT_DECK_ID],
+    "curDeck": DEFAULT_DECK_ID,
+    "newSpread": 0,
+    "collapseTime": 1200,
+    "timeLim": 0,
+    "estTimes": True,
+    "dueCounts": True,
+    "curModel": MODEL_ID,
+    "nextPos": 1,
+    "sortType": "noteFld",
+    "sortBackwards": False,
+    "addToCur": True,
+}
+
+
+def deck_id(name: str) -> int:
+    """Stable ID for a deck, so decks keep their IDs across exports."""
+    if name == "Default":
+        return DEFAULT_DECK_ID
+    return int(hashlib.sha256(name.encode("utf-8")).hexdigest()[:12], 16)
+
+
+def _strip_html(html: str) -> str:
+    return re.sub(r"<[^>]*>", "", html).strip()
+
+
+def _model(now: int) -> dict:
+    return {
+        "id": MODEL_ID,
+        "name": NOTE_TYPE_NAME,
+        "type": 0,
+        "mod": now,
+        "usn": -1,
+        "sortf": 0,
+        "did": DEFAULT_DECK_ID,
+        "tmpls": [
+            {
+                "name": CARD_TEMPLATE["Name"],
+                "ord": 0,
+                "qfmt": CARD_TEMPLATE["Front"],
+                "afmt": CARD_TEMPLATE["Back"],
+                "did": None,
+                "bqfmt": "",
+                "bafmt": "",
+            }
+        ],
+        "flds": [
+            {
+                "name": name,
+                "ord": i,
+                "sticky": False,
+                "rtl": False,
+                "font": "Arial",
+                "size": 20,
+                "media": [],
+            }
+            for i, name in enumerate(NOTE_FIELDS)
+        ],
+        "css": ".card { font-family: arial; font-size: 20px; }",
+        "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n"
+        "\\usepackage[utf8]{inputenc}\n\\usepackage{amssymb,amsmath}\n"
+        "\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n",
+        "latexPost": "\\end{document}",
+        "latexsvg": False,
+        "tags": [],
+        "vers": [],
+        "req": [[0, "any", [0]]],
+    }
+
+
+def _decks(names: set[str], now: int) -> dict:
+    # Parents have to exist too, or Anki files sub-decks under Default
+    every = {"Default"}
+    for name in names:
+        parts = name.split("::")
+        every.update("::".join(parts[:i]) for i in range(1, len(parts) + 1))
+    return {
+        str(deck_id(name)): {
+            "id": deck_id(name),
+            "name": name,
+            "mod": now,
+            "usn": -1,
+            "lrnToday": [0, 0],
+            "revToday": [0, 0],
+            "newToday": [0, 0],
+            "timeToday": [0, 0],
+            "collapsed": False,
+            "browserCollapsed": False,
+            "desc": "",
+            "dyn": 0,
+            "conf": 1,
+            "extendNew": 0,
+            "extendRev": 0,
+        }
+        for name in sorted(every)
+    }
+
+
+def _rows(
+    cards: list[MarkdownCard], html: list[str], base_id: int, now: int
+) -> tuple[list[tuple], list[tuple]]:
+    notes: list[tuple] = []
+    card_rows: list[tuple] = []
+    seen = set()
+    for card, front, back in zip(cards, html[::2], html[1::2]):
+        if card.source_hash in seen:
+            continue
+        seen.add(card.source_hash)
+        note_id = base_id + len(notes)
+        card_fingerprint = fingerprint_field(
+            fingerprint(card.front_raw, card.back_raw), front, back
+        )
+        fields = [front, back, card.source_hash, card.source_file, card_fingerprint]
+        sort_field = _strip_html(front)
+        checksum = int(hashlib.sha1(sort_field.encode()).hexdigest()[:8], 16)
+        # (id, guid, mid, mod, usn, tags, flds, sfld, csum, flags, data)
+        notes.append(
+            (
+                note_id,
+                card.source_hash,
+                MODEL_ID,
+                now,
+                -1,
+                "",
+                "\x1f".join(fields),
+                sort_field,
+                checksum,
+                0,
+                "",
+            )
+        )
+        # (id, nid, did, mod, due); new cards are due in vault order
+        card_rows.append((note_id, note_id, deck_id(card.deck), now, len(notes)))
+    return notes, card_rows
+
+
+def write_apkg(cards: list[MarkdownCard], html: list[str], output: Path) -> int:
+    """Write `cards` as mdanki notes to an Anki package at `output`.
+
+    `html` holds each card's rendered front and back, interleaved. Notes carry
+    the same fields as notes created through AnkiConnect, and their GUID is
+    the SourceHash so importing again updates them instead of duplicating.
+    Cards repeating an earlier card's SourceHash are skipped. Returns the
+    number of notes written.
+    """
+    now = int(time.time())
+    base_id = now * 1000
+    notes, card_rows = _rows(cards, html, base_id, now)
+    col = (
+        now,
+        base_id,
+        base_id,
+        json.dumps(_COL_CONF),
+        json.dumps({str(MODEL_ID): _model(now)}),
+        json.dumps(_decks({card.deck for card in cards}, now)),
+        json.dumps({"1": _DECK_CONF}),
+    )
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = Path(tmpdir) / "collection.anki2"
+        conn = sqlite3.connect(db_path)
+        try:
+            with conn:
+                conn.executescript(_SCHEMA)
+                conn.execute(
+                    "INSERT INTO col VALUES"
+                    " (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')",
+                    col,
+                )
+                conn.executemany(
+                    "INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", notes
+                )
+                conn.executemany(
+                    "INSERT INTO cards VALUES"
+                    " (?, ?, ?, 0, ?, -1, 0, 0, ?, 0, 0, 0, 0, 0, 0, 0, 0, '')",
+                    card_rows,
+                )
+        finally:
+            conn.close()
+
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as package:
+            package.write(db_path, "collection.anki2")
+            package.writestr("media", "{}")
+    return len(notes)
+
+
+def export_apkg(path: Path, output: Path, use_cache: bool = True, jobs: int = 1) -> int:
+    """Parse and render every card under `path` into an Anki package, without
+    AnkiConnect. Returns the number of notes written."""
+    cards = parse_all(path, use_cache=use_cache, jobs=jobs)
+    render_cache = RenderCache.for_root(path) if use_cache else RenderCache()
+    try:
+        html = render_many(
+            [text for card in cards for text in (card.front_raw, card.back_raw)],
+            jobs,
+            render_cache,
+        )
+    finally:
+        render_cache.close()
+    return write_apkg(cards, html, output)
@@ -1,15 +1,29 @@
 import argparse
 import sys
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from .parser import parse_all
-from .anki import AnkiClient
-from .sync import sync
+from .defaults import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_DEBOUNCE,
+    DEFAULT_FETCH_SIZE,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+)
+
+# Subcommands import what they use, so `mdanki status` or `mdanki parse` from
+# an editor or git hook does not load httpx, mistune or asyncio for nothing
+if TYPE_CHECKING:
+    from .sync import SyncStats
 
 
 def cmd_status(_args: argparse.Namespace) -> int:
+    from .anki import AnkiClient
+
     try:
-        client = AnkiClient()
+        # Report a stopped Anki at once instead of backing off and retrying
+        client = AnkiClient(retries=0)
         print(f"Connected to Anki (version {client.get_version()})")
         return 0
     except Exception as e:
@@ -21,11 +35,13 @@ def cmd_status(_args: argparse.Namespace) -> int:
 
 
 def cmd_parse(args: argparse.Namespace) -> int:
+    from .parser import parse_all
+
     path = args.path.resolve()
     if not path.is_dir():
         print(f"Path is not a directory: {path}", file=sys.stderr)
         return 1
-    cards = parse_all(path)
+    cards = parse_all(path, use_cache=not args.no_cache, jobs=args.jobs)
     print(f"Parsed {len(cards)} cards from {path}")
     for card in cards:
         print(
@@ -35,25 +51,124 @@ def cmd_parse(args: argparse.Namespace) -> int:
     return 0
 
 
-def cmd_sync(args: argparse.Namespace) -> int:
+def cmd_export(args: argparse.Namespace) -> int:
+    from .apkg import export_apkg
+
     path = args.path.resolve()
     if not path.is_dir():
         print(f"Path is not a directory: {path}", file=sys.stderr)
         return 1
+    output = args.output or Path(f"{path.name}.apkg")
+    count = export_apkg(path, output, use_cache=not args.no_cache, jobs=args.jobs)
+    print(f"Exported {count} notes to {output}")
+    return 0
+
+
+def _print_profile(stats: "SyncStats") -> None:
+    from .anki import LATENCY_BUCKETS
+
+    print(f"\n  {'Phase':<32} {'Seconds':>8}")
+    for phase, seconds in stats.phases.items():
+        print(f"  {phase:<32} {seconds:>8.3f}")
+    print(f"  {'total':<32} {sum(stats.phases.values()):>8.3f}")
+
+    buckets = [f"<={b * 1000:g}ms" for b in LATENCY_BUCKETS] + ["slower"]
+    print(
+        f"\n  {'AnkiConnect action':<24} {'Calls':>5} {'Seconds':>8}"
+        f" {'Sent KiB':>9} {'Recv KiB':>9}  Latency"
+    )
+    for action, s in sorted(stats.requests.items(), key=lambda i: -i[1].seconds):
+        histogram = " ".join(
+            f"{bucket}:{count}" for bucket, count in zip(buckets, s.histogram) if count
+        )
+        print(
+            f"  {action:<24} {s.calls:>5} {s.seconds:>8.3f}"
+            f" {s.bytes_sent / 1024:>9.1f} {s.bytes_received / 1024:>9.1f}  {histogram}"
+        )
+
 
-    client = AnkiClient()
+def _write_stats_json(stats: "SyncStats", target: str) -> None:
+    import json
+    from dataclasses import asdict
+
+    from .anki import LATENCY_BUCKETS
+
+    data = asdict(stats)
+    data["latency_buckets"] = list(LATENCY_BUCKETS)
+    text = json.dumps(data, indent=2)
+    if target == "-":
+        print(text)
+    else:
+        Path(target).write_text(text + "\n", encoding="utf-8")
+
+
+async def _sync_async(args: argparse.Namespace, options: dict) -> "SyncStats":
+    from .anki import AsyncAnkiClient
+    from .sync import async_sync
+
+    client = AsyncAnkiClient(
+        batch_size=args.batch_size,
+        fetch_size=args.fetch_size,
+        max_in_flight=args.max_in_flight,
+        timeout=args.timeout,
+        retries=args.retries,
+    )
+    try:
+        return await async_sync(client=client, **options)
+    finally:
+        await client.aclose()
+
+
+def cmd_sync(args: argparse.Namespace) -> int:
+    import asyncio
+
+    from .anki import AnkiClient
+    from .sync import sync, sync_roots, sync_subtree
+
+    paths = [path.resolve() for path in args.paths]
+    for path in paths:
+        if not path.is_dir():
+            print(f"Path is not a directory: {path}", file=sys.stderr)
+            return 1
+    if args.use_async and len(paths) > 1:
+        print("--async syncs one path at a time", file=sys.stderr)
+        return 1
+    only = [p.resolve() for p in args.only or []]
+    if only and (len(paths) > 1 or args.use_async):
+        print("--only takes a single path without --async", file=sys.stderr)
+        return 1
+    if only and args.full:
+        print("--full cannot be combined with --only", file=sys.stderr)
+        return 1
 
     if args.dry_run:
         print("Dry run - no changes will be made\n")
 
+    options = dict(
+        dry_run=args.dry_run,
+        verbose=args.verbose,
+        delete=args.delete,
+        full=args.full,
+        use_cache=not args.no_cache,
+        jobs=args.jobs,
+    )
     try:
-        stats = sync(
-            path=path,
-            client=client,
-            dry_run=args.dry_run,
-            verbose=args.verbose,
-            delete=args.delete,
-        )
+        if args.use_async:
+            stats = asyncio.run(_sync_async(args, dict(path=paths[0], **options)))
+        else:
+            client = AnkiClient(
+                batch_size=args.batch_size,
+                fetch_size=args.fetch_size,
+                timeout=args.timeout,
+                retries=args.retries,
+            )
+            if only:
+                del options["full"]  # rejected above
+                stats = sync_subtree(paths[0], client=client, only=only, **options)
+            elif len(paths) > 1:
+                stats = sync_roots(paths, client=client, **options)
+            else:
+                stats = sync(paths[0], client=client, **options)
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         return 1
@@ -63,11 +178,74 @@ def cmd_sync(args: argparse.Namespace) -> int:
     print(f"Updated: {stats.updated}")
     print(f"Moved: {stats.moved}")
     print(f"Deleted: {stats.deleted}")
+    print(f"Media stored: {stats.media}")
     if stats.errors:
         print(f"Errors: {len(stats.errors)}")
         for err in stats.errors:
             print(f"  - {err}")
 
+    if args.profile:
+        _print_profile(stats)
+    if args.stats_json:
+        _write_stats_json(stats, args.stats_json)
+
+    return 0
+
+
+def _print_batch(stats: "SyncStats", files: int) -> None:
+    print(
+        f"Synced {files} changed path(s): {stats.created} created, "
+        f"{stats.updated} updated, {stats.moved} moved, {stats.deleted} deleted, "
+        f"{stats.media} media stored"
+    )
+    for err in stats.errors:
+        print(f"  - {err}")
+
+
+def cmd_watch(args: argparse.Namespace) -> int:
+    from .anki import AnkiClient
+    from .state import SyncState
+    from .sync import sync, sync_files
+    from .watch import watch_changes
+
+    path = args.path.resolve()
+    if not path.is_dir():
+        print(f"Path is not a directory: {path}", file=sys.stderr)
+        return 1
+
+    client = AnkiClient(
+        batch_size=args.batch_size, timeout=args.timeout, retries=args.retries
+    )
+    options = dict(verbose=args.verbose, delete=args.delete)
+    state = SyncState.for_root(path)
+
+    try:
+        stats = sync(path, client, **options)
+        known = state.load()
+        print(f"Watching {path} ({stats.total} notes), press Ctrl+C to stop")
+        for changed in watch_changes(path, debounce=args.debounce, poll=args.poll):
+            try:
+                if changed is None:
+                    # Events were lost, so fall back to a full reconcile
+                    client.metadata.clear()
+                    stats = sync(path, client, full=True, **options)
+                    known = state.load()
+                    _print_batch(stats, 0)
+                else:
+                    stats = sync_files(path, client, changed, known, **options)
+                    _print_batch(stats, len(changed))
+                if stats.errors:
+                    # Decks may have been changed in Anki behind our back
+                    client.metadata.clear()
+            except Exception as e:
+                # Keep watching; the next batch or rescan picks the change up
+                client.metadata.clear()
+                print(f"Error: {e}", file=sys.stderr)
+    except KeyboardInterrupt:
+        return 0
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
     return 0
 
 
@@ -91,6 +269,18 @@ def main() -> int:
         type=Path,
         help="Path to directory with markdown files",
     )
+    parse_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-parse every file instead of reusing cached results",
+    )
+    parse_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Parse on this many processes (default: 1)",
+    )
     parse_parser.set_defaults(func=cmd_parse)
 
     sync_parser = subparsers.add_parser(
@@ -98,9 +288,11 @@ def main() -> int:
         help="Sync markdown files to Anki",
     )
     sync_parser.add_argument(
-        "path",
+        "paths",
         type=Path,
-        help="Path to directory with markdown files",
+        nargs="+",
+        metavar="path",
+        help="Path to directory with markdown files; several are synced in one run",
     )
     sync_parser.add_argument(
         "-n",
@@ -119,7 +311,163 @@ def main() -> int:
         action="store_true",
         help="Delete notes in Anki that are no longer in markdown",
     )
+    sync_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Reconcile against every note in Anki instead of the local sync state",
+    )
+    sync_parser.add_argument(
+        "--only",
+        type=Path,
+        nargs="+",
+        metavar="PATH",
+        help="Sync only these files or directories inside the path, without "
+        "scanning the rest of it",
+    )
+    sync_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-parse every file instead of reusing cached results",
+    )
+    sync_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Parse and render on this many processes (default: 1)",
+    )
+    sync_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Max actions per AnkiConnect request (default: {DEFAULT_BATCH_SIZE})",
+    )
+    sync_parser.add_argument(
+        "--fetch-size",
+        type=int,
+        default=DEFAULT_FETCH_SIZE,
+        help=f"Max IDs per notesInfo/cardsInfo request (default: {DEFAULT_FETCH_SIZE})",
+    )
+    sync_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help=f"Seconds to wait for each AnkiConnect request (default: {DEFAULT_TIMEOUT})",
+    )
+    sync_parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="Times to retry a request that failed to connect or timed out "
+        f"(default: {DEFAULT_RETRIES})",
+    )
+    sync_parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Overlap AnkiConnect reads with each other and with parsing",
+    )
+    sync_parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help="Max concurrent AnkiConnect requests with --async "
+        f"(default: {DEFAULT_MAX_IN_FLIGHT})",
+    )
+    sync_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print time per sync phase and per AnkiConnect action",
+    )
+    sync_parser.add_argument(
+        "--stats-json",
+        metavar="FILE",
+        help="Write the sync counts, phase timings and request stats as JSON "
+        "to FILE (- for stdout)",
+    )
     sync_parser.set_defaults(func=cmd_sync)
 
+    export_parser = subparsers.add_parser(
+        "export",
+        help="Write markdown files to an Anki package without AnkiConnect",
+    )
+    export_parser.add_argument(
+        "path",
+        type=Path,
+        help="Path to directory with markdown files",
+    )
+    export_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="Package to write (default: <directory name>.apkg)",
+    )
+    export_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-parse and re-render every card instead of reusing cached results",
+    )
+    export_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Parse and render on this many processes (default: 1)",
+    )
+    export_parser.set_defaults(func=cmd_export)
+
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Sync markdown files to Anki whenever they change",
+    )
+    watch_parser.add_argument(
+        "path",
+        type=Path,
+        help="Path to directory with markdown files",
+    )
+    watch_parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Show detailed output",
+    )
+    watch_parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="Delete notes in Anki whose cards were removed from a changed file",
+    )
+    watch_parser.add_argument(
+        "--debounce",
+        type=float,
+        default=DEFAULT_DEBOUNCE,
+        help="Seconds to wait for a burst of saves to settle "
+        f"(default: {DEFAULT_DEBOUNCE})",
+    )
+    watch_parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="Poll the tree for changes instead of using inotify",
+    )
+    watch_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Max actions per AnkiConnect request (default: {DEFAULT_BATCH_SIZE})",
+    )
+    watch_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help=f"Seconds to wait for each AnkiConnect request (default: {DEFAULT_TIMEOUT})",
+    )
+    watch_parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="Times to retry a request that failed to connect or timed out "
+        f"(default: {DEFAULT_RETRIES})",
+    )
+    watch_parser.set_defaults(func=cmd_watch)
+
     args = parser.parse_args()
     return args.func(args)
@@ -0,0 +1,8 @@
+# Defaults the CLI shows in its help. Kept free of imports so building the
+# argument parser does not load httpx, mistune or asyncio.
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FETCH_SIZE = 1000
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_DEBOUNCE = 0.1
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_RETRIES = 3
@@ -0,0 +1,95 @@
+import hashlib
+import html as html_lib
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from .parser import MarkdownCard
+from .state import MediaState
+
+# Prefix of the Anki media files mdanki stores, so they can be listed apart
+MEDIA_PREFIX = "mdanki-"
+
+_IMG_SRC = re.compile(r'(<img\b[^>]*?\bsrc=")([^"]*)(")')
+
+
+def media_name(data: bytes, suffix: str) -> str:
+    """Anki media file name for `data`; files with the same contents share it."""
+    digest = hashlib.sha256(data).hexdigest()[:24]
+    return f"{MEDIA_PREFIX}{digest}{html_lib.escape(suffix.lower())}"
+
+
+def _local_path(src: str, directory: Path) -> str | None:
+    url = urlsplit(html_lib.unescape(src))
+    if url.scheme or url.netloc or not url.path:
+        return None
+    return os.path.abspath(directory / unquote(url.path))
+
+
+@dataclass
+class LinkedMedia:
+    """Card HTML pointing at Anki media files, and the local files it uses."""
+
+    html: list[str]
+    # By absolute path
+    files: dict[str, MediaState] = field(default_factory=dict)
+    # (SourceFile, src) of each image whose file was not found
+    missing: list[tuple[str, str]] = field(default_factory=list)
+
+
+def link_media(
+    root: Path,
+    cards: list[MarkdownCard],
+    html: list[str],
+    known: dict[str, MediaState],
+) -> LinkedMedia:
+    """Point the local `<img>` sources in each card's HTML at Anki media files.
+
+    `html` holds each card's rendered front and back, interleaved. Sources are
+    resolved against the card's markdown file and renamed after the file's
+    contents, so an image used by many cards is stored once. Files whose
+    size and mtime match their entry in `known` are not read again. URLs and
+    missing files are left as they are.
+    """
+    linked = LinkedMedia(html=[])
+    names: dict[str, str | None] = {}
+
+    def name_for(path: str) -> str | None:
+        if path in names:
+            return names[path]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            names[path] = None
+            return None
+        entry = known.get(path)
+        if entry is None or (entry.mtime_ns, entry.size) != (
+            stat.st_mtime_ns,
+            stat.st_size,
+        ):
+            name = media_name(Path(path).read_bytes(), Path(path).suffix)
+            entry = MediaState(path, stat.st_mtime_ns, stat.st_size, name)
+        linked.files[path] = entry
+        names[path] = entry.name
+        return entry.name
+
+    for i, text in enumerate(html):
+        card = cards[i // 2]
+        if "<img" in text:
+            directory = root.parent / Path(card.source_file).parent
+
+            def relink(match: re.Match[str]) -> str:
+                path = _local_path(match[2], directory)
+                if path is None:
+                    return match[0]
+                name = name_for(path)
+                if name is None:
+                    linked.missing.append((card.source_file, match[2]))
+                    return match[0]
+                return f"{match[1]}{name}{match[3]}"
+
+            text = _IMG_SRC.sub(relink, text)
+        linked.html.append(text)
+    return linked
@@ -0,0 +1,22 @@
+from collections.abc import Callable, Sequence
+from typing import Any
+
+
+def map_ordered(
+    fn: Callable[[Any], Any], items: Sequence[Any], jobs: int = 1
+) -> list[Any]:
+    """Apply `fn` to every item, over `jobs` worker processes when jobs > 1.
+
+    Results come back in input order, so callers get the same output as the
+    serial path. `fn` and the items must be picklable.
+    """
+    if jobs <= 1 or len(items) < 2:
+        return [fn(item) for item in items]
+    # Imported here as it pulls in multiprocessing, which serial runs never need
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = min(jobs, len(items))
+    # A few chunks per worker keeps IPC overhead low while balancing load
+    chunksize = max(1, len(items) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, items, chunksize=chunksize))
@@ -1,11 +1,20 @@
 import hashlib
-import re
+import json
 import sys
-from dataclasses import dataclass
+from collections.abc import Iterable, Iterator
+from dataclasses import asdict, dataclass
+from functools import partial
 from pathlib import Path
+from typing import Any
 
+from .parallel import map_ordered
+from .state import STATE_DIR_NAME
 
-@dataclass
+PARSE_CACHE_FILE_NAME = "parse-cache.json"
+_PARSE_CACHE_VERSION = 1
+
+
+@dataclass(slots=True)
 class MarkdownCard:
     front_raw: str
     back_raw: str
@@ -26,44 +35,184 @@ def get_deck_from_path(file_path: Path, base_path: Path) -> str:
 
 
 def parse_markdown_file(file_path: Path, base_path: Path) -> list[MarkdownCard]:
-    content = file_path.read_text(encoding="utf-8")
-    deck = get_deck_from_path(file_path, base_path)
-    relative_path = file_path.relative_to(base_path.parent)
-    source_file = str(relative_path)
+    return list(iter_cards(file_path, base_path))
 
-    heading_pattern = re.compile(r"^## (.+)$", re.MULTILINE)
-    matches = list(heading_pattern.finditer(content))
 
-    cards: list[MarkdownCard] = []
+def parse_markdown(
+    content: str, file_path: Path, base_path: Path
+) -> list[MarkdownCard]:
+    return list(_scan(content.split("\n"), file_path, base_path))
 
-    for i, match in enumerate(matches):
-        front_raw = match.group(1).strip()
 
-        start = match.end()
-        end = matches[i + 1].start() if i + 1 < len(matches) else len(content)
-        back_raw = content[start:end].strip()
+def iter_cards(file_path: Path, base_path: Path) -> Iterator[MarkdownCard]:
+    """Yield the cards of one file as it is read, holding only the card being
+    scanned in memory. Gives the same cards as `parse_markdown_file`."""
+    # Text mode applies the same newline translation as Path.read_text
+    with file_path.open(encoding="utf-8") as f:
+        yield from _scan((line.removesuffix("\n") for line in f), file_path, base_path)
 
-        if not front_raw or not back_raw:
-            continue
-
-        source_hash = MarkdownCard.compute_hash(front_raw)
-
-        cards.append(
-            MarkdownCard(
-                front_raw=front_raw,
-                back_raw=back_raw,
-                source_hash=source_hash,
-                source_file=source_file,
-                deck=deck,
-            )
-        )
 
-    return cards
+def iter_all(base_path: Path) -> Iterator[MarkdownCard]:
+    """Yield every card under `base_path` lazily, in `parse_all` order."""
+    for file_path in sorted(base_path.rglob("*.md")):
+        yield from iter_cards(file_path, base_path)
 
 
-def parse_all(base_path: Path) -> list[MarkdownCard]:
+def _scan(
+    lines: Iterable[str], file_path: Path, base_path: Path
+) -> Iterator[MarkdownCard]:
+    """Split lines into cards at `## ` headings: the heading is the front and
+    everything up to the next heading is the back. Cards with an empty front
+    or back are skipped."""
+    deck = get_deck_from_path(file_path, base_path)
+    source_file = str(file_path.relative_to(base_path.parent))
+
+    front_raw: str | None = None
+    back: list[str] = []
+
+    def card() -> MarkdownCard | None:
+        back_raw = "\n".join(back).strip()
+        if not front_raw or not back_raw:
+            return None
+        return MarkdownCard(
+            front_raw=front_raw,
+            back_raw=back_raw,
+            source_hash=MarkdownCard.compute_hash(front_raw),
+            source_file=source_file,
+            deck=deck,
+        )
+
+    for line in lines:
+        if line.startswith("## ") and len(line) > 3:
+            if front_raw is not None and (done := card()):
+                yield done
+            front_raw = line[3:].strip()
+            back = []
+        elif front_raw is not None:
+            back.append(line)
+    if front_raw is not None and (done := card()):
+        yield done
+
+
+def _cache_key(file_path: Path, base_path: Path) -> str:
+    return file_path.relative_to(base_path).as_posix()
+
+
+def _read_entry(item: tuple[Path, str | None], base_path: Path) -> dict[str, Any]:
+    """Build a parse cache entry for a file, leaving out "cards" when its content
+    still has the cached hash."""
+    file_path, cached_hash = item
+    stat = file_path.stat()
+    data = file_path.read_bytes()
+    entry: dict[str, Any] = {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "content_hash": hashlib.sha256(data).hexdigest(),
+    }
+    if entry["content_hash"] != cached_hash:
+        # Same newline handling as Path.read_text
+        content = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+        cards = parse_markdown(content, file_path, base_path)
+        entry["cards"] = [asdict(card) for card in cards]
+    return entry
+
+
+class ParseCache:
+    """Parsed cards per file, reused while a file's (mtime_ns, size) or content
+    hash is unchanged."""
+
+    def __init__(self, path: Path, root_name: str) -> None:
+        self.path = path
+        self.root_name = root_name
+        self._entries: dict[str, dict] = {}
+        self._dirty = False
+
+    @classmethod
+    def for_root(cls, root: Path) -> "ParseCache":
+        return cls(root / STATE_DIR_NAME / PARSE_CACHE_FILE_NAME, root.name)
+
+    def load(self) -> None:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        # Cached cards embed the root's name in source_file
+        if (
+            data.get("version") == _PARSE_CACHE_VERSION
+            and data.get("root") == self.root_name
+        ):
+            self._entries = data["files"]
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": _PARSE_CACHE_VERSION,
+            "root": self.root_name,
+            "files": self._entries,
+        }
+        self.path.write_text(json.dumps(data), encoding="utf-8")
+        self._dirty = False
+
+    def parse_files(
+        self, files: list[Path], base_path: Path, jobs: int = 1
+    ) -> list[MarkdownCard]:
+        changed: list[tuple[Path, str | None]] = []
+        for file_path in files:
+            entry = self._entries.get(_cache_key(file_path, base_path))
+            stat = file_path.stat()
+            if not entry or (entry["mtime_ns"], entry["size"]) != (
+                stat.st_mtime_ns,
+                stat.st_size,
+            ):
+                changed.append((file_path, entry["content_hash"] if entry else None))
+
+        read = partial(_read_entry, base_path=base_path)
+        for (file_path, _), entry in zip(changed, map_ordered(read, changed, jobs)):
+            key = _cache_key(file_path, base_path)
+            if "cards" not in entry:
+                entry["cards"] = self._entries[key]["cards"]
+            self._entries[key] = entry
+            self._dirty = True
+
+        return [
+            MarkdownCard(**card)
+            for file_path in files
+            for card in self._entries[_cache_key(file_path, base_path)]["cards"]
+        ]
+
+    def prune(self, files: list[Path], base_path: Path) -> None:
+        """Evict entries for files that no longer exist."""
+        keep = {_cache_key(f, base_path) for f in files}
+        stale = self._entries.keys() - keep
+        for key in stale:
+            del self._entries[key]
+        self._dirty = self._dirty or bool(stale)
+
+
+def parse_all(
+    base_path: Path, use_cache: bool = False, jobs: int = 1
+) -> list[MarkdownCard]:
     files = sorted(base_path.rglob("*.md"))
     if not files:
         print(f"No markdown files found in {base_path}", file=sys.stderr)
         return []
-    return [card for f in files for card in parse_markdown_file(f, base_path)]
+    if not use_cache:
+        return parse_files(base_path, files, jobs)
+
+    cache = ParseCache.for_root(base_path)
+    cache.load()
+    cards = cache.parse_files(files, base_path, jobs)
+    cache.prune(files, base_path)
+    cache.save()
+    return cards
+
+
+def parse_files(
+    base_path: Path, files: list[Path], jobs: int = 1
+) -> list[MarkdownCard]:
+    """Parse only `files`, with decks and SourceFiles relative to `base_path`
+    as `parse_all` gives them, without walking the rest of the tree."""
+    parse = partial(parse_markdown_file, base_path=base_path)
+    return [card for cards in map_ordered(parse, files, jobs) for card in cards]
@@ -1,7 +1,24 @@
+import functools
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+
 import mistune
 from mistune.plugins.math import math as math_plugin
 from mistune.renderers.html import HTMLRenderer
 
+from .parallel import map_ordered
+from .state import STATE_DIR_NAME
+
+# Bump whenever AnkiRenderer's output changes, so cached HTML is not reused
+RENDERER_VERSION = "1"
+RENDER_CACHE_FILE_NAME = "render-cache.sqlite3"
+DEFAULT_RENDER_CACHE_SIZE = 50_000
+# Persisted entries not used for this long are dropped
+RENDER_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
 
 class AnkiRenderer(HTMLRenderer):
     def math(self, text: str) -> str:
@@ -11,8 +28,134 @@ class AnkiRenderer(HTMLRenderer):
         return rf"\[{text}\]"
 
 
-_markdown = mistune.Markdown(renderer=AnkiRenderer(), plugins=[math_plugin])
+@functools.cache
+def _markdown() -> mistune.Markdown:
+    # Built on first use rather than at import, and once per worker process
+    return mistune.Markdown(renderer=AnkiRenderer(), plugins=[math_plugin])
 
 
 def render_markdown(text: str) -> str:
-    return _markdown(text)
+    return _markdown()(text)
+
+
+def fingerprint(front: str, back: str) -> str:
+    """Digest of a card's markdown and the renderer version, which changes
+    whenever the card's rendered HTML can."""
+    versioned = f"{RENDERER_VERSION}\0{mistune.__version__}\0{front}\0{back}"
+    return hashlib.sha256(versioned.encode("utf-8")).hexdigest()[:16]
+
+
+class RenderCache:
+    """Rendered HTML keyed by the markdown text and renderer version.
+
+    Lookups go through an in-memory LRU of `maxsize` entries; when `path` is
+    set, entries are also read from and written to a SQLite file so they
+    survive across runs.
+    """
+
+    def __init__(
+        self, path: Path | None = None, maxsize: int = DEFAULT_RENDER_CACHE_SIZE
+    ) -> None:
+        self.path = path
+        self.maxsize = maxsize
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        self._pending: dict[str, str] = {}
+        self._used: set[str] = set()
+        self._conn: sqlite3.Connection | None = None
+
+    @classmethod
+    def for_root(cls, root: Path) -> "RenderCache":
+        return cls(root / STATE_DIR_NAME / RENDER_CACHE_FILE_NAME)
+
+    @staticmethod
+    def key(text: str) -> str:
+        versioned = f"{RENDERER_VERSION}\0{mistune.__version__}\0{text}"
+        return hashlib.sha256(versioned.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection | None:
+        if self.path is None:
+            return None
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS renders"
+                " (key TEXT PRIMARY KEY, html TEXT NOT NULL, used_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def _remember(self, key: str, html: str) -> None:
+        self._memory[key] = html
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: list[str]) -> dict[str, str]:
+        found: dict[str, str] = {}
+        missing: list[str] = []
+        for key in dict.fromkeys(keys):
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                found[key] = self._memory[key]
+            else:
+                missing.append(key)
+        if conn := self._connect():
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(missing), 500):
+                chunk = missing[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, html FROM renders WHERE key IN ({placeholders})",
+                    chunk,
+                )
+                for key, html in rows:
+                    found[key] = html
+                    self._remember(key, html)
+        self._used.update(found)
+        return found
+
+    def put(self, key: str, html: str) -> None:
+        self._remember(key, html)
+        self._pending[key] = html
+
+    def close(self) -> None:
+        """Write new entries to disk and drop ones unused for too long."""
+        conn = self._connect()
+        if conn is None:
+            return
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO renders VALUES (?, ?, ?)",
+                [(key, html, now) for key, html in self._pending.items()],
+            )
+            used = list(self._used - self._pending.keys())
+            for start in range(0, len(used), 500):
+                chunk = used[start : start + 500]
+                conn.execute(
+                    "UPDATE renders SET used_at = ? WHERE key IN"
+                    f" ({','.join('?' * len(chunk))})",
+                    [now, *chunk],
+                )
+            conn.execute(
+                "DELETE FROM renders WHERE used_at < ?", (now - RENDER_CACHE_MAX_AGE,)
+            )
+        conn.close()
+        self._conn = None
+        self._pending.clear()
+        self._used.clear()
+
+
+def render_many(
+    texts: list[str], jobs: int = 1, cache: RenderCache | None = None
+) -> list[str]:
+    if cache is None:
+        return map_ordered(render_markdown, texts, jobs)
+    keys = [RenderCache.key(text) for text in texts]
+    found = cache.get_many(keys)
+    missing = list({k: t for k, t in zip(keys, texts) if k not in found}.items())
+    rendered = map_ordered(render_markdown, [text for _, text in missing], jobs)
+    for (key, _), html in zip(missing, rendered):
+        cache.put(key, html)
+        found[key] = html
+    return [found[key] for key in keys]
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import sqlite3
+import sys
+from collections.abc import Sequence
+from dataclasses import dataclass
+from pathlib import Path
+
+STATE_DIR_NAME = ".mdanki"
+STATE_FILE_NAME = "state.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    source_hash TEXT PRIMARY KEY,
+    note_id INTEGER NOT NULL,
+    card_ids TEXT NOT NULL,
+    deck TEXT NOT NULL,
+    source_file TEXT NOT NULL,
+    fields_digest TEXT NOT NULL,
+    fingerprint TEXT NOT NULL DEFAULT '',
+    back_digest TEXT NOT NULL DEFAULT '',
+    mod INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS media_files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS media_stored (name TEXT PRIMARY KEY);
+"""
+
+
+def fields_digest(front: str, back: str) -> str:
+    return hashlib.sha256(f"{front}\0{back}".encode("utf-8")).hexdigest()[:16]
+
+
+def fingerprint_field(fingerprint: str, front: str, back: str) -> str:
+    """Value of a note's Fingerprint field: the card's markdown fingerprint
+    and the digest of the Front and Back written with it."""
+    return f"{fingerprint}:{fields_digest(front, back)}"
+
+
+def read_fingerprint_field(value: str, front: str, back: str) -> str:
+    """The markdown fingerprint in a Fingerprint field, or "" if the note's
+    Front or Back no longer holds what was written with it, as after an edit
+    made in Anki."""
+    card_fingerprint, _, digest = value.partition(":")
+    return card_fingerprint if digest == fields_digest(front, back) else ""
+
+
+def back_digest(back: str) -> str:
+    """Digest of a note's Back field alone, to recognise a card whose front
+    was edited."""
+    return hashlib.sha256(back.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass(slots=True)
+class NoteState:
+    source_hash: str
+    note_id: int
+    card_ids: list[int]
+    deck: str
+    source_file: str
+    fields_digest: str
+    fingerprint: str = ""
+    back_digest: str = ""
+    # Modification time of the note in Anki, or 0 if not known
+    mod: int = 0
+
+
+@dataclass(slots=True)
+class MediaState:
+    """A local media file as last seen, and the Anki media file name for its
+    contents."""
+
+    path: str
+    mtime_ns: int
+    size: int
+    name: str
+
+
+class SyncState:
+    """What the last sync of a root left in Anki, stored in SQLite under the root."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    @classmethod
+    def for_root(cls, root: Path) -> "SyncState":
+        return cls(root / STATE_DIR_NAME / STATE_FILE_NAME)
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.executescript(_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(notes)")}
+        # State written before notes carried these
+        for column, definition in (
+            ("fingerprint", "TEXT NOT NULL DEFAULT ''"),
+            ("back_digest", "TEXT NOT NULL DEFAULT ''"),
+            ("mod", "INTEGER NOT NULL DEFAULT 0"),
+        ):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE notes ADD COLUMN {column} {definition}")
+        return conn
+
+    def load(self, *scopes: str) -> dict[str, NoteState]:
+        """Load the stored notes, only those whose SourceFile is one of
+        `scopes` or lies under one of them if any are given."""
+        if not self.path.exists():
+            return {}
+        where, params = "", []
+        if scopes:
+            where = " WHERE " + " OR ".join(
+                ["source_file = ? OR substr(source_file, 1, ?) = ?"] * len(scopes)
+            )
+            for scope in scopes:
+                params += [scope, len(scope) + 1, scope + "/"]
+        conn = self._connect()
+        try:
+            # Built row by row, so the raw rows are never all held at once
+            return {
+                row[0]: NoteState(
+                    source_hash=row[0],
+                    note_id=row[1],
+                    card_ids=json.loads(row[2]),
+                    # Shared by every note from the same file or deck
+                    deck=sys.intern(row[3]),
+                    source_file=sys.intern(row[4]),
+                    fields_digest=row[5],
+                    fingerprint=row[6],
+                    back_digest=row[7],
+                    mod=row[8],
+                )
+                for row in conn.execute(
+                    "SELECT source_hash, note_id, card_ids, deck, source_file,"
+                    " fields_digest, fingerprint, back_digest, mod FROM notes" + where,
+                    params,
+                )
+            }
+        finally:
+            conn.close()
+
+    def count(self) -> int:
+        if not self.path.exists():
+            return 0
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+        finally:
+            conn.close()
+
+    def save(self, notes: list[NoteState]) -> None:
+        self.update(notes, clear=True)
+
+    def update(
+        self, notes: list[NoteState], removed: Sequence[str] = (), clear: bool = False
+    ) -> None:
+        """Write `notes` and drop the rows for the `removed` source hashes,
+        leaving the other rows alone unless `clear` is set."""
+        conn = self._connect()
+        try:
+            with conn:
+                if clear:
+                    conn.execute("DELETE FROM notes")
+                conn.executemany(
+                    "DELETE FROM notes WHERE source_hash = ?", [(h,) for h in removed]
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            n.source_hash,
+                            n.note_id,
+                            json.dumps(n.card_ids),
+                            n.deck,
+                            n.source_file,
+                            n.fields_digest,
+                            n.fingerprint,
+                            n.back_digest,
+                            n.mod,
+                        )
+                        for n in notes
+                    ],
+                )
+        finally:
+            conn.close()
+
+    def load_media(self) -> tuple[dict[str, MediaState], set[str]]:
+        """The media files seen by earlier syncs, by path, and the names of the
+        media files already stored in Anki."""
+        if not self.path.exists():
+            return {}, set()
+        conn = self._connect()
+        try:
+            files = conn.execute(
+                "SELECT path, mtime_ns, size, name FROM media_files"
+            ).fetchall()
+            stored = conn.execute("SELECT name FROM media_stored").fetchall()
+        finally:
+            conn.close()
+        return (
+            {row[0]: MediaState(*row) for row in files},
+            {row[0] for row in stored},
+        )
+
+    def update_media(
+        self, files: list[MediaState], stored: Sequence[str], clear: bool = False
+    ) -> None:
+        """Record `files` and add `stored` to the names stored in Anki, first
+        forgetting every stored name if `clear` is set."""
+        conn = self._connect()
+        try:
+            with conn:
+                if clear:
+                    conn.execute("DELETE FROM media_stored")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO media_files VALUES (?, ?, ?, ?)",
+                    [(f.path, f.mtime_ns, f.size, f.name) for f in files],
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO media_stored VALUES (?)",
+                    [(name,) for name in stored],
+                )
+        finally:
+            conn.close()
@@ -1,9 +1,42 @@
-from dataclasses import dataclass, field
+import asyncio
+import re
+import sys
+import time
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
 from pathlib import Path
+from typing import Any
 
-from .anki import AnkiClient, NOTE_TYPE_NAME
-from .parser import parse_all
-from .render import render_markdown
+from .anki import (
+    NOTE_TYPE_NAME,
+    ActionStats,
+    AnkiClient,
+    AnkiConnectError,
+    AsyncAnkiClient,
+    make_note,
+)
+from .media import MEDIA_PREFIX, LinkedMedia, link_media
+from .parser import (
+    MarkdownCard,
+    get_deck_from_path,
+    parse_all,
+    parse_files,
+    parse_markdown_file,
+)
+from .render import RenderCache, fingerprint, render_many
+from .state import (
+    MediaState,
+    NoteState,
+    SyncState,
+    back_digest,
+    fields_digest,
+    fingerprint_field,
+    read_fingerprint_field,
+)
+
+# SourceHash terms OR-ed into a single findNotes search
+HASH_QUERY_SIZE = 100
 
 
 @dataclass
@@ -13,39 +46,287 @@ class SyncStats:
     updated: int = 0
     moved: int = 0
     deleted: int = 0
+    # Media files stored in Anki
+    media: int = 0
     errors: list[str] = field(default_factory=list)
+    # Seconds spent in each phase of the sync, in the order they ran
+    phases: dict[str, float] = field(default_factory=dict)
+    requests: dict[str, ActionStats] = field(default_factory=dict)
 
 
-@dataclass
+class _PhaseClock:
+    """Charges the time since the previous lap to a phase in SyncStats.phases."""
+
+    def __init__(self, stats: SyncStats) -> None:
+        self.stats = stats
+        self.last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        now = time.perf_counter()
+        phases = self.stats.phases
+        phases[phase] = phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+
+@dataclass(slots=True)
 class AnkiNote:
     note_id: int
     card_ids: list[int]
     source_hash: str
     source_file: str
     deck: str
-    front: str
-    back: str
+    fields_digest: str
+    fingerprint: str = ""
+    back_digest: str = ""
+    mod: int = 0
+
+
+@dataclass(slots=True)
+class PendingWrite:
+    """A queued AnkiConnect action, the SyncStats counter it bumps on success (if
+    any) and the AnkiNote fields it changes."""
+
+    counter: str | None
+    description: str
+    action: str
+    params: dict[str, Any]
+    source_hash: str
+    changes: dict[str, Any]
 
 
 def _get_field(fields: dict, name: str) -> str:
     return fields.get(name, {}).get("value", "")
 
 
-def get_existing_notes(client: AnkiClient) -> dict[str, AnkiNote]:
-    note_ids = client.find_notes(f"note:{NOTE_TYPE_NAME}")
-    notes_info = client.get_notes_info(note_ids)
+def _escape_search(value: str) -> str:
+    return re.sub(r'([\\"*_])', r"\\\1", value)
 
-    all_card_ids = [cid for info in notes_info for cid in info.get("cards", [])]
 
-    cards_info = client.get_cards_info(all_card_ids)
-    card_to_deck = {card["cardId"]: card["deckName"] for card in cards_info}
+def scope_query(*base_dirs: str) -> str:
+    """Search for the mdanki notes whose SourceFile lies under any of
+    `base_dirs`."""
+    terms = " OR ".join(f'"SourceFile:{_escape_search(d)}/*"' for d in base_dirs)
+    return f"note:{NOTE_TYPE_NAME} {terms if len(base_dirs) == 1 else f'({terms})'}"
 
-    existing: dict[str, AnkiNote] = {}
 
+def _record_decks(decks: list[str], results: list[Any], stats: SyncStats) -> None:
+    for deck, result in zip(decks, results):
+        if isinstance(result, AnkiConnectError):
+            stats.errors.append(f"Failed to create deck '{deck}': {result}")
+
+
+def _record_writes(
+    writes: list[PendingWrite],
+    results: list[Any],
+    stats: SyncStats,
+    notes: dict[str, AnkiNote],
+) -> None:
+    for write, result in zip(writes, results):
+        if isinstance(result, AnkiConnectError):
+            stats.errors.append(f"{write.description}: {result}")
+            continue
+        if write.counter:
+            setattr(stats, write.counter, getattr(stats, write.counter) + 1)
+        # The write changed the note's mod time, to be read back before saving
+        notes[write.source_hash] = replace(
+            notes[write.source_hash], **write.changes, mod=0
+        )
+
+
+def _record_creates(
+    creates: list[tuple[MarkdownCard, dict[str, Any]]],
+    results: list[Any],
+    stats: SyncStats,
+    notes: dict[str, AnkiNote],
+) -> dict[int, MarkdownCard]:
+    """Index created notes and return the new note IDs, whose card IDs are
+    still to be filled in."""
+    created: dict[int, MarkdownCard] = {}
+    for (card, note), result in zip(creates, results):
+        if isinstance(result, AnkiConnectError):
+            stats.errors.append(f"Failed to create '{card.front_raw[:50]}': {result}")
+            continue
+        stats.created += 1
+        fields = note["fields"]
+        notes[card.source_hash] = AnkiNote(
+            note_id=result,
+            card_ids=[],
+            source_hash=card.source_hash,
+            source_file=card.source_file,
+            deck=card.deck,
+            fields_digest=fields_digest(fields["Front"], fields["Back"]),
+            fingerprint=read_fingerprint_field(
+                fields["Fingerprint"], fields["Front"], fields["Back"]
+            ),
+            back_digest=back_digest(fields["Back"]),
+        )
+        created[result] = card
+    return created
+
+
+def _record_card_ids(
+    notes_info: list[dict[str, Any]],
+    created: dict[int, MarkdownCard],
+    notes: dict[str, AnkiNote],
+) -> None:
+    for info in notes_info:
+        notes[created[info["noteId"]].source_hash].card_ids = info.get("cards", [])
+
+
+def _apply_writes(
+    client: AnkiClient,
+    writes: list[PendingWrite],
+    stats: SyncStats,
+    dry_run: bool,
+    notes: dict[str, AnkiNote],
+) -> None:
+    if dry_run:
+        results: list[Any] = [None] * len(writes)
+    else:
+        results = client.multi([(write.action, write.params) for write in writes])
+    _record_writes(writes, results, stats, notes)
+
+
+def _apply_creates(
+    client: AnkiClient,
+    creates: list[tuple[MarkdownCard, dict[str, Any]]],
+    stats: SyncStats,
+    dry_run: bool,
+    notes: dict[str, AnkiNote],
+) -> None:
+    if dry_run:
+        stats.created += len(creates)
+        return
+    results = client.add_notes([note for _, note in creates])
+    created = _record_creates(creates, results, stats, notes)
+    _record_card_ids(client.get_notes_info(list(created)), created, notes)
+
+
+def _load_existing(
+    client: AnkiClient, base_dirs: list[str], known: dict[str, NoteState], full: bool
+) -> dict[str, AnkiNote]:
+    """Use the local state of the roots in `base_dirs` as the existing-note
+    index unless a full reconcile was asked for or the notes in Anki no longer
+    match it.
+
+    One request lists the note IDs under the roots, the mod times of the known
+    notes and the decks of their cards. A note edited in Anki since the last
+    sync has a newer mod time than the state records, and a card moved there
+    sits in another deck. Card mod times are not compared, as reviewing a
+    card changes them too.
+    """
+    if known and not full:
+        results = client.multi(_state_check(base_dirs, known))
+        if _matches_state(results, known):
+            return _from_state(known)
+    return get_existing_notes(client, *base_dirs)
+
+
+def _state_check(
+    base_dirs: list[str], known: dict[str, NoteState]
+) -> list[tuple[str, dict[str, Any]]]:
+    return [
+        ("findNotes", {"query": scope_query(*base_dirs)}),
+        _mod_query(list(known.values())),
+        ("getDecks", {"cards": [c for note in known.values() for c in note.card_ids]}),
+    ]
+
+
+def _matches_state(results: list[Any], known: dict[str, NoteState]) -> bool:
+    found, note_mods, decks = results
+    if isinstance(found, AnkiConnectError):
+        raise found
+    if set(found) != {note.note_id for note in known.values()}:
+        return False
+    if isinstance(decks, AnkiConnectError):
+        return False
+    card_decks = {card: deck for deck, cards in decks.items() for card in cards}
+    mods = _read_mods(note_mods)
+    return all(
+        mods.get(note.note_id) == note.mod
+        and all(card_decks.get(card) == note.deck for card in note.card_ids)
+        for note in known.values()
+    )
+
+
+def _mod_query(
+    notes: list[AnkiNote] | list[NoteState],
+) -> tuple[str, dict[str, Any]]:
+    return ("notesModTime", {"notes": [note.note_id for note in notes]})
+
+
+def _read_mods(note_mods: Any) -> dict[int, int]:
+    """Mod times by note ID, or nothing if the lookup failed, as it does for
+    a note Anki no longer has."""
+    if isinstance(note_mods, AnkiConnectError):
+        return {}
+    return {entry["noteId"]: entry["mod"] for entry in note_mods}
+
+
+def _unread_mods(notes: dict[str, AnkiNote]) -> list[AnkiNote]:
+    return [note for note in notes.values() if not note.mod]
+
+
+def _record_mods(notes: list[AnkiNote], note_mods: Any) -> None:
+    mods = _read_mods(note_mods)
+    for note in notes:
+        note.mod = mods.get(note.note_id, 0)
+
+
+def _refresh_mods(client: AnkiClient, notes: dict[str, AnkiNote]) -> None:
+    """Read back the mod times of the `notes` written in this sync, so the
+    next sync can tell them from notes edited in Anki."""
+    unread = _unread_mods(notes)
+    if unread:
+        _record_mods(unread, *client.multi([_mod_query(unread)]))
+
+
+def _from_state(known: dict[str, NoteState]) -> dict[str, AnkiNote]:
+    return {h: AnkiNote(**asdict(note)) for h, note in known.items()}
+
+
+def _existing_query(base_dirs: tuple[str, ...]) -> str:
+    return scope_query(*base_dirs) if base_dirs else f"note:{NOTE_TYPE_NAME}"
+
+
+def _hash_queries(hashes: list[str]) -> list[str]:
+    queries = []
+    for start in range(0, len(hashes), HASH_QUERY_SIZE):
+        terms = " OR ".join(
+            f'"SourceHash:{_escape_search(h)}"'
+            for h in hashes[start : start + HASH_QUERY_SIZE]
+        )
+        queries.append(f"note:{NOTE_TYPE_NAME} ({terms})")
+    return queries
+
+
+def get_existing_notes(client: AnkiClient, *base_dirs: str) -> dict[str, AnkiNote]:
+    """Index mdanki notes by SourceHash, only those under `base_dirs` if given."""
+    return _notes_by_id(client, client.find_notes(_existing_query(base_dirs)))
+
+
+def find_notes_by_hash(client: AnkiClient, hashes: list[str]) -> dict[str, AnkiNote]:
+    """Look up mdanki notes by SourceHash wherever their SourceFile points."""
+    note_ids: list[int] = []
+    for query in _hash_queries(hashes):
+        note_ids.extend(client.find_notes(query))
+    return _notes_by_id(client, note_ids)
+
+
+def _first_cards(notes_info: list[dict[str, Any]]) -> list[int]:
+    # A note's deck is read from its first card, so only those are looked up
+    return [info["cards"][0] for info in notes_info if info.get("cards")]
+
+
+def _index_notes(
+    notes_info: list[dict[str, Any]],
+    cards_info: list[dict[str, Any]],
+    existing: dict[str, AnkiNote],
+) -> None:
+    card_to_deck = {card["cardId"]: card["deckName"] for card in cards_info}
     for info in notes_info:
         fields = info.get("fields", {})
         source_hash = _get_field(fields, "SourceHash")
-        source_file = _get_field(fields, "SourceFile")
         front = _get_field(fields, "Front")
         back = _get_field(fields, "Back")
 
@@ -56,113 +337,1199 @@ def get_existing_notes(client: AnkiClient) -> dict[str, AnkiNote]:
             note_id=info["noteId"],
             card_ids=cards,
             source_hash=source_hash,
-            source_file=source_file,
-            deck=deck,
-            front=front,
-            back=back,
+            source_file=sys.intern(_get_field(fields, "SourceFile")),
+            deck=sys.intern(deck),
+            fields_digest=fields_digest(front, back),
+            # Dropped if Front or Back was edited in Anki, so the card is
+            # rendered and the note restored
+            fingerprint=read_fingerprint_field(
+                _get_field(fields, "Fingerprint"), front, back
+            ),
+            back_digest=back_digest(back),
+            mod=info.get("mod", 0),
         )
 
+
+def _notes_by_id(client: AnkiClient, note_ids: list[int]) -> dict[str, AnkiNote]:
+    existing: dict[str, AnkiNote] = {}
+    # Index one notesInfo chunk at a time so only that chunk is held in memory
+    for notes_info in client.iter_notes_info(note_ids):
+        cards_info = client.get_cards_info(_first_cards(notes_info))
+        _index_notes(notes_info, cards_info, existing)
     return existing
 
 
-def sync(
+def _render_texts(
+    path: Path, texts: list[str], use_cache: bool, jobs: int
+) -> list[str]:
+    if not texts:
+        return []
+    render_cache = RenderCache.for_root(path) if use_cache else RenderCache()
+    try:
+        return render_many(texts, jobs, render_cache)
+    finally:
+        render_cache.close()
+
+
+def _render_cards(
     path: Path,
-    client: AnkiClient,
-    dry_run: bool = False,
-    verbose: bool = False,
-    delete: bool = False,
-) -> SyncStats:
-    stats = SyncStats()
+    cards: list[MarkdownCard],
+    use_cache: bool,
+    jobs: int,
+    rendered: Mapping[str, str] | None = None,
+) -> list[str]:
+    """Render every card's front and back, interleaved, taking the HTML of
+    markdown already in `rendered`."""
+    texts = [text for card in cards for text in (card.front_raw, card.back_raw)]
+    if not rendered:
+        return _render_texts(path, texts, use_cache, jobs)
+    missing = list(dict.fromkeys(t for t in texts if t not in rendered))
+    html = dict(zip(missing, _render_texts(path, missing, use_cache, jobs)))
+    return [rendered[t] if t in rendered else html[t] for t in texts]
 
-    if not dry_run:
-        client.create_note_type_if_not_exists()
 
-    cards = parse_all(path)
+def _render_ahead(
+    path: Path,
+    cards: list[MarkdownCard],
+    known: dict[str, NoteState],
+    use_cache: bool,
+    jobs: int,
+) -> dict[str, str]:
+    """Render the cards that the local state says need it, before the notes in
+    Anki are known. Returns HTML by markdown text."""
+    to_render, _ = _split_unchanged(cards, known)
+    texts = list(
+        dict.fromkeys(t for card in to_render for t in (card.front_raw, card.back_raw))
+    )
+    return dict(zip(texts, _render_texts(path, texts, use_cache, jobs)))
+
 
+def _link_media(
+    path: Path,
+    cards: list[MarkdownCard],
+    html: list[str],
+    known_media: dict[str, MediaState],
+    verbose: bool,
+) -> LinkedMedia:
+    linked = link_media(path, cards, html, known_media)
     if verbose:
-        print(f"Found {len(cards)} cards in {path}")
+        for source_file, src in linked.missing:
+            print(f"Missing media in {source_file}: {src}")
+    return linked
 
-    existing = get_existing_notes(client)
 
-    if verbose:
-        print(f"Found {len(existing)} existing notes in Anki")
+def _media_to_store(linked: LinkedMedia, stored: set[str]) -> list[tuple[str, Path]]:
+    # Keyed by name so identical files are stored once
+    pending = {f.name: Path(f.path) for f in linked.files.values()}
+    return [(name, path) for name, path in pending.items() if name not in stored]
 
-    if not dry_run:
-        for deck in {card.deck for card in cards}:
-            client.create_deck(deck)
 
+def _record_media(
+    pending: list[tuple[str, Path]], results: list[Any], stats: SyncStats
+) -> list[str]:
+    new = []
+    for (name, path), result in zip(pending, results):
+        if isinstance(result, AnkiConnectError):
+            stats.errors.append(f"Failed to store media '{path}': {result}")
+            continue
+        new.append(name)
+    stats.media += len(new)
+    return new
+
+
+def _save_media(
+    state: SyncState,
+    linked: LinkedMedia,
+    known_media: dict[str, MediaState],
+    stored: list[str],
+    clear: bool,
+) -> None:
+    files = [f for path, f in linked.files.items() if known_media.get(path) != f]
+    if files or stored or clear:
+        state.update_media(files, stored, clear)
+
+
+def _store_media(
+    client: AnkiClient,
+    state: SyncState,
+    linked: LinkedMedia,
+    known_media: dict[str, MediaState],
+    stored: set[str],
+    stats: SyncStats,
+    dry_run: bool,
+    full: bool,
+) -> None:
+    """Store the media files Anki is not known to hold yet.
+
+    A full sync asks Anki which mdanki media files it holds, since Anki's
+    media check may have removed some since they were stored.
+    """
+    if full and not dry_run:
+        stored = set(client.get_media_file_names(f"{MEDIA_PREFIX}*"))
+    pending = _media_to_store(linked, stored)
+    if dry_run:
+        stats.media = len(pending)
+        return
+    results = client.store_media_files(pending) if pending else []
+    new = _record_media(pending, results, stats)
+    _save_media(state, linked, known_media, [*stored, *new] if full else new, full)
+
+
+def _synced_notes(
+    existing: dict[str, AnkiNote],
+    base_dir: str,
+    card_hashes: set[str],
+    claimed: set[str],
+) -> dict[str, AnkiNote]:
+    """What Anki holds under this root, kept current as writes succeed. Notes
+    `claimed` by cards of another root synced alongside are not this root's."""
+    return {
+        h: note
+        for h, note in existing.items()
+        if h in card_hashes
+        or (note.source_file.startswith(base_dir + "/") and h not in claimed)
+    }
+
+
+def _has_images(card: MarkdownCard) -> bool:
+    return "![" in card.front_raw or "![" in card.back_raw
+
+
+def _split_unchanged(
+    cards: list[MarkdownCard], existing: Mapping[str, AnkiNote | NoteState]
+) -> tuple[list[MarkdownCard], list[MarkdownCard]]:
+    """Split `cards` into those to render and those whose note already holds
+    their rendering, going by the note's fingerprint and SourceFile.
+
+    Cards with images are always rendered, as the images can change while
+    the markdown does not.
+    """
+    to_render: list[MarkdownCard] = []
+    unchanged: list[MarkdownCard] = []
     for card in cards:
-        front_html = render_markdown(card.front_raw)
-        back_html = render_markdown(card.back_raw)
+        note = existing.get(card.source_hash)
+        if (
+            note is None
+            or note.source_file != card.source_file
+            or note.fingerprint != fingerprint(card.front_raw, card.back_raw)
+            or _has_images(card)
+        ):
+            to_render.append(card)
+        else:
+            unchanged.append(card)
+    return to_render, unchanged
+
+
+def _match_edits(
+    cards: list[MarkdownCard],
+    html: list[str],
+    existing: dict[str, AnkiNote],
+    synced: dict[str, AnkiNote],
+    orphaned: list[AnkiNote],
+    verbose: bool,
+) -> list[str]:
+    """Pair the rendered `cards` that have no note with `orphaned` notes whose
+    card had its front edited, so the note is updated instead of replaced.
 
+    A card pairs with an orphan holding the same Back, preferring one from
+    the same file and then the oldest. Cards whose answer changed as well are
+    left to be created. Paired notes are filed under the card's SourceHash in
+    `existing` and `synced`. Returns the SourceHashes they were filed under
+    before.
+    """
+    # One entry per SourceHash, as repeated cards share a note
+    new = {
+        card.source_hash: (card, back)
+        for card, back in zip(cards, html[1::2])
+        if card.source_hash not in existing
+    }.values()
+    if not new or not orphaned:
+        return []
+    by_back: dict[str, list[AnkiNote]] = {}
+    for note in sorted(orphaned, key=lambda n: n.note_id):
+        if note.back_digest:
+            by_back.setdefault(note.back_digest, []).append(note)
+
+    pairs: list[tuple[MarkdownCard, AnkiNote]] = []
+    taken: set[str] = set()
+    for card, back in new:
+        candidates = [
+            n for n in by_back.get(back_digest(back), []) if n.source_hash not in taken
+        ]
+        if candidates:
+            same_file = [n for n in candidates if n.source_file == card.source_file]
+            note = (same_file or candidates)[0]
+            taken.add(note.source_hash)
+            pairs.append((card, note))
+
+    for card, note in pairs:
+        if verbose:
+            print(f"Edited: {card.front_raw[:50]}")
+        del existing[note.source_hash]
+        existing[card.source_hash] = note
+        synced.pop(note.source_hash, None)
+        synced[card.source_hash] = note
+    return [note.source_hash for _, note in pairs]
+
+
+def _plan_move(
+    card: MarkdownCard, note: AnkiNote, stats: SyncStats, verbose: bool
+) -> list[PendingWrite]:
+    if note.deck == card.deck:
+        return []
+    if verbose:
+        print(f"Moving to {card.deck}: {card.front_raw[:50]}")
+    if not note.card_ids:
+        stats.moved += 1
+        return []
+    return [
+        PendingWrite(
+            counter="moved",
+            description=f"Failed to move '{card.front_raw[:50]}'",
+            action="changeDeck",
+            params={"cards": note.card_ids, "deck": card.deck},
+            source_hash=card.source_hash,
+            changes={"deck": card.deck},
+        )
+    ]
+
+
+def _plan_changes(
+    cards: list[MarkdownCard],
+    html: list[str],
+    unchanged: list[MarkdownCard],
+    existing: dict[str, AnkiNote],
+    stats: SyncStats,
+    verbose: bool,
+) -> tuple[list[tuple[MarkdownCard, dict[str, Any]]], list[PendingWrite]]:
+    """Work out the notes to create and the writes to send for the rendered
+    `cards` and the `unchanged` ones, which can only need a move."""
+    creates: list[tuple[MarkdownCard, dict[str, Any]]] = []
+    writes: list[PendingWrite] = []
+
+    for card, front_html, back_html in zip(cards, html[::2], html[1::2]):
+        card_fingerprint = fingerprint(card.front_raw, card.back_raw)
         if card.source_hash in existing:
             note = existing[card.source_hash]
-            content_changed = note.front != front_html or note.back != back_html
-            deck_changed = note.deck != card.deck
+            digest = fields_digest(front_html, back_html)
+            # SourceFile also scopes later searches, so keep it current
+            content_changed = (
+                note.fields_digest != digest
+                or note.source_file != card.source_file
+                or note.source_hash != card.source_hash
+            )
 
             if content_changed:
                 if verbose:
                     print(f"Updating: {card.front_raw[:50]}")
-                if not dry_run:
-                    client.update_note(
-                        note.note_id, front_html, back_html, card.source_file
+                fields = {
+                    "Front": front_html,
+                    "Back": back_html,
+                    "SourceFile": card.source_file,
+                    "Fingerprint": fingerprint_field(
+                        card_fingerprint, front_html, back_html
+                    ),
+                }
+                if note.source_hash != card.source_hash:
+                    # Matched by `_match_edits` after its front was edited
+                    fields["SourceHash"] = card.source_hash
+                writes.append(
+                    PendingWrite(
+                        counter="updated",
+                        description=f"Failed to update '{card.front_raw[:50]}'",
+                        action="updateNoteFields",
+                        params={"note": {"id": note.note_id, "fields": fields}},
+                        source_hash=card.source_hash,
+                        changes={
+                            "source_hash": card.source_hash,
+                            "fields_digest": digest,
+                            "source_file": card.source_file,
+                            "fingerprint": card_fingerprint,
+                            "back_digest": back_digest(back_html),
+                        },
                     )
-                stats.updated += 1
+                )
+            elif note.fingerprint != card_fingerprint:
+                # Same HTML as before, so only record the fingerprint to skip
+                # rendering the card next time
+                writes.append(
+                    PendingWrite(
+                        counter=None,
+                        description=f"Failed to update '{card.front_raw[:50]}'",
+                        action="updateNoteFields",
+                        params={
+                            "note": {
+                                "id": note.note_id,
+                                "fields": {
+                                    "Fingerprint": fingerprint_field(
+                                        card_fingerprint, front_html, back_html
+                                    )
+                                },
+                            }
+                        },
+                        source_hash=card.source_hash,
+                        changes={"fingerprint": card_fingerprint},
+                    )
+                )
 
-            if deck_changed:
-                if verbose:
-                    print(f"Moving to {card.deck}: {card.front_raw[:50]}")
-                if not dry_run and note.card_ids:
-                    client.change_deck(note.card_ids, card.deck)
-                stats.moved += 1
+            writes.extend(_plan_move(card, note, stats, verbose))
 
         else:
             if verbose:
                 print(f"Creating: {card.front_raw[:50]}")
-            try:
-                if not dry_run:
-                    client.add_note(
-                        deck=card.deck,
-                        front=front_html,
-                        back=back_html,
-                        source_hash=card.source_hash,
-                        source_file=card.source_file,
-                    )
-                stats.created += 1
-            except Exception as e:
-                stats.errors.append(f"Failed to create '{card.front_raw[:50]}': {e}")
+            creates.append(
+                (
+                    card,
+                    make_note(
+                        card.deck,
+                        front_html,
+                        back_html,
+                        card.source_hash,
+                        card.source_file,
+                        fingerprint_field(card_fingerprint, front_html, back_html),
+                    ),
+                )
+            )
+
+    for card in unchanged:
+        writes.extend(_plan_move(card, existing[card.source_hash], stats, verbose))
+
+    return creates, writes
 
+
+def _orphaned_notes(
+    existing: dict[str, AnkiNote],
+    base_dir: str,
+    card_hashes: set[str],
+    verbose: bool,
+) -> list[AnkiNote]:
+    # By key, as a note paired with an edited card is filed under the card's
+    # SourceHash before its own is updated
+    orphaned = [
+        note
+        for h, note in existing.items()
+        if note.source_file.startswith(base_dir + "/") and h not in card_hashes
+    ]
+    if verbose:
+        for note in orphaned:
+            print(f"Deleting: {note.source_file} ({note.source_hash})")
+    return orphaned
+
+
+def _plan_root(
+    base_dir: str,
+    to_render: list[MarkdownCard],
+    html: list[str],
+    unchanged: list[MarkdownCard],
+    existing: dict[str, AnkiNote],
+    synced: dict[str, AnkiNote],
+    kept: set[str],
+    stats: SyncStats,
+    verbose: bool,
+) -> tuple[list[tuple[MarkdownCard, dict[str, Any]]], list[PendingWrite]]:
+    """Pair edited cards with the orphaned notes of the root `base_dir`, whose
+    SourceHash is not in `kept`, then plan the changes for the rendered
+    `to_render` cards and the `unchanged` ones."""
+    orphaned = _orphaned_notes(existing, base_dir, kept, False)
+    _match_edits(to_render, html, existing, synced, orphaned, verbose)
+    return _plan_changes(to_render, html, unchanged, existing, stats, verbose)
+
+
+def _record_deletes(
+    orphaned: list[AnkiNote], stats: SyncStats, synced: dict[str, AnkiNote]
+) -> None:
+    for note in orphaned:
+        del synced[note.source_hash]
+    stats.deleted += len(orphaned)
+
+
+def _root_decks(
+    cards: list[MarkdownCard], existing: dict[str, AnkiNote], base_dir: str
+) -> set[str]:
+    root_decks = {card.deck.split("::")[0] for card in cards}
+    root_decks |= {
+        note.deck.split("::")[0]
+        for note in existing.values()
+        if note.source_file.startswith(base_dir + "/")
+    }
+    return root_decks
+
+
+def _save_state(
+    state: SyncState, synced: dict[str, AnkiNote], known: dict[str, NoteState]
+) -> None:
+    notes = [NoteState(**asdict(note)) for note in synced.values()]
+    if {n.source_hash: n for n in notes} != known:
+        state.save(notes)
+
+
+def _fetch_existing(
+    client: AnkiClient,
+    base_dirs: list[str],
+    known: dict[str, NoteState],
+    full: bool,
+    dry_run: bool,
+) -> dict[str, AnkiNote]:
+    if not dry_run:
+        client.create_note_type_if_not_exists()
+    return _load_existing(client, base_dirs, known, full)
+
+
+def _find_moved_in(
+    client: AnkiClient, existing: dict[str, AnkiNote], cards: list[MarkdownCard]
+) -> None:
+    unmatched = _unmatched_hashes(cards, existing)
+    if unmatched:
+        existing.update(find_notes_by_hash(client, unmatched))
+
+
+def _unmatched_hashes(
+    cards: list[MarkdownCard], existing: dict[str, AnkiNote]
+) -> list[str]:
+    # Cards moved in from another root still carry their note under the old
+    # SourceFile, so look those up by hash rather than scanning the collection
+    return [c.source_hash for c in cards if c.source_hash not in existing]
+
+
+def _sync_root(
+    client: AnkiClient,
+    path: Path,
+    cards: list[MarkdownCard],
+    known: dict[str, NoteState],
+    existing: dict[str, AnkiNote],
+    claimed: set[str],
+    stats: SyncStats,
+    clock: _PhaseClock,
+    *,
+    dry_run: bool,
+    verbose: bool,
+    delete: bool,
+    full: bool,
+    use_cache: bool,
+    jobs: int,
+    rendered: Mapping[str, str] | None = None,
+) -> set[str]:
+    """Push the parsed `cards` of the root at `path` to Anki and save its state
+    over the `known` one.
+
+    `claimed` holds the SourceHashes of cards in other roots synced in the
+    same run; their notes are neither deleted nor recorded as this root's.
+    `rendered` holds HTML by markdown text rendered ahead. Returns the root
+    decks to check for emptiness.
+    """
+    state = SyncState.for_root(path)
     base_dir = path.name
+    card_hashes = {card.source_hash for card in cards}
+    synced = _synced_notes(existing, base_dir, card_hashes, claimed)
+
+    if not dry_run:
+        decks = sorted({card.deck for card in cards})
+        results = client.create_decks(decks)
+        _record_decks(decks, results, stats)
+    clock.lap("metadata")
+
+    to_render, unchanged = _split_unchanged(cards, existing)
+    html = _render_cards(path, to_render, use_cache, jobs, rendered)
+    clock.lap("render")
+    known_media, stored_media = state.load_media()
+    linked = _link_media(path, to_render, html, known_media, verbose)
+    clock.lap("media")
+    creates, writes = _plan_root(
+        base_dir,
+        to_render,
+        linked.html,
+        unchanged,
+        existing,
+        synced,
+        card_hashes | claimed,
+        stats,
+        verbose,
+    )
+    clock.lap("plan")
+
+    _store_media(client, state, linked, known_media, stored_media, stats, dry_run, full)
+    clock.lap("media")
+    _apply_creates(client, creates, stats, dry_run, synced)
+    clock.lap("create")
+    _apply_writes(client, writes, stats, dry_run, synced)
+    clock.lap("update")
+
+    if delete:
+        orphaned_notes = _orphaned_notes(
+            existing, base_dir, card_hashes | claimed, verbose
+        )
+        if orphaned_notes and not dry_run:
+            client.delete_notes([note.note_id for note in orphaned_notes])
+        _record_deletes(orphaned_notes, stats, synced)
+        clock.lap("delete")
+
+    if not dry_run:
+        _refresh_mods(client, synced)
+        _save_state(state, synced, known)
+        clock.lap("save state")
+
+    return _root_decks(cards, existing, base_dir)
+
+
+def _clean_up_decks(
+    client: AnkiClient,
+    root_decks: set[str],
+    stats: SyncStats,
+    verbose: bool,
+    clock: _PhaseClock,
+) -> None:
+    # Only moves and deletes can leave a deck empty
+    if stats.moved > 0 or stats.deleted > 0:
+        deleted_decks = client.delete_empty_decks(*sorted(root_decks))
+        _report_removed_decks(deleted_decks, verbose)
+        clock.lap("deck cleanup")
 
+
+def _report_removed_decks(deleted_decks: list[str], verbose: bool) -> None:
+    if verbose:
+        for deck in deleted_decks:
+            print(f"Removed empty deck: {deck}")
+
+
+def sync(
+    path: Path,
+    client: AnkiClient,
+    dry_run: bool = False,
+    verbose: bool = False,
+    delete: bool = False,
+    full: bool = False,
+    use_cache: bool = True,
+    jobs: int = 1,
+) -> SyncStats:
+    """Sync the markdown cards under `path` to Anki.
+
+    The note type check and the existing-note fetch run on a background
+    thread while the vault is parsed and the cards whose fingerprint differs
+    from the local state are rendered, so a sync takes about as long as the
+    slower of the two sides.
+    """
+    stats = SyncStats()
+    with client.recording(stats.requests):
+        clock = _PhaseClock(stats)
+        known = SyncState.for_root(path).load()
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            fetching = pool.submit(
+                _fetch_existing, client, [path.name], known, full, dry_run
+            )
+            cards = parse_all(path, use_cache=use_cache, jobs=jobs)
+            clock.lap("parse")
+            if verbose:
+                print(f"Found {len(cards)} cards in {path}")
+            rendered = _render_ahead(path, cards, known, use_cache, jobs)
+            clock.lap("render ahead")
+            existing = fetching.result()
+
+        _find_moved_in(client, existing, cards)
+        # Only the part of the fetch that outlasted parsing and rendering
+        clock.lap("fetch existing")
+
+        if verbose:
+            print(f"Found {len(existing)} existing notes in Anki")
+
+        root_decks = _sync_root(
+            client,
+            path,
+            cards,
+            known,
+            existing,
+            set(),
+            stats,
+            clock,
+            dry_run=dry_run,
+            verbose=verbose,
+            delete=delete,
+            full=full,
+            use_cache=use_cache,
+            jobs=jobs,
+            rendered=rendered,
+        )
+        if not dry_run:
+            _clean_up_decks(client, root_decks, stats, verbose, clock)
+
+        stats.total = len(existing) + stats.created - stats.deleted
+
+    return stats
+
+
+def sync_roots(
+    paths: list[Path],
+    client: AnkiClient,
+    dry_run: bool = False,
+    verbose: bool = False,
+    delete: bool = False,
+    full: bool = False,
+    use_cache: bool = True,
+    jobs: int = 1,
+) -> SyncStats:
+    """`sync` several roots in one run, returning their combined stats.
+
+    The note type is checked and the existing notes of every root fetched
+    once, and empty decks are removed once at the end. Each root keeps its own
+    state and `delete` still only removes notes whose SourceFile lies under
+    the root, but a card moved from one root to another keeps its note.
+    """
+    names = [path.name for path in paths]
+    if len(set(names)) != len(names):
+        raise ValueError("Roots must have different directory names")
+
+    stats = SyncStats()
+    with client.recording(stats.requests):
+        clock = _PhaseClock(stats)
+        known = {path: SyncState.for_root(path).load() for path in paths}
+        every_known = {h: n for k in known.values() for h, n in k.items()}
+
+        # Parsing and rendering overlap the fetch, as in `sync`
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            fetching = pool.submit(
+                _fetch_existing, client, names, every_known, full, dry_run
+            )
+            parsed = {
+                path: parse_all(path, use_cache=use_cache, jobs=jobs) for path in paths
+            }
+            clock.lap("parse")
+            if verbose:
+                for path, cards in parsed.items():
+                    print(f"Found {len(cards)} cards in {path}")
+            rendered = {
+                path: _render_ahead(path, cards, known[path], use_cache, jobs)
+                for path, cards in parsed.items()
+            }
+            clock.lap("render ahead")
+            existing = fetching.result()
+
+        all_cards = [card for cards in parsed.values() for card in cards]
+        _find_moved_in(client, existing, all_cards)
+        clock.lap("fetch existing")
+
+        if verbose:
+            print(f"Found {len(existing)} existing notes in Anki")
+
+        root_decks: set[str] = set()
+        for path, cards in parsed.items():
+            own = {card.source_hash for card in cards}
+            claimed = {
+                card.source_hash for card in all_cards if card.source_hash not in own
+            }
+            root_decks |= _sync_root(
+                client,
+                path,
+                cards,
+                known[path],
+                existing,
+                claimed,
+                stats,
+                clock,
+                dry_run=dry_run,
+                verbose=verbose,
+                delete=delete,
+                full=full,
+                use_cache=use_cache,
+                jobs=jobs,
+                rendered=rendered[path],
+            )
+        if not dry_run:
+            _clean_up_decks(client, root_decks, stats, verbose, clock)
+
+        stats.total = len(existing) + stats.created - stats.deleted
+
+    return stats
+
+
+def _changed_cards(path: Path, changed: set[Path]) -> list[MarkdownCard]:
+    files = set()
+    for changed_path in changed:
+        if changed_path.is_dir():
+            files.update(changed_path.rglob("*.md"))
+        elif changed_path.suffix == ".md":
+            files.add(changed_path)
+    cards = []
+    for file_path in sorted(files):
+        try:
+            cards.extend(parse_markdown_file(file_path, path))
+        except FileNotFoundError:
+            # Removed since the change was seen; its notes count as orphaned
+            continue
+    return cards
+
+
+def subtree_query(*scopes: str) -> str:
+    """Search for the mdanki notes whose SourceFile is one of `scopes`, or
+    lies under one of them."""
+    terms = " OR ".join(
+        f'"SourceFile:{_escape_search(s)}" OR "SourceFile:{_escape_search(s)}/*"'
+        for s in scopes
+    )
+    return f"note:{NOTE_TYPE_NAME} ({terms})"
+
+
+def _in_scope(source_file: str, scopes: set[str]) -> bool:
+    return any(
+        source_file == scope or source_file.startswith(scope + "/") for scope in scopes
+    )
+
+
+def _sync_scope(
+    client: AnkiClient,
+    path: Path,
+    state: SyncState,
+    cards: list[MarkdownCard],
+    existing: dict[str, AnkiNote],
+    known: dict[str, NoteState],
+    scopes: set[str],
+    stats: SyncStats,
+    clock: _PhaseClock,
+    *,
+    dry_run: bool,
+    verbose: bool,
+    delete: bool,
+    use_cache: bool,
+    jobs: int,
+    stale: list[str],
+) -> list[AnkiNote]:
+    """Push the `cards` parsed from the `scopes` of the root at `path`,
+    deleting only orphaned notes inside the scopes. Rewrites the affected
+    rows of the stored state, dropping the `stale` ones, and updates `known`
+    to match. Returns the deleted notes."""
+    card_hashes = {card.source_hash for card in cards}
+    touched = {h: existing[h] for h in card_hashes if h in existing}
+
+    to_render, unchanged = _split_unchanged(cards, existing)
+    html = _render_cards(path, to_render, use_cache, jobs)
+    clock.lap("render")
+    known_media, stored_media = state.load_media()
+    linked = _link_media(path, to_render, html, known_media, verbose)
+    clock.lap("media")
+    orphaned = [
+        note
+        for note in _orphaned_notes(existing, path.name, card_hashes, False)
+        if _in_scope(note.source_file, scopes)
+    ]
+    edited = _match_edits(to_render, linked.html, existing, touched, orphaned, verbose)
+    creates, writes = _plan_changes(
+        to_render, linked.html, unchanged, existing, stats, verbose
+    )
+    clock.lap("plan")
+
+    if not dry_run:
+        # Only new notes and moves can need a deck that does not exist yet
+        decks = sorted(
+            {card.deck for card, _ in creates}
+            | {w.params["deck"] for w in writes if w.action == "changeDeck"}
+        )
+        results = client.create_decks(decks)
+        _record_decks(decks, results, stats)
+    clock.lap("metadata")
+
+    _store_media(
+        client, state, linked, known_media, stored_media, stats, dry_run, False
+    )
+    clock.lap("media")
+    _apply_creates(client, creates, stats, dry_run, touched)
+    clock.lap("create")
+    _apply_writes(client, writes, stats, dry_run, touched)
+    clock.lap("update")
+
+    orphaned_notes = []
     if delete:
-        markdown_hashes = {card.source_hash for card in cards}
         orphaned_notes = [
             note
-            for note in existing.values()
-            if note.source_file.startswith(base_dir + "/")
-            and note.source_hash not in markdown_hashes
+            for note in _orphaned_notes(existing, path.name, card_hashes, False)
+            if _in_scope(note.source_file, scopes)
         ]
-        if orphaned_notes:
+        if verbose:
             for note in orphaned_notes:
-                if verbose:
-                    print(f"Deleting: {note.front[:50]}")
-            if not dry_run:
-                client.delete_notes([note.note_id for note in orphaned_notes])
-            stats.deleted = len(orphaned_notes)
-
-    if not dry_run and (stats.moved > 0 or stats.deleted > 0):
-        root_decks = {card.deck.split("::")[0] for card in cards}
-        root_decks |= {
-            note.deck.split("::")[0]
-            for note in existing.values()
-            if note.source_file.startswith(base_dir + "/")
+                print(f"Deleting: {note.source_file} ({note.source_hash})")
+        if orphaned_notes and not dry_run:
+            client.delete_notes([note.note_id for note in orphaned_notes])
+        stats.deleted = len(orphaned_notes)
+        clock.lap("delete")
+
+    if not dry_run:
+        _refresh_mods(client, touched)
+        notes = [NoteState(**asdict(note)) for note in touched.values()]
+        kept = {note.source_hash for note in notes}
+        removed = [
+            h
+            for h in [note.source_hash for note in orphaned_notes] + stale + edited
+            if h not in kept
+        ]
+        state.update(notes, removed)
+        known.update((n.source_hash, n) for n in notes)
+        for source_hash in removed:
+            known.pop(source_hash, None)
+        clock.lap("save state")
+    return orphaned_notes
+
+
+def sync_files(
+    path: Path,
+    client: AnkiClient,
+    changed: set[Path],
+    known: dict[str, NoteState],
+    verbose: bool = False,
+    delete: bool = False,
+    use_cache: bool = True,
+) -> SyncStats:
+    """Sync only the notes of the `changed` files and directories under `path`.
+
+    `known` is the local sync state, trusted as the existing-note index for
+    everything outside the changed paths. It is updated in place, and only
+    the affected rows of the stored state are rewritten.
+    """
+    stats = SyncStats()
+    with client.recording(stats.requests):
+        clock = _PhaseClock(stats)
+        state = SyncState.for_root(path)
+        scopes = {p.relative_to(path.parent).as_posix() for p in changed}
+
+        cards = _changed_cards(path, changed)
+        clock.lap("parse")
+
+        existing = _from_state(known)
+        _find_moved_in(client, existing, cards)
+        clock.lap("fetch existing")
+        # Decks the cards may be moved out of
+        cleanup = {
+            existing[c.source_hash].deck for c in cards if c.source_hash in existing
         }
-        for root_deck in root_decks:
-            deleted_decks = client.delete_empty_decks(root_deck)
+
+        orphaned_notes = _sync_scope(
+            client,
+            path,
+            state,
+            cards,
+            existing,
+            known,
+            scopes,
+            stats,
+            clock,
+            dry_run=False,
+            verbose=verbose,
+            delete=delete,
+            use_cache=use_cache,
+            jobs=1,
+            stale=[],
+        )
+
+        cleanup |= {note.deck for note in orphaned_notes}
+        # Cards at the top of the root land in Default, which is not ours
+        cleanup.discard("Default")
+        _clean_up_decks(client, cleanup, stats, verbose, clock)
+
+        stats.total = len(known)
+
+    return stats
+
+
+def _subtree_files(only: list[Path]) -> list[Path]:
+    files = set()
+    for only_path in only:
+        if only_path.is_dir():
+            files.update(only_path.rglob("*.md"))
+        elif only_path.exists():
+            files.add(only_path)
+        # A path that no longer exists has no cards, so its notes are orphans
+    return sorted(files)
+
+
+def _fetch_scope(
+    client: AnkiClient, scopes: set[str], dry_run: bool
+) -> dict[str, AnkiNote]:
+    if not dry_run:
+        client.create_note_type_if_not_exists()
+    return _notes_by_id(client, client.find_notes(subtree_query(*sorted(scopes))))
+
+
+def sync_subtree(
+    path: Path,
+    client: AnkiClient,
+    only: list[Path],
+    dry_run: bool = False,
+    verbose: bool = False,
+    delete: bool = False,
+    use_cache: bool = True,
+    jobs: int = 1,
+) -> SyncStats:
+    """Sync only the files and directories in `only`, inside the root `path`.
+
+    Decks and SourceFiles stay relative to `path`, but only the `only` paths
+    are parsed, and only the notes whose SourceFile lies under them are
+    fetched from Anki. `delete` and the empty-deck cleanup are limited to the
+    same paths. Stored state for the rest of the root is left alone.
+    """
+    for only_path in only:
+        if not only_path.is_relative_to(path):
+            raise ValueError(f"{only_path} is not inside {path}")
+
+    stats = SyncStats()
+    with client.recording(stats.requests):
+        clock = _PhaseClock(stats)
+        state = SyncState.for_root(path)
+        scopes = {p.relative_to(path.parent).as_posix() for p in only}
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            fetching = pool.submit(_fetch_scope, client, scopes, dry_run)
+            # The parse cache covers the whole root, so loading it would cost
+            # more than parsing a few files
+            cards = parse_files(path, _subtree_files(only), jobs)
+            clock.lap("parse")
             if verbose:
-                for deck in deleted_decks:
-                    print(f"Removed empty deck: {deck}")
+                print(f"Found {len(cards)} cards in {', '.join(sorted(scopes))}")
+            known = state.load(*sorted(scopes))
+            existing = fetching.result()
+
+        _find_moved_in(client, existing, cards)
+        clock.lap("fetch existing")
+
+        # State rows in the scopes whose notes Anki no longer has
+        stale = [h for h in known if h not in existing]
+        # Decks inside the scopes, and those cards may be moved out of
+        cleanup = {
+            get_deck_from_path(p if p.suffix == ".md" else p / "_.md", path)
+            for p in only
+        }
+        cleanup |= {
+            existing[c.source_hash].deck for c in cards if c.source_hash in existing
+        }
+
+        orphaned_notes = _sync_scope(
+            client,
+            path,
+            state,
+            cards,
+            existing,
+            known,
+            scopes,
+            stats,
+            clock,
+            dry_run=dry_run,
+            verbose=verbose,
+            delete=delete,
+            use_cache=use_cache,
+            jobs=jobs,
+            stale=stale,
+        )
+        cleanup |= {note.deck for note in orphaned_notes}
+        # Cards at the top of the root land in Default, which is not ours
+        cleanup.discard("Default")
+        if not dry_run:
+            _clean_up_decks(client, cleanup, stats, verbose, clock)
+
+        stats.total = state.count()
+
+    return stats
+
+
+async def _load_existing_async(
+    client: AsyncAnkiClient, base_dir: str, known: dict[str, NoteState], full: bool
+) -> dict[str, AnkiNote]:
+    if known and not full:
+        results = await client.multi(_state_check([base_dir], known))
+        if _matches_state(results, known):
+            return _from_state(known)
+    return await get_existing_notes_async(client, base_dir)
+
+
+async def _refresh_mods_async(
+    client: AsyncAnkiClient, notes: dict[str, AnkiNote]
+) -> None:
+    unread = _unread_mods(notes)
+    if unread:
+        _record_mods(unread, *await client.multi([_mod_query(unread)]))
+
+
+async def get_existing_notes_async(
+    client: AsyncAnkiClient, *base_dirs: str
+) -> dict[str, AnkiNote]:
+    """`get_existing_notes` for an AsyncAnkiClient."""
+    note_ids = await client.find_notes(_existing_query(base_dirs))
+    return await _notes_by_id_async(client, note_ids)
+
+
+async def find_notes_by_hash_async(
+    client: AsyncAnkiClient, hashes: list[str]
+) -> dict[str, AnkiNote]:
+    """`find_notes_by_hash` for an AsyncAnkiClient, searching concurrently."""
+    found = await asyncio.gather(
+        *(client.find_notes(query) for query in _hash_queries(hashes))
+    )
+    return await _notes_by_id_async(client, [nid for ids in found for nid in ids])
+
+
+async def _notes_by_id_async(
+    client: AsyncAnkiClient, note_ids: list[int]
+) -> dict[str, AnkiNote]:
+    existing: dict[str, AnkiNote] = {}
+    async for notes_info in client.iter_notes_info(note_ids):
+        cards_info = await client.get_cards_info(_first_cards(notes_info))
+        _index_notes(notes_info, cards_info, existing)
+    return existing
+
+
+async def _store_media_async(
+    client: AsyncAnkiClient,
+    state: SyncState,
+    linked: LinkedMedia,
+    known_media: dict[str, MediaState],
+    stored: set[str],
+    stats: SyncStats,
+    dry_run: bool,
+    full: bool,
+) -> None:
+    """`_store_media` for an AsyncAnkiClient."""
+    if full and not dry_run:
+        stored = set(await client.get_media_file_names(f"{MEDIA_PREFIX}*"))
+    pending = _media_to_store(linked, stored)
+    if dry_run:
+        stats.media = len(pending)
+        return
+    results = await client.store_media_files(pending) if pending else []
+    new = _record_media(pending, results, stats)
+    _save_media(state, linked, known_media, [*stored, *new] if full else new, full)
+
+
+async def _apply_creates_async(
+    client: AsyncAnkiClient,
+    creates: list[tuple[MarkdownCard, dict[str, Any]]],
+    stats: SyncStats,
+    dry_run: bool,
+    notes: dict[str, AnkiNote],
+) -> None:
+    if dry_run:
+        stats.created += len(creates)
+        return
+    results = await client.add_notes([note for _, note in creates])
+    created = _record_creates(creates, results, stats, notes)
+    _record_card_ids(await client.get_notes_info(list(created)), created, notes)
+
+
+async def _clean_up_decks_async(
+    client: AsyncAnkiClient,
+    root_decks: set[str],
+    stats: SyncStats,
+    verbose: bool,
+    clock: _PhaseClock,
+) -> None:
+    if stats.moved > 0 or stats.deleted > 0:
+        deleted_decks = await client.delete_empty_decks(*sorted(root_decks))
+        _report_removed_decks(deleted_decks, verbose)
+        clock.lap("deck cleanup")
+
+
+async def async_sync(
+    path: Path,
+    client: AsyncAnkiClient,
+    dry_run: bool = False,
+    verbose: bool = False,
+    delete: bool = False,
+    full: bool = False,
+    use_cache: bool = True,
+    jobs: int = 1,
+) -> SyncStats:
+    """`sync` over an AsyncAnkiClient.
+
+    Parsing, and rendering the cards the local state says changed, run in a
+    worker thread while the note type check and the existing-note fetch are
+    in flight; any other cards whose fingerprint differs from their note are
+    rendered there afterwards. Writes are sent in the same order as `sync`
+    sends them.
+    """
+    stats = SyncStats()
+    with client.recording(stats.requests):
+        clock = _PhaseClock(stats)
+        state = SyncState.for_root(path)
+        base_dir = path.name
+        known = state.load()
+        known_media, stored_media = state.load_media()
+
+        async def prepare_note_type() -> None:
+            if not dry_run:
+                await client.create_note_type_if_not_exists()
+
+        def parse() -> tuple[list[MarkdownCard], dict[str, str]]:
+            cards = parse_all(path, use_cache=use_cache, jobs=jobs)
+            return cards, _render_ahead(path, cards, known, use_cache, jobs)
+
+        (cards, rendered), existing, _ = await asyncio.gather(
+            asyncio.to_thread(parse),
+            _load_existing_async(client, base_dir, known, full),
+            prepare_note_type(),
+        )
+        # These ran concurrently, so the time is not split between them
+        clock.lap("parse and fetch existing")
+
+        if verbose:
+            print(f"Found {len(cards)} cards in {path}")
+
+        unmatched = _unmatched_hashes(cards, existing)
+        if unmatched:
+            existing.update(await find_notes_by_hash_async(client, unmatched))
+        card_hashes = {card.source_hash for card in cards}
+        synced = _synced_notes(existing, base_dir, card_hashes, set())
+        clock.lap("fetch existing")
+
+        if verbose:
+            print(f"Found {len(existing)} existing notes in Anki")
+
+        if not dry_run:
+            decks = sorted({card.deck for card in cards})
+            results = await client.create_decks(decks)
+            _record_decks(decks, results, stats)
+        clock.lap("metadata")
+
+        def render(to_render: list[MarkdownCard]) -> LinkedMedia:
+            html = _render_cards(path, to_render, use_cache, jobs, rendered)
+            return _link_media(path, to_render, html, known_media, verbose)
+
+        to_render, unchanged = _split_unchanged(cards, existing)
+        linked = await asyncio.to_thread(render, to_render)
+        clock.lap("render")
+        creates, writes = _plan_root(
+            base_dir,
+            to_render,
+            linked.html,
+            unchanged,
+            existing,
+            synced,
+            card_hashes,
+            stats,
+            verbose,
+        )
+        clock.lap("plan")
+
+        await _store_media_async(
+            client, state, linked, known_media, stored_media, stats, dry_run, full
+        )
+        clock.lap("media")
+        await _apply_creates_async(client, creates, stats, dry_run, synced)
+        clock.lap("create")
+        if dry_run:
+            results = [None] * len(writes)
+        else:
+            results = await client.multi([(w.action, w.params) for w in writes])
+        _record_writes(writes, results, stats, synced)
+        clock.lap("update")
+
+        if delete:
+            orphaned_notes = _orphaned_notes(existing, base_dir, card_hashes, verbose)
+            if orphaned_notes and not dry_run:
+                await client.delete_notes([note.note_id for note in orphaned_notes])
+            _record_deletes(orphaned_notes, stats, synced)
+            clock.lap("delete")
+
+        if not dry_run:
+            await _refresh_mods_async(client, synced)
+            _save_state(state, synced, known)
+            clock.lap("save state")
+            root_decks = _root_decks(cards, existing, base_dir)
+            await _clean_up_decks_async(client, root_decks, stats, verbose, clock)
 
-    stats.total = len(existing) + stats.created - stats.deleted
+        stats.total = len(existing) + stats.created - stats.deleted
 
     return stats
@@ -0,0 +1,191 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+from .defaults import DEFAULT_DEBOUNCE
+from .state import STATE_DIR_NAME
+
+DEFAULT_POLL_INTERVAL = 0.5
+# Longest a burst of saves can hold back a batch
+_MAX_BATCH_WAIT = 1.0
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+)
+_EVENT = struct.Struct("iIII")
+
+
+def _relevant(path: Path, root: Path, is_dir: bool) -> bool:
+    if STATE_DIR_NAME in path.relative_to(root).parts:
+        return False
+    return is_dir or path.suffix == ".md"
+
+
+def _snapshot(root: Path) -> dict[Path, tuple[int, int]]:
+    snapshot = {}
+    for file_path in root.rglob("*.md"):
+        try:
+            stat = file_path.stat()
+        except OSError:
+            continue
+        snapshot[file_path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def poll_changes(
+    root: Path,
+    debounce: float = DEFAULT_DEBOUNCE,
+    interval: float = DEFAULT_POLL_INTERVAL,
+) -> Iterator[set[Path]]:
+    """Yield batches of created, modified and deleted markdown files by
+    comparing snapshots of the tree every `interval` seconds."""
+    before = _snapshot(root)
+    while True:
+        time.sleep(interval)
+        after = _snapshot(root)
+        changed = _diff(before, after)
+        # Wait for the tree to settle so a burst of saves is one batch
+        deadline = time.monotonic() + _MAX_BATCH_WAIT
+        while changed and time.monotonic() < deadline:
+            time.sleep(debounce)
+            settled = _snapshot(root)
+            more = _diff(after, settled)
+            after = settled
+            if not more:
+                break
+            changed |= more
+        before = after
+        if changed:
+            yield changed
+
+
+def _diff(
+    before: dict[Path, tuple[int, int]], after: dict[Path, tuple[int, int]]
+) -> set[Path]:
+    return {p for p in before.keys() | after.keys() if before.get(p) != after.get(p)}
+
+
+class _Inotify:
+    """Recursive watch of a directory tree over the Linux inotify API."""
+
+    def __init__(self, root: Path) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(_IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self._dirs: dict[int, Path] = {}
+        self.watch_tree(root)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def watch_tree(self, top: Path) -> None:
+        for directory, dirnames, _ in os.walk(top):
+            if STATE_DIR_NAME in dirnames:
+                dirnames.remove(STATE_DIR_NAME)
+            wd = self._add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+            if wd >= 0:
+                self._dirs[wd] = Path(directory)
+
+    def _forget_tree(self, top: Path) -> None:
+        for wd, directory in list(self._dirs.items()):
+            if directory.is_relative_to(top):
+                del self._dirs[wd]
+
+    def wait(self, timeout: float | None) -> bool:
+        return bool(select.select([self.fd], [], [], timeout)[0])
+
+    def read(self) -> set[Path] | None:
+        """Paths touched by the pending events, or None if the kernel queue
+        overflowed and events were lost."""
+        data = os.read(self.fd, 64 * 1024)
+        changed: set[Path] = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size : offset + _EVENT.size + length]
+            offset += _EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            if mask & _IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or mask & _IN_DELETE_SELF:
+                continue
+            path = directory / os.fsdecode(name.rstrip(b"\0"))
+            is_dir = bool(mask & _IN_ISDIR)
+            if not _relevant(path, self.root, is_dir):
+                continue
+            if is_dir and mask & _IN_MOVED_FROM:
+                # Moved within the tree it is watched again on its IN_MOVED_TO
+                self._forget_tree(path)
+            if is_dir and mask & (_IN_CREATE | _IN_MOVED_TO):
+                self.watch_tree(path)
+            changed.add(path)
+        return changed
+
+
+def _inotify_changes(inotify: _Inotify, debounce: float) -> Iterator[set[Path] | None]:
+    try:
+        while True:
+            inotify.wait(None)
+            changed = inotify.read()
+            deadline = time.monotonic() + _MAX_BATCH_WAIT
+            while changed is not None and inotify.wait(
+                min(debounce, max(0.0, deadline - time.monotonic()))
+            ):
+                more = inotify.read()
+                changed = None if more is None else changed | more
+            if changed is None or changed:
+                yield changed
+    finally:
+        inotify.close()
+
+
+def watch_changes(
+    root: Path,
+    debounce: float = DEFAULT_DEBOUNCE,
+    poll: bool = False,
+    interval: float = DEFAULT_POLL_INTERVAL,
+) -> Iterator[set[Path] | None]:
+    """Yield debounced batches of changed markdown files and directories under
+    `root`.
+
+    Uses inotify on Linux and polling elsewhere or when `poll` is set. A batch
+    of None means events were lost and the whole tree should be rescanned.
+    """
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            inotify = _Inotify(root)
+        except (OSError, AttributeError):
+            pass
+        else:
+            return _inotify_changes(inotify, debounce)
+    return poll_changes(root, debounce, interval)
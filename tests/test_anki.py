@@ -0,0 +1,430 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from mdanki import anki
+from mdanki.anki import AnkiClient, AnkiConnectError, AsyncAnkiClient, make_note
+
+
+def make_client(handler, **kwargs) -> tuple[AnkiClient, list[dict]]:
+    requests: list[dict] = []
+
+    def record(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        requests.append(payload)
+        return httpx.Response(200, json=handler(payload))
+
+    client = AnkiClient(**kwargs)
+    client._client = httpx.Client(transport=httpx.MockTransport(record))
+    return client, requests
+
+
+def test_multi_batches_actions():
+    def handler(payload):
+        actions = payload["params"]["actions"]
+        return {
+            "result": [{"result": a["params"]["deck"], "error": None} for a in actions],
+            "error": None,
+        }
+
+    client, requests = make_client(handler, batch_size=2)
+    decks = ["a", "b", "c", "d", "e"]
+    results = client.multi([("createDeck", {"deck": d}) for d in decks])
+
+    assert results == decks
+    assert [len(r["params"]["actions"]) for r in requests] == [2, 2, 1]
+    assert all(r["action"] == "multi" for r in requests)
+
+
+def test_multi_reports_errors_per_action():
+    def handler(payload):
+        return {
+            "result": [
+                {"result": None, "error": "note was not found"}
+                if a["params"]["note"]["id"] == 2
+                else {"result": None, "error": None}
+                for a in payload["params"]["actions"]
+            ],
+            "error": None,
+        }
+
+    client, _ = make_client(handler)
+    results = client.multi(
+        [("updateNoteFields", {"note": {"id": i, "fields": {}}}) for i in (1, 2, 3)]
+    )
+
+    assert results[0] is None
+    assert isinstance(results[1], AnkiConnectError)
+    assert str(results[1]) == "note was not found"
+    assert results[2] is None
+
+
+def test_multi_empty_sends_nothing():
+    client, requests = make_client(lambda payload: {"result": [], "error": None})
+    assert client.multi([]) == []
+    assert requests == []
+
+
+def test_add_notes_maps_null_results_to_errors():
+    def handler(payload):
+        if payload["action"] == "addNotes":
+            return {"result": [101, None, 103], "error": None}
+        assert payload["action"] == "canAddNotesWithErrorDetail"
+        assert len(payload["params"]["notes"]) == 1
+        return {
+            "result": [{"canAdd": False, "error": "cannot create note: duplicate"}],
+            "error": None,
+        }
+
+    client, _ = make_client(handler)
+    notes = [make_note("Default", f"Q{i}", "A", f"h{i}", "f.md") for i in range(3)]
+    results = client.add_notes(notes)
+
+    assert results[0] == 101
+    assert isinstance(results[1], AnkiConnectError)
+    assert "duplicate" in str(results[1])
+    assert results[2] == 103
+
+
+def test_add_notes_falls_back_to_per_note_results_on_request_error():
+    def handler(payload):
+        if payload["action"] == "addNotes":
+            return {"result": None, "error": "['duplicate', None]"}
+        return {
+            "result": [
+                {"result": None, "error": "duplicate"},
+                {"result": 202, "error": None},
+            ],
+            "error": None,
+        }
+
+    client, requests = make_client(handler, batch_size=2)
+    notes = [make_note("Default", f"Q{i}", "A", f"h{i}", "f.md") for i in range(2)]
+    results = client.add_notes(notes)
+
+    assert isinstance(results[0], AnkiConnectError)
+    assert results[1] == 202
+    assert [r["action"] for r in requests] == ["addNotes", "multi"]
+
+
+def test_add_notes_chunks_by_batch_size():
+    def handler(payload):
+        notes = payload["params"]["notes"]
+        return {"result": list(range(len(notes))), "error": None}
+
+    client, requests = make_client(handler, batch_size=2)
+    notes = [make_note("Default", f"Q{i}", "A", f"h{i}", "f.md") for i in range(5)]
+
+    assert len(client.add_notes(notes)) == 5
+    assert [len(r["params"]["notes"]) for r in requests] == [2, 2, 1]
+
+
+def test_iter_notes_info_fetches_in_chunks():
+    def handler(payload):
+        return {
+            "result": [{"noteId": n} for n in payload["params"]["notes"]],
+            "error": None,
+        }
+
+    client, requests = make_client(handler, fetch_size=2)
+    chunks = list(client.iter_notes_info([1, 2, 3, 4, 5]))
+
+    assert chunks == [
+        [{"noteId": 1}, {"noteId": 2}],
+        [{"noteId": 3}, {"noteId": 4}],
+        [{"noteId": 5}],
+    ]
+    assert [r["params"]["notes"] for r in requests] == [[1, 2], [3, 4], [5]]
+
+
+def test_get_cards_info_joins_chunks():
+    def handler(payload):
+        return {
+            "result": [{"cardId": c} for c in payload["params"]["cards"]],
+            "error": None,
+        }
+
+    client, requests = make_client(handler, fetch_size=2)
+
+    assert client.get_cards_info([1, 2, 3]) == [
+        {"cardId": 1},
+        {"cardId": 2},
+        {"cardId": 3},
+    ]
+    assert client.get_cards_info([]) == []
+    assert len(requests) == 2
+
+
+def test_async_iter_notes_info_keeps_order_and_bounds_requests():
+    in_flight = 0
+    peak = 0
+
+    async def handle(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, peak
+        notes = json.loads(request.content)["params"]["notes"]
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # Later chunks answer first
+        await asyncio.sleep(0.01 / notes[0])
+        in_flight -= 1
+        return httpx.Response(
+            200, json={"result": [{"noteId": n} for n in notes], "error": None}
+        )
+
+    async def run() -> list[dict]:
+        client = AsyncAnkiClient(fetch_size=1, max_in_flight=2)
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+        try:
+            return await client.get_notes_info([1, 2, 3, 4, 5])
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) == [{"noteId": n} for n in [1, 2, 3, 4, 5]]
+    assert peak == 2
+
+
+def test_async_multi_sends_chunks_in_order():
+    requests: list[dict] = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        requests.append(payload)
+        actions = payload["params"]["actions"]
+        return httpx.Response(
+            200,
+            json={
+                "result": [{"result": a["params"]["deck"]} for a in actions],
+                "error": None,
+            },
+        )
+
+    async def run() -> list:
+        client = AsyncAnkiClient(batch_size=2)
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+        return await client.multi([("createDeck", {"deck": d}) for d in "abc"])
+
+    assert asyncio.run(run()) == ["a", "b", "c"]
+    assert [len(r["params"]["actions"]) for r in requests] == [2, 1]
+
+
+def test_delete_empty_decks_in_one_pass():
+    decks = ["a", "a::x", "a::x::deep", "a::y", "a::y::deep", "b", "b::z", "c::w"]
+
+    def handler(payload):
+        match payload["action"]:
+            case "findCards":
+                result = [1, 2]
+            case "getDecks":
+                result = {"a::y::deep": [1], "b": [2]}
+            case "deckNames":
+                result = decks
+            case _:
+                result = None
+        return {"result": result, "error": None}
+
+    client, requests = make_client(handler)
+    deleted = client.delete_empty_decks("a", "b")
+
+    assert deleted == ["a::x::deep", "a::x", "b::z"]
+    assert requests[0]["params"]["query"] == 'deck:"a" OR deck:"b"'
+    assert [r["action"] for r in requests] == [
+        "findCards",
+        "getDecks",
+        "deckNames",
+        "deleteDecks",
+    ]
+    assert requests[-1]["params"]["decks"] == deleted
+
+
+def test_metadata_cache_skips_known_decks_and_models():
+    def handler(payload):
+        match payload["action"]:
+            case "deckNames":
+                result = ["Default", "a"]
+            case "multi":
+                replies = {
+                    "modelNames": ["mdanki"],
+                    "modelFieldNames": ["Front", "Back", "SourceHash", "SourceFile"],
+                }
+                result = [
+                    {"result": replies.get(action["action"], 1), "error": None}
+                    for action in payload["params"]["actions"]
+                ]
+            case _:
+                result = None
+        return {"result": result, "error": None}
+
+    client, requests = make_client(handler)
+    client.create_note_type_if_not_exists()
+    client.create_note_type_if_not_exists()
+
+    assert client.create_decks(["a", "b::c"]) == [None, 1]
+    assert client.create_decks(["a", "b", "b::c"]) == [None, None, None]
+    assert client.create_deck("b") is None
+
+    client.multi([("deleteDecks", {"decks": ["b"], "cardsToo": True})])
+    assert client.get_deck_names() == ["Default", "a"]
+    # The note type from before Fingerprint existed gets the field added once
+    assert [r["action"] for r in requests] == [
+        "multi",
+        "modelFieldAdd",
+        "deckNames",
+        "multi",
+        "multi",
+    ]
+    assert requests[1]["params"] == {
+        "modelName": "mdanki",
+        "fieldName": "Fingerprint",
+        "index": 4,
+    }
+
+
+def test_recording_collects_request_stats():
+    client, _ = make_client(lambda payload: {"result": [], "error": None})
+    stats: dict = {}
+
+    client.find_notes("note:mdanki")
+    with client.recording(stats):
+        client.find_notes("note:mdanki")
+        client.find_notes("note:mdanki")
+        client.multi([("createDeck", {"deck": "a"}), ("changeDeck", {"deck": "a"})])
+    client.find_notes("note:mdanki")
+
+    assert set(stats) == {"findNotes", "multi(changeDeck,createDeck)"}
+    find = stats["findNotes"]
+    assert find.calls == 2
+    assert sum(find.histogram) == 2
+    assert find.bytes_sent > 0 and find.bytes_received > 0
+
+
+def test_store_media_files_batches_by_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(anki, "MEDIA_BATCH_BYTES", 10)
+    files = []
+    for name, size in [("a", 4), ("b", 4), ("c", 12), ("d", 1)]:
+        path = tmp_path / name
+        path.write_bytes(b"x" * size)
+        files.append((name, path))
+
+    def handler(payload):
+        actions = payload["params"]["actions"]
+        return {
+            "result": [{"result": a["params"]["filename"]} for a in actions],
+            "error": None,
+        }
+
+    client, requests = make_client(handler)
+
+    assert client.store_media_files(files) == ["a", "b", "c", "d"]
+    assert [
+        [a["params"]["filename"] for a in r["params"]["actions"]] for r in requests
+    ] == [["a", "b"], ["c"], ["d"]]
+    assert requests[0]["params"]["actions"][0]["params"]["data"] == "eHh4eA=="
+
+
+def failing_client(handler, failures, **kwargs):
+    """Client whose first requests raise the exceptions in `failures`."""
+    failures = list(failures)
+
+    def maybe_fail(payload):
+        if failures:
+            raise failures.pop(0)
+        return handler(payload)
+
+    client, requests = make_client(maybe_fail, **kwargs)
+    client.retry_backoff = 0
+    return client, requests
+
+
+def test_retries_connect_errors():
+    client, requests = failing_client(
+        lambda payload: {"result": 6, "error": None},
+        [httpx.ConnectError("refused")] * 2,
+    )
+    stats: dict = {}
+    with client.recording(stats):
+        assert client.get_version() == "6"
+
+    assert len(requests) == 3
+    assert stats["version"].retries == 2
+    assert stats["version"].calls == 1
+
+
+def test_gives_up_after_retries():
+    client, _ = failing_client(
+        lambda payload: {"result": 6, "error": None},
+        [httpx.ConnectError("refused")] * 3,
+        retries=2,
+    )
+    with pytest.raises(httpx.ConnectError):
+        client.get_version()
+
+
+def test_add_notes_is_not_resent_after_timeout():
+    client, requests = failing_client(
+        lambda payload: {"result": [1], "error": None},
+        [httpx.ReadTimeout("slow")],
+    )
+    note = make_note("d", "f", "b", "h", "s.md")
+    with pytest.raises(httpx.ReadTimeout):
+        client.add_notes([note])
+
+    # The first attempt may have reached Anki, so it is not repeated
+    assert len(requests) == 1
+
+
+def test_timed_out_fetch_is_split():
+    def handler(payload):
+        return {"result": [{"noteId": i} for i in payload["params"]["notes"]]}
+
+    client, requests = failing_client(
+        handler, [httpx.ReadTimeout("slow")], fetch_size=4
+    )
+    chunks = list(client.iter_notes_info([1, 2, 3, 4, 5, 6]))
+
+    assert [n["noteId"] for chunk in chunks for n in chunk] == [1, 2, 3, 4, 5, 6]
+    # The timed-out chunk of 4 is sent again as two halves of 2, after which
+    # the chunk size stays halved
+    assert [r["params"]["notes"] for r in requests] == [
+        [1, 2, 3, 4],
+        [1, 2],
+        [3, 4],
+        [5, 6],
+    ]
+
+
+def test_chunk_size_follows_latency():
+    size = anki._ChunkSize(100, target=1.0)
+    size.observe(2.0)
+    assert size.size == 50
+    size.observe(0.7)
+    assert size.size == 50
+    size.observe(0.1)
+    assert size.size == 62
+    for _ in range(10):
+        size.observe(0.1)
+    assert size.size == 100
+    for _ in range(10):
+        size.observe(5.0)
+    assert size.size == 1
+
+
+def test_async_retries_connect_errors():
+    failures = [httpx.ConnectError("refused")]
+    requests: list[dict] = []
+
+    def record(request: httpx.Request) -> httpx.Response:
+        if failures:
+            raise failures.pop()
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json={"result": 6, "error": None})
+
+    async def run():
+        client = AsyncAnkiClient()
+        client.retry_backoff = 0
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(record))
+        return await client.get_version()
+
+    assert asyncio.run(run()) == "6"
+    assert len(requests) == 1
@@ -0,0 +1,54 @@
+import json
+import sqlite3
+import zipfile
+
+from mdanki.apkg import MODEL_ID, deck_id, export_apkg
+from mdanki.render import fingerprint
+from mdanki.state import fingerprint_field
+
+
+def test_export_apkg_writes_mdanki_notes(tmp_path):
+    root = tmp_path / "notes"
+    (root / "python").mkdir(parents=True)
+    (root / "python" / "basics.md").write_text("## Q1\n\nA1\n\n## Q2\n\n**A2**\n")
+    (root / "top.md").write_text("## Q1\n\nDuplicate front\n")
+    output = tmp_path / "out.apkg"
+
+    assert export_apkg(root, output, use_cache=False) == 2
+
+    with zipfile.ZipFile(output) as package:
+        assert json.loads(package.read("media")) == {}
+        (tmp_path / "collection.anki2").write_bytes(package.read("collection.anki2"))
+    conn = sqlite3.connect(tmp_path / "collection.anki2")
+    try:
+        models, decks = conn.execute("SELECT models, decks FROM col").fetchone()
+        notes = conn.execute("SELECT id, guid, mid, flds FROM notes").fetchall()
+        cards = conn.execute("SELECT nid, did FROM cards ORDER BY due").fetchall()
+    finally:
+        conn.close()
+
+    model = json.loads(models)[str(MODEL_ID)]
+    assert model["name"] == "mdanki"
+    assert [f["name"] for f in model["flds"]] == [
+        "Front",
+        "Back",
+        "SourceHash",
+        "SourceFile",
+        "Fingerprint",
+    ]
+    assert {d["name"] for d in json.loads(decks).values()} == {"Default", "python"}
+
+    fields = [flds.split("\x1f") for _, _, _, flds in notes]
+    assert fields[1] == [
+        "<p>Q2</p>\n",
+        "<p><strong>A2</strong></p>\n",
+        notes[1][1],
+        "notes/python/basics.md",
+        fingerprint_field(
+            fingerprint("Q2", "**A2**"),
+            "<p>Q2</p>\n",
+            "<p><strong>A2</strong></p>\n",
+        ),
+    ]
+    assert all(mid == MODEL_ID for _, _, mid, _ in notes)
+    assert cards == [(notes[0][0], deck_id("python")), (notes[1][0], deck_id("python"))]
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import mdanki
+
+SRC = str(Path(mdanki.__file__).parent.parent)
+
+
+def _loaded_after(code: str) -> set[str]:
+    """Top-level packages loaded by running `code` in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-c", f"{code}\nimport sys; print(*sys.modules)"],
+        env={**os.environ, "PYTHONPATH": SRC},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return {name.split(".")[0] for name in result.stdout.split()}
+
+
+def test_cli_import_loads_no_heavy_dependencies():
+    loaded = _loaded_after("import mdanki.cli")
+    assert not loaded & {"httpx", "mistune", "asyncio", "sqlite3"}
+
+
+def test_parse_command_does_not_load_anki_or_renderer(tmp_path):
+    (tmp_path / "a.md").write_text("## Q\n\nA\n")
+    loaded = _loaded_after(
+        "import contextlib, io, sys; from mdanki.cli import main\n"
+        f"sys.argv = ['mdanki', 'parse', '--no-cache', {str(tmp_path)!r}]\n"
+        "with contextlib.redirect_stdout(io.StringIO()): main()"
+    )
+    assert not loaded & {"httpx", "mistune", "asyncio"}
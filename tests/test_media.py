@@ -0,0 +1,53 @@
+from mdanki.media import MEDIA_PREFIX, link_media, media_name
+from mdanki.parser import parse_all
+from mdanki.render import render_many
+from mdanki.state import MediaState
+
+
+def _linked(root, known=None):
+    cards = parse_all(root, use_cache=False)
+    html = render_many([t for c in cards for t in (c.front_raw, c.back_raw)])
+    return link_media(root, cards, html, known or {})
+
+
+def test_media_name_follows_contents():
+    assert media_name(b"png", ".PNG") == media_name(b"png", ".png")
+    assert media_name(b"png", ".png") != media_name(b"gif", ".png")
+    assert media_name(b"png", ".png").startswith(MEDIA_PREFIX)
+
+
+def test_link_media_names_local_images_by_contents(tmp_path):
+    root = tmp_path / "notes"
+    (root / "sub" / "img").mkdir(parents=True)
+    (root / "sub" / "img" / "a b.png").write_bytes(b"same")
+    (root / "copy.png").write_bytes(b"same")
+    (root / "sub" / "deck.md").write_text(
+        "## Q1\n\n![](img/a%20b.png)\n\n## Q2\n\n![](../copy.png) ![](gone.png)\n"
+        "\n## Q3\n\n![](https://example.com/x.png)\n"
+    )
+
+    linked = _linked(root)
+
+    name = media_name(b"same", ".png")
+    assert f'src="{name}"' in linked.html[1]
+    assert f'src="{name}"' in linked.html[3]
+    assert 'src="gone.png"' in linked.html[3]
+    assert 'src="https://example.com/x.png"' in linked.html[5]
+    assert {f.name for f in linked.files.values()} == {name}
+    assert len(linked.files) == 2
+    assert linked.missing == [("notes/sub/deck.md", "gone.png")]
+
+
+def test_link_media_trusts_unchanged_files(tmp_path):
+    root = tmp_path / "notes"
+    root.mkdir()
+    image = root / "a.png"
+    image.write_bytes(b"old")
+    (root / "deck.md").write_text("## Q\n\n![](a.png)\n")
+    stat = image.stat()
+    known = {str(image): MediaState(str(image), stat.st_mtime_ns, 3, "cached.png")}
+
+    assert 'src="cached.png"' in _linked(root, known).html[1]
+
+    image.write_bytes(b"newer")
+    assert media_name(b"newer", ".png") in _linked(root, known).html[1]
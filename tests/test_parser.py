@@ -1,11 +1,18 @@
+import json
+import os
 import tempfile
 from pathlib import Path
 
+from mdanki import parser
 from mdanki.parser import (
     MarkdownCard,
+    ParseCache,
     get_deck_from_path,
-    parse_markdown_file,
+    iter_all,
+    iter_cards,
     parse_all,
+    parse_markdown,
+    parse_markdown_file,
 )
 
 
@@ -91,3 +98,117 @@ def test_parse_all():
         decks = {c.deck for c in cards}
         assert "topic1" in decks
         assert "topic2" in decks
+
+
+def test_parse_all_cache_matches_uncached():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = Path(tmpdir) / "notes"
+        (base / "topic").mkdir(parents=True)
+        (base / "a.md").write_text("## Q1\r\n\r\nA1\r\n\r\n## Q2\n\nA2")
+        (base / "topic" / "b.md").write_text("## Q3\n\nA3")
+
+        expected = parse_all(base)
+        assert parse_all(base, use_cache=True) == expected
+        assert parse_all(base, use_cache=True) == expected
+        assert ParseCache.for_root(base).path.exists()
+
+
+def test_parse_all_cache_reparses_only_changed_files(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = Path(tmpdir) / "notes"
+        base.mkdir()
+        for i in range(3):
+            (base / f"{i}.md").write_text(f"## Q{i}\n\nA{i}")
+        parse_all(base, use_cache=True)
+
+        parsed: list[str] = []
+        original = parser.parse_markdown
+
+        def counting_parse(content, file_path, base_path):
+            parsed.append(file_path.name)
+            return original(content, file_path, base_path)
+
+        monkeypatch.setattr(parser, "parse_markdown", counting_parse)
+
+        (base / "1.md").write_text("## Q1\n\nChanged")
+        cards = parse_all(base, use_cache=True)
+
+        assert parsed == ["1.md"]
+        assert [c.back_raw for c in cards] == ["A0", "Changed", "A2"]
+
+
+def test_parse_all_cache_falls_back_to_content_hash(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = Path(tmpdir) / "notes"
+        base.mkdir()
+        file = base / "a.md"
+        file.write_text("## Q\n\nA")
+        parse_all(base, use_cache=True)
+
+        # Touch without changing the content
+        stat = file.stat()
+        os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        monkeypatch.setattr(parser, "parse_markdown", None)
+
+        assert [c.front_raw for c in parse_all(base, use_cache=True)] == ["Q"]
+
+
+def test_parse_all_cache_evicts_deleted_files():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = Path(tmpdir) / "notes"
+        base.mkdir()
+        (base / "a.md").write_text("## Q1\n\nA1")
+        (base / "b.md").write_text("## Q2\n\nA2")
+        parse_all(base, use_cache=True)
+
+        (base / "b.md").unlink()
+        cards = parse_all(base, use_cache=True)
+
+        assert [c.front_raw for c in cards] == ["Q1"]
+        data = json.loads(ParseCache.for_root(base).path.read_text())
+        assert list(data["files"]) == ["a.md"]
+
+
+def test_parse_all_parallel_matches_serial():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = Path(tmpdir) / "notes"
+        for i in range(6):
+            (base / f"topic{i % 3}").mkdir(parents=True, exist_ok=True)
+            (base / f"topic{i % 3}" / f"{i}.md").write_text(
+                f"## Q{i}a\n\nA{i}a\n\n## Q{i}b\n\nA{i}b"
+            )
+
+        expected = parse_all(base)
+        assert parse_all(base, jobs=3) == expected
+        assert parse_all(base, use_cache=True, jobs=3) == expected
+
+
+def test_iter_cards_streams_same_cards_as_parse_markdown():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = Path(tmpdir)
+        content = (
+            "intro\r\n## \r\n## Q1 \r\n\r\n  A1\r\n### not a card\r\n"
+            "##Q2\r## Q2\r\n\r\n## Q3\n   \n## Q4\nlast"
+        )
+        file = base / "test.md"
+        file.write_bytes(content.encode("utf-8"))
+
+        cards = iter_cards(file, base)
+        assert next(cards).back_raw == "A1\n### not a card\n##Q2"
+        rest = list(cards)
+
+        normalized = content.replace("\r\n", "\n").replace("\r", "\n")
+        expected = parse_markdown(normalized, file, base)
+        assert [c.front_raw for c in expected] == ["Q1", "Q4"]
+        assert [c.front_raw for c in rest] == ["Q4"]
+        assert parse_markdown_file(file, base) == expected
+
+
+def test_iter_all_matches_parse_all():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = Path(tmpdir) / "notes"
+        (base / "b").mkdir(parents=True)
+        (base / "a.md").write_text("## A\n\nanswer\n")
+        (base / "b" / "c.md").write_text("## C\n\nanswer\n## D\n\nanswer\n")
+
+        assert list(iter_all(base)) == parse_all(base)
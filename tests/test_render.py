@@ -1,4 +1,8 @@
-from mdanki.render import render_markdown
+import tempfile
+from pathlib import Path
+
+from mdanki import render
+from mdanki.render import RenderCache, render_many, render_markdown
 
 
 def test_render_plain_text():
@@ -55,3 +59,52 @@ def test_render_mixed_math_and_markdown():
     assert r"\(E=mc^2\)" in result
     assert "<strong>important</strong>" in result
     assert "<code>physics</code>" in result
+
+
+def test_render_many_parallel_matches_serial():
+    texts = [f"Item {i}: $x_{i}$ and **bold** `code`" for i in range(20)]
+    assert (
+        render_many(texts, jobs=3)
+        == render_many(texts)
+        == [render_markdown(t) for t in texts]
+    )
+
+
+def test_render_cache_reuses_html(monkeypatch):
+    cache = RenderCache()
+    texts = ["**a**", "*b*", "**a**"]
+    assert render_many(texts, cache=cache) == [render_markdown(t) for t in texts]
+
+    monkeypatch.setattr(render, "render_markdown", None)
+    assert render_many(["*b*", "**a**"], cache=cache) == [
+        "<p><em>b</em></p>\n",
+        "<p><strong>a</strong></p>\n",
+    ]
+
+
+def test_render_cache_evicts_least_recently_used():
+    cache = RenderCache(maxsize=2)
+    render_many(["a", "b"], cache=cache)
+    render_many(["a"], cache=cache)
+    render_many(["c"], cache=cache)
+
+    keys = [RenderCache.key(t) for t in ("a", "b", "c")]
+    assert set(cache.get_many(keys)) == {keys[0], keys[2]}
+
+
+def test_render_cache_persists_across_runs(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = RenderCache.for_root(Path(tmpdir))
+        expected = render_many(["$x_1$", "`code`"], cache=cache)
+        cache.close()
+
+        monkeypatch.setattr(render, "render_markdown", None)
+        cache = RenderCache.for_root(Path(tmpdir))
+        assert render_many(["$x_1$", "`code`"], cache=cache) == expected
+        cache.close()
+
+
+def test_render_cache_key_depends_on_renderer_version(monkeypatch):
+    before = RenderCache.key("$x$")
+    monkeypatch.setattr(render, "RENDERER_VERSION", "test")
+    assert RenderCache.key("$x$") != before
@@ -0,0 +1,86 @@
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from mdanki.state import MediaState, NoteState, SyncState, fields_digest
+
+
+def make_note(source_hash: str, note_id: int) -> NoteState:
+    return NoteState(
+        source_hash=source_hash,
+        note_id=note_id,
+        card_ids=[note_id + 1],
+        deck="notes::python",
+        source_file="notes/python/basics.md",
+        fields_digest=fields_digest("<p>Q</p>", "<p>A</p>"),
+        mod=1_700_000_000 + note_id,
+    )
+
+
+def test_fields_digest():
+    assert fields_digest("a", "b") == fields_digest("a", "b")
+    assert fields_digest("a", "b") != fields_digest("ab", "")
+    assert len(fields_digest("a", "b")) == 16
+
+
+def test_load_missing_state_is_empty():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        state = SyncState.for_root(Path(tmpdir))
+        assert state.load() == {}
+        assert not state.path.exists()
+
+
+def test_save_and_load_roundtrip():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        state = SyncState.for_root(Path(tmpdir))
+        notes = [make_note("aaaa", 10), make_note("bbbb", 20)]
+        state.save(notes)
+
+        loaded = SyncState.for_root(Path(tmpdir)).load()
+        assert loaded == {"aaaa": notes[0], "bbbb": notes[1]}
+
+
+def test_save_replaces_previous_state():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        state = SyncState.for_root(Path(tmpdir))
+        state.save([make_note("aaaa", 10), make_note("bbbb", 20)])
+        state.save([make_note("bbbb", 20)])
+
+        assert list(state.load()) == ["bbbb"]
+
+
+def test_media_roundtrip():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        state = SyncState.for_root(Path(tmpdir))
+        assert state.load_media() == ({}, set())
+        files = [MediaState("/v/a.png", 1, 2, "mdanki-1.png")]
+        state.update_media(files, ["mdanki-1.png"])
+        state.update_media([], ["mdanki-2.png"])
+
+        assert state.load_media() == (
+            {"/v/a.png": files[0]},
+            {"mdanki-1.png", "mdanki-2.png"},
+        )
+        state.update_media([], ["mdanki-3.png"], clear=True)
+        assert state.load_media()[1] == {"mdanki-3.png"}
+
+
+def test_load_state_written_before_fingerprints():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        state = SyncState.for_root(Path(tmpdir))
+        state.path.parent.mkdir()
+        conn = sqlite3.connect(state.path)
+        with conn:
+            conn.execute(
+                "CREATE TABLE notes (source_hash TEXT PRIMARY KEY, note_id INTEGER,"
+                " card_ids TEXT, deck TEXT, source_file TEXT, fields_digest TEXT)"
+            )
+            conn.execute(
+                "INSERT INTO notes VALUES ('aaaa', 10, '[11]', 'd', 'n/a.md', 'f')"
+            )
+        conn.close()
+
+        loaded = state.load()["aaaa"]
+        assert (loaded.fingerprint, loaded.back_digest, loaded.mod) == ("", "", 0)
+        state.update([make_note("bbbb", 20)])
+        assert len(state.load()) == 2
@@ -1,10 +1,32 @@
+import asyncio
+import json
+import re
 import tempfile
+import time
+from dataclasses import replace
 from pathlib import Path
+from typing import Any
 
+import httpx
 import pytest
 
-from mdanki.anki import AnkiClient
-from mdanki.sync import sync
+from mdanki.anki import NOTE_FIELDS, AnkiClient, AsyncAnkiClient
+from mdanki import sync as sync_module
+from mdanki.media import media_name
+from mdanki.render import fingerprint
+from mdanki.state import SyncState, fingerprint_field
+from mdanki.sync import (
+    SyncStats,
+    async_sync,
+    find_notes_by_hash,
+    get_existing_notes,
+    scope_query,
+    subtree_query,
+    sync,
+    sync_files,
+    sync_roots,
+    sync_subtree,
+)
 
 TEST_DECK_PREFIX = "mdanki-test"
 TEST_DECK = TEST_DECK_PREFIX
@@ -13,11 +35,10 @@ TEST_DECK = TEST_DECK_PREFIX
 @pytest.fixture
 def client():
     try:
-        client = AnkiClient()
-        client.get_version()
-        return client
+        AnkiClient(retries=0).get_version()
     except Exception:
         pytest.skip("Anki is not running or AnkiConnect is not available")
+    return AnkiClient()
 
 
 @pytest.fixture
@@ -40,6 +61,232 @@ def cleanup_test_deck(client):
             client._request("deleteDecks", decks=[deck], cardsToo=True)
 
 
+def test_scope_query():
+    assert scope_query("notes") == 'note:mdanki "SourceFile:notes/*"'
+    assert scope_query('my_"notes"*') == r'note:mdanki "SourceFile:my\_\"notes\"\*/*"'
+    assert scope_query("a", "b") == (
+        'note:mdanki ("SourceFile:a/*" OR "SourceFile:b/*")'
+    )
+
+
+def _fake_anki(
+    notes: dict[int, tuple[str, str]], client_class: type = AnkiClient
+) -> tuple[Any, list[dict]]:
+    """A client backed by notes {id: (source_hash, source_file)}, one card each.
+
+    It keeps the other fields and the deck of the notes it adds, and bumps a
+    note's mod time when its fields are updated."""
+    requests: list[dict] = []
+    contents: dict[int, dict[str, str]] = {}
+    mods: dict[int, int] = {}
+    decks: dict[int, str] = {}
+    deck_names = {"Default"}
+
+    def reply(action: str, params: dict[str, Any]) -> Any:
+        match action:
+            case "findNotes":
+                query = params["query"]
+                result = [
+                    nid
+                    for nid, (h, f) in notes.items()
+                    if f"SourceHash:{h}" in query
+                    or f'"SourceFile:{f}"' in query
+                    or any(
+                        f"SourceFile:{'/'.join(f.split('/')[:i])}/*" in query
+                        for i in range(1, f.count("/") + 1)
+                    )
+                ]
+            case "notesInfo":
+                result = [
+                    {
+                        "noteId": nid,
+                        "cards": [nid * 10],
+                        "mod": mods.get(nid, 1),
+                        "fields": {
+                            **{
+                                name: {"value": value}
+                                for name, value in contents.get(nid, {}).items()
+                            },
+                            "SourceHash": {"value": notes[nid][0]},
+                            "SourceFile": {"value": notes[nid][1]},
+                        },
+                    }
+                    for nid in params["notes"]
+                ]
+            case "cardsInfo":
+                result = [
+                    {"cardId": c, "deckName": decks.get(c // 10, "d")}
+                    for c in params["cards"]
+                ]
+            case "notesModTime":
+                result = [
+                    {"noteId": nid, "mod": mods.get(nid, 1)} for nid in params["notes"]
+                ]
+            case "findCards":
+                prefixes = re.findall(r'deck:"([^"]*)"', params["query"])
+                result = [
+                    nid * 10
+                    for nid, deck in decks.items()
+                    if any(deck == p or deck.startswith(p + "::") for p in prefixes)
+                ]
+            case "createDeck":
+                deck_names.add(params["deck"])
+                result = 1
+            case "deleteDecks":
+                deck_names.difference_update(params["decks"])
+                result = None
+            case "getDecks":
+                result = {}
+                for c in params["cards"]:
+                    result.setdefault(decks.get(c // 10, "d"), []).append(c)
+            case "changeDeck":
+                for c in params["cards"]:
+                    decks[c // 10] = params["deck"]
+                deck_names.add(params["deck"])
+                result = None
+            case "addNotes":
+                result = []
+                for note in params["notes"]:
+                    fields = note["fields"]
+                    nid = max(notes, default=0) + 1
+                    notes[nid] = (fields["SourceHash"], fields["SourceFile"])
+                    contents[nid] = dict(fields)
+                    decks[nid] = note["deckName"]
+                    result.append(nid)
+            case "updateNoteFields":
+                nid, fields = params["note"]["id"], params["note"]["fields"]
+                contents.setdefault(nid, {}).update(fields)
+                notes[nid] = (
+                    fields.get("SourceHash", notes[nid][0]),
+                    fields.get("SourceFile", notes[nid][1]),
+                )
+                mods[nid] = mods.get(nid, 1) + 1
+                result = None
+            case "deleteNotes":
+                for nid in params["notes"]:
+                    del notes[nid]
+                result = None
+            case "multi":
+                result = [
+                    {"result": reply(a["action"], a.get("params", {})), "error": None}
+                    for a in params["actions"]
+                ]
+            case "modelFieldNames":
+                result = NOTE_FIELDS
+            case "deckNames":
+                result = sorted(deck_names)
+            case "modelNames":
+                result = ["mdanki"]
+            case "getMediaFilesNames":
+                result = []
+            case _:
+                result = None
+        return result
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        requests.append(payload)
+        result = reply(payload["action"], payload.get("params", {}))
+        return httpx.Response(200, json={"result": result, "error": None})
+
+    client = client_class()
+    transport = httpx.MockTransport(handle)
+    if client_class is AsyncAnkiClient:
+        client._client = httpx.AsyncClient(transport=transport)
+    else:
+        client._client = httpx.Client(transport=transport)
+    return client, requests
+
+
+def test_get_existing_notes_scoped_to_root():
+    client, requests = _fake_anki({1: ("a", "notes/x.md"), 2: ("b", "other/y.md")})
+
+    existing = get_existing_notes(client, "notes")
+
+    assert list(existing) == ["a"]
+    assert requests[0]["params"]["query"] == scope_query("notes")
+    assert requests[1]["params"]["notes"] == [1]
+
+
+def test_find_notes_by_hash_crosses_roots():
+    client, requests = _fake_anki({1: ("a", "notes/x.md"), 2: ("b", "other/y.md")})
+
+    found = find_notes_by_hash(client, ["b", "missing"])
+
+    assert {h: n.source_file for h, n in found.items()} == {"b": "other/y.md"}
+    assert requests[0]["params"]["query"] == (
+        'note:mdanki ("SourceHash:b" OR "SourceHash:missing")'
+    )
+
+
+def test_async_sync_dry_run_matches_existing_notes(tmp_path):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.md").write_text("## Question\n\nAnswer\n")
+    client, requests = _fake_anki(
+        {1: ("stale", "notes/old.md")}, client_class=AsyncAnkiClient
+    )
+
+    stats = asyncio.run(async_sync(root, client, dry_run=True, delete=True))
+
+    assert (stats.created, stats.deleted, stats.total) == (1, 1, 1)
+    assert requests[0]["params"]["query"] == scope_query("notes")
+
+
+def test_sync_files_pushes_only_changed_files(tmp_path):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.md").write_text("## A\n\nAnswer\n")
+    (root / "b.md").write_text("## B\n\nAnswer\n")
+    client, requests = _fake_anki({})
+    sync(root, client)
+    known = SyncState.for_root(root).load()
+    requests.clear()
+
+    (root / "b.md").unlink()
+    (root / "c.md").write_text("## B\n\nAnswer\n\n## C\n\nAnswer\n")
+    changed = {root / "b.md", root / "c.md"}
+    stats = sync_files(root, client, changed, known, delete=True)
+
+    assert (stats.created, stats.updated, stats.deleted) == (1, 1, 0)
+    assert {n.source_file for n in known.values()} == {"notes/a.md", "notes/c.md"}
+    assert SyncState.for_root(root).load() == known
+    assert stats.requests["addNotes"].calls == 1
+    assert "render" in stats.phases
+    # A hash lookup for the new card, then only writes for the changed files
+    # and reading back their mod times
+    assert [r["action"] for r in requests] == [
+        "findNotes",
+        "addNotes",
+        "notesInfo",
+        "multi",
+        "multi",
+    ]
+
+    (root / "c.md").write_text("## B\n\nAnswer\n")
+    stats = sync_files(root, client, {root / "c.md"}, known, delete=True)
+
+    assert stats.deleted == 1
+    assert len(known) == stats.total == 2
+
+
+def test_sync_files_removes_decks_cards_moved_out_of(tmp_path):
+    root = tmp_path / "notes"
+    (root / "a").mkdir(parents=True)
+    (root / "b").mkdir()
+    (root / "a" / "x.md").write_text("## A\n\nAnswer\n\n## B\n\nAnswer\n")
+    client, requests = _fake_anki({})
+    sync(root, client)
+    known = SyncState.for_root(root).load()
+
+    (root / "a" / "x.md").rename(root / "b" / "x.md")
+    changed = {root / "a" / "x.md", root / "b" / "x.md"}
+    stats = sync_files(root, client, changed, known, delete=True)
+
+    assert stats.moved == 2
+    assert "a" not in client.get_deck_names()
+
+
 def test_sync_creates_new_cards(client, cleanup_test_deck):
     with tempfile.TemporaryDirectory() as tmpdir:
         base = Path(tmpdir)
@@ -281,3 +528,333 @@ Answer.
 
         deck_names = client.get_deck_names()
         assert TEST_DECK not in deck_names
+
+
+def test_sync_stores_shared_media_once(tmp_path):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.png").write_bytes(b"image")
+    (root / "b.png").write_bytes(b"image")
+    (root / "deck.md").write_text("## A\n\n![](a.png)\n\n## B\n\n![](b.png)\n")
+    client, requests = _fake_anki({})
+
+    stats = sync(root, client)
+
+    assert stats.media == 1
+    stored = [
+        action["params"]["filename"]
+        for r in requests
+        if r["action"] == "multi"
+        for action in r["params"]["actions"]
+        if action["action"] == "storeMediaFile"
+    ]
+    assert stored == [media_name(b"image", ".png")]
+
+    requests.clear()
+    assert sync(root, client).media == 0
+    assert "storeMediaFile" not in [a["action"] for a in _multi_actions(requests)]
+
+    requests.clear()
+    # Anki lists none of them, as after its media check removed them
+    assert sync(root, client, full=True).media == 1
+    assert "getMediaFilesNames" in [r["action"] for r in requests]
+
+
+def test_sync_renders_only_cards_whose_fingerprint_changed(tmp_path, monkeypatch):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.md").write_text("## A\n\nAnswer\n\n## B\n\nAnswer\n")
+    client, requests = _fake_anki({})
+    sync(root, client)
+
+    rendered: list[str] = []
+
+    def render_many(texts, *args):
+        rendered.extend(texts)
+        return [f"<p>{text}</p>" for text in texts]
+
+    monkeypatch.setattr(sync_module, "render_many", render_many)
+    (root / "a.md").write_text("## A\n\nNew answer\n\n## B\n\nAnswer\n")
+    stats = sync(root, client)
+
+    assert rendered == ["A", "New answer"]
+    assert stats.updated == 1
+
+
+def test_sync_fetches_existing_notes_while_parsing(tmp_path, monkeypatch):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.md").write_text("## A\n\nAnswer\n")
+    client, requests = _fake_anki({})
+    parse_all = sync_module.parse_all
+    seen_during_parse: list[str] = []
+
+    def slow_parse_all(*args, **kwargs):
+        deadline = time.monotonic() + 5
+        while not any(r["action"] == "findNotes" for r in requests):
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+        seen_during_parse.extend(r["action"] for r in requests)
+        return parse_all(*args, **kwargs)
+
+    monkeypatch.setattr(sync_module, "parse_all", slow_parse_all)
+    stats = sync(root, client)
+
+    assert "findNotes" in seen_during_parse
+    assert stats.created == 1
+
+
+def test_sync_reconciles_notes_changed_in_anki(tmp_path):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.md").write_text("## A\n\nAnswer\n")
+    client, requests = _fake_anki({})
+    sync(root, client)
+    (note,) = SyncState.for_root(root).load().values()
+    requests.clear()
+    assert sync(root, client).updated == 0
+    assert "notesInfo" not in [r["action"] for r in requests]
+    # Reviews change card mod times, so only the decks of the cards are read
+    assert "cardsModTime" not in [a["action"] for a in _multi_actions(requests)]
+
+    def fields() -> dict[str, str]:
+        info = client.get_notes_info([note.note_id])[0]["fields"]
+        return {name: field["value"] for name, field in info.items()}
+
+    edit = {"id": note.note_id, "fields": {"Back": "<p>hacked</p>"}}
+    client.multi([("updateNoteFields", {"note": edit})])
+    assert sync(root, client).updated == 1
+    assert fields()["Back"] == "<p>Answer</p>\n"
+
+    client.multi([("changeDeck", {"cards": note.card_ids, "deck": "elsewhere"})])
+    assert sync(root, client).moved == 1
+    assert client.get_cards_info(note.card_ids)[0]["deckName"] == note.deck
+
+
+def test_sync_restores_fields_edited_in_anki(tmp_path):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.md").write_text("## A\n\nAnswer\n")
+    client, _ = _fake_anki({})
+    sync(root, client)
+    (note_id,) = [n.note_id for n in SyncState.for_root(root).load().values()]
+
+    def back() -> str:
+        return client.get_notes_info([note_id])[0]["fields"]["Back"]["value"]
+
+    for options in [{}, {"full": True, "use_cache": False}]:
+        edit = {"id": note_id, "fields": {"Back": "<p>hacked</p>"}}
+        client.multi([("updateNoteFields", {"note": edit})])
+
+        assert sync(root, client, **options).updated == 1
+        assert back() == "<p>Answer</p>\n"
+
+
+def test_sync_records_missing_fingerprints_without_updating(tmp_path):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.md").write_text("## A\n\nAnswer\n")
+    client, requests = _fake_anki({})
+    sync(root, client)
+    state = SyncState.for_root(root)
+    # As left by a version of mdanki without fingerprints
+    state.save([replace(n, fingerprint="") for n in state.load().values()])
+    requests.clear()
+
+    stats = sync(root, client)
+
+    assert stats.updated == 0
+    (note,) = _update_requests(requests)
+    assert note["fields"] == {
+        "Fingerprint": fingerprint_field(
+            fingerprint("A", "Answer"), "<p>A</p>\n", "<p>Answer</p>\n"
+        )
+    }
+    assert [n.fingerprint for n in state.load().values()] == [
+        fingerprint("A", "Answer")
+    ]
+
+
+def _multi_actions(requests: list[dict]) -> list[dict]:
+    return [
+        action
+        for r in requests
+        if r["action"] == "multi"
+        for action in r["params"]["actions"]
+    ]
+
+
+def _update_requests(requests: list[dict]) -> list[dict]:
+    return [
+        action["params"]["note"]
+        for action in _multi_actions(requests)
+        if action["action"] == "updateNoteFields"
+    ]
+
+
+def test_sync_updates_note_when_front_is_edited(tmp_path):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.md").write_text("## Q1\n\nAnswer one\n\n## Q2\n\nAnswer two\n")
+    client, requests = _fake_anki({})
+    sync(root, client)
+    before = SyncState.for_root(root).load()
+
+    (root / "a.md").write_text("## Question 1\n\nAnswer one\n\n## Q2\n\nAnswer two\n")
+    requests.clear()
+    stats = sync(root, client, delete=True)
+
+    assert (stats.created, stats.updated, stats.deleted) == (0, 1, 0)
+    assert "addNotes" not in [r["action"] for r in requests]
+    [update] = _update_requests(requests)
+    new_hash = update["fields"]["SourceHash"]
+    assert new_hash not in before
+    after = SyncState.for_root(root).load()
+    assert len(after) == 2
+    assert after[new_hash].note_id == update["id"]
+
+
+def _run_async_sync(*args, **kwargs) -> SyncStats:
+    return asyncio.run(async_sync(*args, **kwargs))
+
+
+def test_async_sync_plans_edits_like_sync(tmp_path):
+    results = []
+    for run, client_class in [(sync, AnkiClient), (_run_async_sync, AsyncAnkiClient)]:
+        root = tmp_path / client_class.__name__ / "notes"
+        root.mkdir(parents=True)
+        (root / "a.md").write_text("## Q1\n\nAnswer one\n\n## Q2\n\nAnswer two\n")
+        client, requests = _fake_anki({}, client_class=client_class)
+        run(root, client)
+
+        (root / "a.md").write_text("## Q1 edited\n\nAnswer one\n")
+        requests.clear()
+        stats = run(root, client, delete=True)
+        updates = _update_requests(requests)
+        results.append(((stats.created, stats.updated, stats.deleted), updates))
+
+    assert results[0] == results[1]
+    assert results[0][0] == (0, 1, 1)
+
+
+def test_sync_pairs_edited_cards_only_by_answer(tmp_path):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.md").write_text("## Q1\n\nAnswer one\n\n## Q2\n\nAnswer two\n")
+    (root / "b.md").write_text("## Q3\n\nAnswer three\n")
+    client, requests = _fake_anki({})
+    sync(root, client)
+    ids = sorted(n.note_id for n in SyncState.for_root(root).load().values())
+
+    # Q1 gives way to an unrelated card, and the card in b.md moves to a new
+    # file with a reworded question but the same answer
+    (root / "a.md").write_text(
+        "## Q2\n\nAnswer two\n\n## Totally new question\n\nOther answer\n"
+    )
+    (root / "b.md").unlink()
+    (root / "c.md").write_text("## R3\n\nAnswer three\n")
+    requests.clear()
+    stats = sync(root, client)
+
+    assert (stats.created, stats.updated, stats.deleted) == (1, 1, 0)
+    assert [n["id"] for n in _update_requests(requests)] == [ids[2]]
+    # Q1's note is kept as it was
+    state = SyncState.for_root(root).load()
+    assert set(ids) <= {n.note_id for n in state.values()}
+
+
+def test_sync_roots_shares_one_snapshot_and_keeps_moved_cards(tmp_path):
+    a, b = tmp_path / "a", tmp_path / "b"
+    a.mkdir()
+    b.mkdir()
+    (a / "x.md").write_text("## Moves\n\nAnswer\n\n## Stays\n\nAnswer\n")
+    (b / "y.md").write_text("## B\n\nAnswer\n")
+    client, requests = _fake_anki({})
+    stats = sync_roots([a, b], client, delete=True)
+    assert (stats.created, stats.total) == (3, 3)
+
+    (a / "x.md").write_text("## Stays\n\nAnswer\n")
+    (b / "y.md").write_text("## B\n\nAnswer\n\n## Moves\n\nAnswer\n")
+    requests.clear()
+    stats = sync_roots([a, b], client, delete=True)
+
+    assert (stats.created, stats.updated, stats.deleted) == (0, 1, 0)
+    assert stats.total == 3
+    # One search covers both roots, trusted against their combined state
+    (search,) = [a for a in _multi_actions(requests) if a["action"] == "findNotes"]
+    assert search["params"]["query"] == scope_query("a", "b")
+    assert "findNotes" not in [r["action"] for r in requests]
+    assert {n.source_file for n in SyncState.for_root(a).load().values()} == {"a/x.md"}
+    assert {n.source_file for n in SyncState.for_root(b).load().values()} == {"b/y.md"}
+
+
+def test_sync_roots_rejects_roots_with_the_same_name(tmp_path):
+    with pytest.raises(ValueError):
+        sync_roots([tmp_path / "x" / "notes", tmp_path / "y" / "notes"], None)
+
+
+def test_sync_subtree_reads_and_deletes_only_inside_it(tmp_path):
+    root = tmp_path / "notes"
+    (root / "sub").mkdir(parents=True)
+    (root / "a.md").write_text("## A\n\nAnswer\n\n## Gone\n\nAnswer\n")
+    (root / "sub" / "b.md").write_text("## B\n\nAnswer\n\n## Old\n\nAnswer\n")
+    client, requests = _fake_anki({})
+    sync(root, client)
+
+    (root / "a.md").write_text("## A\n\nAnswer\n")
+    (root / "sub" / "b.md").write_text("## B\n\nAnswer\n")
+    (root / "sub" / "c.md").write_text("## New\n\nOther answer\n")
+    requests.clear()
+    stats = sync_subtree(root, client, [root / "sub"], delete=True)
+
+    assert (stats.created, stats.deleted) == (1, 1)
+    queries = [r["params"]["query"] for r in requests if r["action"] == "findNotes"]
+    assert queries[0] == subtree_query("notes/sub")
+    notes_info = [r for r in requests if r["action"] == "notesInfo"]
+    # The two notes under sub/, then the new one
+    assert [len(r["params"]["notes"]) for r in notes_info] == [2, 1]
+    # "Gone" in a.md is outside the subtree, so it stays in Anki and the state
+    state = SyncState.for_root(root).load()
+    assert sorted(n.source_file for n in state.values()) == [
+        "notes/a.md",
+        "notes/a.md",
+        "notes/sub/b.md",
+        "notes/sub/c.md",
+    ]
+
+
+def test_sync_subtree_deletes_notes_of_a_deleted_file(tmp_path):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.md").write_text("## A\n\nAnswer\n")
+    (root / "x.md").write_text("## X\n\nOther answer\n")
+    client, _ = _fake_anki({})
+    sync(root, client)
+
+    (root / "x.md").unlink()
+    stats = sync_subtree(root, client, [root / "x.md"], delete=True)
+
+    assert stats.deleted == 1
+    state = SyncState.for_root(root).load()
+    assert [n.source_file for n in state.values()] == ["notes/a.md"]
+
+
+def test_sync_names_deleted_notes_by_source_hash(tmp_path, capsys):
+    root = tmp_path / "notes"
+    root.mkdir()
+    (root / "a.md").write_text("## A\n\nAnswer\n\n## Gone\n\nOther answer\n")
+    client, _ = _fake_anki({})
+    sync(root, client)
+    before = set(SyncState.for_root(root).load())
+
+    (root / "a.md").write_text("## A\n\nAnswer\n")
+    sync(root, client, verbose=True, delete=True)
+
+    (gone,) = before - set(SyncState.for_root(root).load())
+    assert f"Deleting: notes/a.md ({gone})" in capsys.readouterr().out
+
+
+def test_sync_subtree_rejects_paths_outside_the_root(tmp_path):
+    with pytest.raises(ValueError):
+        sync_subtree(tmp_path / "notes", None, [tmp_path / "other"])
@@ -0,0 +1,35 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from mdanki.watch import poll_changes, watch_changes
+
+
+def test_poll_changes_batches_a_burst(tmp_path):
+    (tmp_path / "a.md").write_text("## A\n\nAnswer\n")
+    changes = poll_changes(tmp_path, debounce=0.05, interval=0.05)
+
+    def edit() -> None:
+        time.sleep(0.1)
+        (tmp_path / "a.md").unlink()
+        (tmp_path / "b.md").write_text("## B\n\nAnswer\n")
+        (tmp_path / "notes.txt").write_text("ignored")
+
+    threading.Thread(target=edit).start()
+    assert next(changes) == {tmp_path / "a.md", tmp_path / "b.md"}
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="needs inotify")
+def test_watch_changes_reports_new_directories(tmp_path):
+    (tmp_path / ".mdanki").mkdir()
+    changes = watch_changes(tmp_path, debounce=0.05)
+
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    (tmp_path / ".mdanki" / "state.sqlite3").write_text("")
+    assert next(changes) == {sub}
+
+    (sub / "a.md").write_text("## A\n\nAnswer\n")
+    assert next(changes) == {sub / "a.md"}